@@ -0,0 +1,9 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Micro-benchmarks for Shanghai, run as modules from the repository root.
+
+Example:
+    python -m benchmarks.framing
+
+"""
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Traffic used as input by the benchmarks.
+
+Notes:
+    Recorded traffic can be supplied as a file of raw CRLF delimited lines or
+    a recording written with record_path, otherwise a synthetic mix of the
+    bursts seen in busy channels is built.
+
+"""
+
+import random
+from typing import List, Optional
+
+from shanghai import recording
+
+
+def synthetic_lines(count: int, *, seed: int = 1459) -> List[bytes]:
+    """Build a reproducible mix of server traffic.
+
+    Args:
+        count: Number of lines to generate
+        seed:  Seed for the random generator, for reproducible runs
+
+    Returns:
+        Raw lines without CRLF, mixing NAMES bursts, netsplit QUITs,
+        channel messages with links, CTCP, tagged messages and numerics
+
+    """
+    rng = random.Random(seed)
+    nicks = [f"user{i}" for i in range(200)] + ["ユーザー", "Müller"]
+    templates = [
+        lambda n: f":irc.example.net 353 shang = #chan :{' '.join(rng.sample(nicks, 30))}",
+        lambda n: f":{n}!~{n}@gateway/web/{n} QUIT :*.net *.split",
+        lambda n: f":{n}!~{n}@host.example.com PRIVMSG #chan :look https://example.com/{rng.randrange(10**6)} ok",
+        lambda n: f":{n}!~{n}@host.example.com PRIVMSG #chan :just some chatter, nothing much 433 at all",
+        lambda n: f":{n}!~{n}@host.example.com PRIVMSG #chan :\x01ACTION waves at ☃ everyone\x01",
+        lambda n: f"@time=2020-02-10T12:00:00.000Z;account={n} :{n}!~{n}@host PRIVMSG #chan :tagged hello",
+        lambda n: f":irc.example.net 433 * {n} :Nickname is already in use",
+        lambda n: "PING :irc.example.net",
+    ]
+    return [rng.choice(templates)(rng.choice(nicks)).encode("utf-8") for _ in range(count)]
+
+
+def load_lines(path: Optional[str], count: int) -> List[bytes]:
+    """Load recorded lines from a file, or build synthetic ones.
+
+    Args:
+        path:  File of raw CRLF delimited lines or a recording, or None for
+               synthetic traffic
+        count: Number of synthetic lines to build when no file is given
+
+    Returns:
+        Raw lines without CRLF
+
+    """
+    if path is None:
+        return synthetic_lines(count)
+    with open(path, "rb") as traffic:
+        stream = traffic.read()
+    if stream.startswith(recording.MAGIC):
+        stream = b"".join(data for _, data in recording.read(path))
+    return [line for line in stream.split(b"\r\n") if line]
+
+
+def chunked(lines: List[bytes], size: int = 4096) -> List[bytes]:
+    """Join lines into a stream and cut it into receive sized chunks.
+
+    Args:
+        lines: Raw lines without CRLF
+        size:  Size of each chunk, matching the socket receive size
+
+    Returns:
+        The stream as a list of chunks, split with no regard for line ends
+
+    """
+    stream = b"".join(line + b"\r\n" for line in lines)
+    return [stream[i : i + size] for i in range(0, len(stream), size)]
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Run the whole bot against a fake IRC server and HTTP origin.
+
+Usage:
+    python -m benchmarks.endtoend [--messages N] [--rate R] [--links 0.05]
+                                  [--mix html=80,binary=10,slow=5,error=5]
+                                  [--sync] [--json] [--record FILE]
+
+Notes:
+    Everything runs in this process on loopback, so no network is needed.
+    The fake server registers the bot, refusing its first nick, then sends
+    --messages channel messages, --links of them carrying a link to the fake
+    origin. The traffic is the same for the same --seed.
+
+    Reported are:
+
+        msgs/s:  Messages sent over the time from the first being sent to the
+                 bot answering a PING sent after the last
+        latency: Link to reply p50 and p99, overall and by kind of link,
+                 with how many links got no reply before --drain ran out
+        cpu:     Process CPU time, and the bot's own thread alone when run
+                 with asyncio, as the fakes share the process
+        rss:     Peak resident memory of the process
+
+    The bot gets a throwaway config: no cache, so every link is fetched, a
+    --flood-rate high enough not to hold replies back, and a failure
+    threshold the error links cannot trip. The bot logs at --log-level to
+    --log, discarded by default, as its own config logs INFO to a file.
+
+"""
+
+import argparse
+import asyncio
+import configparser
+import json
+import logging
+import os
+import resource
+import statistics
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+
+from shanghai import shanghai
+
+from .fakes import KINDS, FakeIRCServer, FakeOrigin
+
+
+def write_configs(directory: str, args: argparse.Namespace, port: int) -> Dict[str, str]:
+    """Write the bot's configs for a run against the fake server, returning their paths."""
+    config = configparser.ConfigParser()
+    config["DEFAULT"] = {
+        "owner": "",
+        "nick": "bench",
+        "alt_nicks": "bench_",
+        "realname": "Shanghai bench",
+        "password": "",
+        "prefix": ",",
+        "server": "127.0.0.1",
+        "port": str(port),
+        "ssl": "no",
+        "asyncio": "no" if args.sync else "yes",
+        "flood_rate": str(args.flood_rate),
+        "flood_burst": str(args.flood_rate),
+        "scrape_workers": str(args.workers),
+        "scrape_queue": str(args.messages),
+        "scrape_per_channel": str(args.workers),
+        "failure_threshold": str(args.messages + 1),
+        "negative_ttl": "0",
+        "cache_path": "",
+        "profile_dir": directory,
+        "record_path": args.record or "",
+    }
+    paths = {name: os.path.join(directory, f"{name}.ini") for name in ("shanghai", "commands", "apis")}
+    with open(paths["shanghai"], "w") as conffile:
+        config.write(conffile)
+    for name in ("commands", "apis"):
+        with open(paths[name], "w") as conffile:
+            configparser.ConfigParser().write(conffile)
+    return paths
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """Parse kind=weight pairs, such as html=70,binary=10."""
+    mix = {}
+    for pair in text.split(","):
+        kind, _, weight = pair.partition("=")
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"Unknown kind of link {kind}, expected one of {', '.join(KINDS)}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def percentile(values: List[float], share: float) -> float:
+    """Return the value below which the given share of values fall, nearest rank."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def run_bot(paths: Dict[str, str], server: FakeIRCServer, sync: bool) -> float:
+    """Run a bot until the server is done with it, returning the bot thread's CPU time."""
+    if sync:
+        bot = shanghai.Bot(paths["shanghai"], paths["commands"], paths["apis"])
+        thread = threading.Thread(target=bot.run, name="bench-bot", daemon=True)
+        thread.start()
+        server.done.wait()
+        bot.stopped = True
+        server.hang_up()
+        thread.join()
+        bot.resources.stop()
+        return 0.0
+
+    async def session() -> float:
+        bot = shanghai.Bot(paths["shanghai"], paths["commands"], paths["apis"])
+        started = time.thread_time()
+        task = asyncio.ensure_future(bot.run_async())
+        await asyncio.get_running_loop().run_in_executor(None, server.done.wait)
+        bot.stopped = True
+        server.hang_up()
+        await task
+        return time.thread_time() - started
+
+    return asyncio.run(session())
+
+
+def report(server: FakeIRCServer, origin: FakeOrigin, cpu: float, bot_cpu: float, wall: float) -> Dict[str, Any]:
+    """Collect the figures of a finished run."""
+    handled = server.flood_handled - server.flood_started if server.flood_handled else float("nan")
+    latencies = [value for values in server.latencies.values() for value in values]
+    result: Dict[str, Any] = {
+        "messages": server.messages,
+        "msgs_per_sec": server.messages / handled,
+        "links": len(server.sent_links),
+        "unanswered": len(server.sent_links) - len(latencies),
+        "origin_requests": origin.requests,
+        "nicks_tried": server.nicks,
+        "wall_seconds": wall,
+        "cpu_seconds": cpu,
+        "bot_cpu_seconds": bot_cpu or None,
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "latency": {},
+    }
+    for kind, values in [("all", latencies)] + sorted(server.latencies.items()):
+        if values:
+            result["latency"][kind] = {
+                "count": len(values),
+                "p50": percentile(values, 0.5),
+                "p99": percentile(values, 0.99),
+                "mean": statistics.mean(values),
+            }
+    return result
+
+
+def main() -> None:
+    """Run the end to end benchmark."""
+    parser_ = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser_.add_argument("--messages", type=int, default=20_000, help="channel messages to send")
+    parser_.add_argument("--rate", type=float, default=0, help="messages per second, 0 for as fast as possible")
+    parser_.add_argument("--links", type=float, default=0.05, help="share of messages carrying a link")
+    parser_.add_argument("--mix", type=parse_mix, default="html=80,binary=10,slow=5,error=5", help="link kinds")
+    parser_.add_argument("--channels", type=int, default=4, help="channels to spread messages across")
+    parser_.add_argument("--page-bytes", type=int, default=16 * 1024, help="size of HTML pages")
+    parser_.add_argument("--binary-bytes", type=int, default=8 * 1024 * 1024, help="size of binaries")
+    parser_.add_argument("--slow-delay", type=float, default=0.3, help="seconds slow links take")
+    parser_.add_argument("--workers", type=int, default=4, help="scrape workers")
+    parser_.add_argument("--flood-rate", type=int, default=1000, help="bot's output lines per second")
+    parser_.add_argument("--drain", type=float, default=30, help="seconds to wait for the last replies")
+    parser_.add_argument("--seed", type=int, default=1459, help="seed for the traffic")
+    parser_.add_argument("--sync", action="store_true", help="run the blocking loop instead of asyncio")
+    parser_.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser_.add_argument("--record", help="record the traffic the bot receives, for benchmarks.replay")
+    parser_.add_argument("--log", default=os.devnull, help="file the bot logs to")
+    parser_.add_argument("--log-level", default="INFO", help="bot logging level")
+    args = parser_.parse_args()
+    logging.basicConfig(
+        filename=args.log, level=args.log_level, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+
+    origin = FakeOrigin(page_bytes=args.page_bytes, binary_bytes=args.binary_bytes, slow_delay=args.slow_delay)
+    origin.start()
+    server = FakeIRCServer(
+        origin,
+        messages=args.messages,
+        rate=args.rate,
+        link_share=args.links,
+        mix=args.mix,
+        channels=args.channels,
+        seed=args.seed,
+        drain=args.drain,
+    )
+    server.start()
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_configs(directory, args, server.port)
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.perf_counter()
+        bot_cpu = run_bot(paths, server, args.sync)
+        wall = time.perf_counter() - start
+        after = resource.getrusage(resource.RUSAGE_SELF)
+    server.stop()
+    origin.stop()
+    cpu = after.ru_utime - usage.ru_utime + after.ru_stime - usage.ru_stime
+    result = report(server, origin, cpu, bot_cpu, wall)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"{result['messages']:,} messages at {result['msgs_per_sec']:,.0f} msgs/s")
+    print(f"{result['links']:,} links, {result['unanswered']} unanswered, {result['origin_requests']:,} fetches")
+    for kind, figures in result["latency"].items():
+        print(
+            f"{kind:>7}: p50 {figures['p50'] * 1000:8.1f}ms  p99 {figures['p99'] * 1000:8.1f}ms"
+            f"  over {figures['count']:,}"
+        )
+    bot_cpu_text = f", {bot_cpu:.2f}s in the bot's thread" if bot_cpu else ""
+    print(f"cpu {cpu:.2f}s over {wall:.2f}s{bot_cpu_text}, peak rss {result['peak_rss_mib']:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Fake IRC server and HTTP origin for running the bot entirely offline.
+
+Notes:
+    Both run in background threads of the calling process and listen on
+    loopback ports picked by the OS. Every link the IRC server sends carries
+    an id that comes back in the bot's reply, in the page title, in the
+    Content-Type of binaries, or in the error naming the link, so replies can
+    be matched to links whatever order they arrive in.
+
+"""
+
+import asyncio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import random
+import re
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+KINDS = ("html", "binary", "slow", "error")
+"""Kinds of link the origin serves."""
+
+_REPLY_ID = re.compile(r"(?:Bench page |x-bench-|/(?:html|binary|slow|error)/)(\d+)")
+
+
+class _QuietServer(ThreadingHTTPServer):
+    """HTTP server that expects clients to drop connections, as the bot does once it has what it needs."""
+
+    daemon_threads = True
+
+    def handle_error(self, request: Any, client_address: Any) -> None:
+        """Ignore connections reset by the client, report anything else."""
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeOrigin:
+    """HTTP server answering /html, /binary, /slow and /error links."""
+
+    def __init__(self, *, page_bytes: int = 16 * 1024, binary_bytes: int = 8 * 1024 * 1024, slow_delay: float = 0.3):
+        """Initialize origin, call start to begin serving.
+
+        Args:
+            page_bytes:   Size of each HTML page, the title comes first
+            binary_bytes: Size reported and served for binaries
+            slow_delay:   Seconds slow links wait before answering
+
+        """
+        self.page_bytes = page_bytes
+        self.binary_bytes = binary_bytes
+        self.slow_delay = slow_delay
+        self.requests = 0
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def port(self) -> int:
+        """Port the origin is listening on."""
+        assert self._server is not None
+        return self._server.server_address[1]
+
+    def start(self) -> None:
+        """Start serving in a background thread."""
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_HEAD(self) -> None:
+                origin.answer(self, body=False)
+
+            def do_GET(self) -> None:
+                origin.answer(self, body=True)
+
+            def log_message(self, format: str, *args: object) -> None:
+                pass
+
+        self._server = _QuietServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, name="fake-origin", daemon=True).start()
+
+    def stop(self) -> None:
+        """Stop serving."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def answer(self, handler: BaseHTTPRequestHandler, *, body: bool) -> None:
+        """Answer a request for one of the origin's links."""
+        self.requests += 1
+        _, kind, ident = (handler.path.split("?")[0].split("/") + ["", ""])[:3]
+        ident = ident.split(".")[0]
+        if kind == "error" or kind not in KINDS:
+            status, ctype, data = (500 if kind == "error" else 404), "text/plain", b"nope"
+        elif kind == "binary":
+            # The id rides in the media type, the only part of a binary the bot repeats
+            status, ctype, data = 200, f"application/x-bench-{ident}", b""
+        else:
+            if kind == "slow":
+                time.sleep(self.slow_delay)
+            head = f"<!doctype html><html><head><title>Bench page {ident}</title></head><body>"
+            filler = "<p>" + "lorem ipsum " * 40 + "</p>\n"
+            page = head + filler * max(0, (self.page_bytes - len(head)) // len(filler)) + "</body></html>"
+            status, ctype, data = 200, "text/html; charset=utf-8", page.encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", ctype)
+        if kind == "binary":
+            handler.send_header("Content-Length", str(self.binary_bytes))
+            handler.send_header("Accept-Ranges", "bytes")
+        else:
+            handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        if not body:
+            return
+        if kind == "binary":
+            chunk = bytes(64 * 1024)
+            try:
+                for _ in range(self.binary_bytes // len(chunk)):
+                    handler.wfile.write(chunk)
+            except ConnectionError:
+                handler.close_connection = True
+            return
+        handler.wfile.write(data)
+
+
+class FakeIRCServer:
+    """IRC server that registers one client then floods it with channel messages."""
+
+    def __init__(
+        self,
+        origin: FakeOrigin,
+        *,
+        messages: int = 10000,
+        rate: float = 0.0,
+        link_share: float = 0.05,
+        mix: Optional[Dict[str, float]] = None,
+        channels: int = 4,
+        seed: int = 1459,
+        drain: float = 10.0,
+    ):
+        """Initialize server, call start to begin listening.
+
+        Args:
+            origin:     The origin links point to
+            messages:   Channel messages to send after registration
+            rate:       Messages per second, 0 to send as fast as the client reads
+            link_share: Fraction of messages that carry a link
+            mix:        Weights of each kind of link, html only if not given
+            channels:   Channels the messages are spread across
+            seed:       Seed for the traffic, for reproducible runs
+            drain:      Seconds to wait for outstanding link replies at the end
+
+        """
+        self.origin = origin
+        self.messages = messages
+        self.rate = rate
+        self.link_share = link_share
+        self.mix = mix or {"html": 1.0}
+        self.channels = [f"#bench{i}" for i in range(channels)]
+        self.seed = seed
+        self.drain = drain
+        self.port = 0
+        self.nicks: List[str] = []
+        self.sent_links: Dict[int, Tuple[str, float]] = {}
+        self.latencies: Dict[str, List[float]] = {kind: [] for kind in KINDS}
+        self.flood_started = 0.0
+        self.flood_handled = 0.0
+        self.done = threading.Event()
+        self._ready = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._hangup: Optional[asyncio.Event] = None
+
+    def start(self) -> None:
+        """Start the server's event loop in a background thread and wait until it listens."""
+        threading.Thread(target=self._run, name="fake-irc", daemon=True).start()
+        self._ready.wait()
+
+    def _run(self) -> None:
+        """Run the server's event loop."""
+        self._loop = asyncio.new_event_loop()
+        self._hangup = asyncio.Event()
+        server = self._loop.run_until_complete(asyncio.start_server(self._client, "127.0.0.1", 0))
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Register the client, flood it, and collect its replies."""
+        nick = await self._register(reader, writer)
+        if nick is None:
+            return
+        replies = asyncio.ensure_future(self._replies(reader))
+        await self._flood(writer, nick)
+        try:
+            await asyncio.wait_for(replies, self.drain)
+        except asyncio.TimeoutError:
+            pass
+        self.done.set()
+        # Stay connected until told to hang up, so the bot can be stopped first and not reconnect
+        assert self._hangup is not None
+        await self._hangup.wait()
+        writer.close()
+
+    async def _register(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> Optional[str]:
+        """Answer CAP negotiation, refuse the first nick with 433, then welcome the client."""
+        nick = ""
+        user = False
+        while not (nick and user):
+            raw = await reader.readline()
+            if not raw:
+                return None
+            command, *params = raw.decode("utf-8", "replace").rstrip("\r\n").split(" ")
+            if command == "CAP" and params[:1] == ["LS"]:
+                writer.write(b":fake.server CAP * LS :message-tags multi-prefix\r\n")
+            elif command == "CAP" and params[:1] == ["REQ"]:
+                writer.write(f":fake.server CAP * ACK {' '.join(params[1:])}\r\n".encode("utf-8"))
+            elif command == "NICK":
+                self.nicks.append(params[0])
+                if len(self.nicks) == 1:
+                    writer.write(f":fake.server 433 * {params[0]} :Nickname is already in use\r\n".encode("utf-8"))
+                else:
+                    nick = params[0]
+            elif command == "USER":
+                user = True
+        writer.write(
+            f":fake.server 001 {nick} :Welcome to the bench network\r\n"
+            f":fake.server 376 {nick} :End of /MOTD command.\r\n".encode("utf-8")
+        )
+        await writer.drain()
+        return nick
+
+    async def _flood(self, writer: asyncio.StreamWriter, nick: str) -> None:
+        """Send the channel messages, pacing them if a rate was given, then a PING marking the end."""
+        rng = random.Random(self.seed)
+        kinds = list(self.mix)
+        weights = [self.mix[kind] for kind in kinds]
+        base = f"http://127.0.0.1:{self.origin.port}"
+        self.flood_started = time.perf_counter()
+        batch: List[str] = []
+        for i in range(self.messages):
+            channel = self.channels[i % len(self.channels)]
+            sender = f"user{rng.randrange(500)}"
+            if rng.random() < self.link_share:
+                kind = rng.choices(kinds, weights)[0]
+                suffix = ".bin" if kind == "binary" else ""
+                text = f"look at this {base}/{kind}/{i}{suffix} neat"
+                self.sent_links[i] = (kind, time.perf_counter())
+            else:
+                text = f"just chatting about nothing in particular, message number {i}"
+            batch.append(f":{sender}!~{sender}@bench.example.com PRIVMSG {channel} :{text}\r\n")
+            if self.rate:
+                writer.write(batch.pop().encode("utf-8"))
+                await writer.drain()
+                await asyncio.sleep(max(0.0, self.flood_started + (i + 1) / self.rate - time.perf_counter()))
+            elif len(batch) >= 64:
+                writer.write("".join(batch).encode("utf-8"))
+                batch.clear()
+                await writer.drain()
+        writer.write(("".join(batch) + "PING :flood-done\r\n").encode("utf-8"))
+        await writer.drain()
+
+    async def _replies(self, reader: asyncio.StreamReader) -> None:
+        """Time link replies until every link is answered or the connection closes."""
+        answered = set()
+        while len(answered) < len(self.sent_links) or not self.flood_handled:
+            raw = await reader.readline()
+            if not raw:
+                return
+            line = raw.decode("utf-8", "replace")
+            if line.startswith("PONG") and "flood-done" in line:
+                self.flood_handled = time.perf_counter()
+                continue
+            if not line.startswith("PRIVMSG"):
+                continue
+            match = _REPLY_ID.search(line)
+            if match is None or int(match.group(1)) in answered:
+                continue
+            ident = int(match.group(1))
+            link = self.sent_links.get(ident)
+            if link is not None:
+                answered.add(ident)
+                self.latencies[link[0]].append(time.perf_counter() - link[1])
+
+    def hang_up(self) -> None:
+        """Close the connection to the client once it is done with, safe to call from any thread."""
+        if self._loop is not None and self._hangup is not None:
+            self._loop.call_soon_threadsafe(self._hangup.set)
+
+    def stop(self) -> None:
+        """Stop the server's event loop."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Compare the byte level line framer against the old string cache framing.
+
+Usage:
+    python -m benchmarks.framing [--lines N] [--file RECORDING]
+
+"""
+
+import argparse
+import time
+from typing import Callable, List
+
+from shanghai.buffers import LineFramer
+
+from .corpus import chunked, load_lines
+
+
+def legacy_frame(chunks: List[bytes]) -> int:
+    """Frame chunks the way ShangSock.receive originally did.
+
+    Args:
+        chunks: Received data
+
+    Returns:
+        Number of messages framed
+
+    """
+    cache: List[str] = []
+    count = 0
+    for data in chunks:
+        cache = ["".join(cache) + bytes.decode(data, encoding="utf-8", errors="replace")]
+        while True:
+            message = "".join(cache).partition("\r\n")
+            if not message[1]:
+                break
+            cache = [message[2]]
+            count += 1
+    return count
+
+
+def framer_frame(chunks: List[bytes]) -> int:
+    """Frame chunks with LineFramer.
+
+    Args:
+        chunks: Received data
+
+    Returns:
+        Number of messages framed
+
+    """
+    framer = LineFramer()
+    return sum(len(framer.feed(data)) for data in chunks)
+
+
+def measure(name: str, func: Callable[[List[bytes]], int], chunks: List[bytes], repeat: int) -> None:
+    """Time a framing function and print its throughput."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = func(chunks)
+        best = min(best, time.perf_counter() - start)
+    total = sum(len(data) for data in chunks)
+    print(f"{name:>8}: {count} lines in {best:.4f}s, {count / best:,.0f} lines/s, {total / best / 2**20:.1f} MiB/s")
+
+
+def main() -> None:
+    """Run the framing benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=200_000, help="synthetic lines to generate")
+    parser.add_argument("--file", help="recorded traffic, raw CRLF delimited lines")
+    parser.add_argument("--chunk", type=int, default=4096, help="bytes per simulated receive")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    chunks = chunked(load_lines(args.file, args.lines), args.chunk)
+    measure("legacy", legacy_frame, chunks, args.repeat)
+    measure("framer", framer_frame, chunks, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
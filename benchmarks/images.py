@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Compare bytes transferred by header sniffing against full image downloads.
+
+Usage:
+    python -m benchmarks.images [--images DIR]
+
+Notes:
+    DIR should hold image files, without one synthetic images are built with
+    realistic headers (including a large EXIF block in the JPEG) and bodies.
+
+"""
+
+import argparse
+import glob
+import os
+import struct
+import time
+from typing import Callable, List, Tuple
+import zlib
+
+from shanghai.imagemeta import probe_image
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    """Build a PNG chunk with its CRC."""
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def synthetic_images() -> List[Tuple[str, bytes]]:
+    """Build images in each supported format, padded out to typical sizes."""
+    body = os.urandom(1024) * 1024
+    png = b"\x89PNG\r\n\x1a\n" + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", 1920, 1080, 8, 6, 0, 0, 0))
+    png += _png_chunk(b"acTL", struct.pack(">II", 24, 0)) + _png_chunk(b"IDAT", body * 2)
+    gif = b"GIF89a" + struct.pack("<HH", 480, 270) + b"\xf7\x00\x00" + b"\x00" * 768
+    gif += b"!\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00" + body
+    exif = b"Exif\x00\x00" + os.urandom(60000)
+    jpeg = b"\xff\xd8" + b"\xff\xe1" + struct.pack(">H", len(exif) + 2) + exif
+    jpeg += b"\xff\xc0\x00\x11\x08" + struct.pack(">HH", 3024, 4032) + b"\x03" + b"\x00" * 9 + body * 3
+    vp8x = b"VP8X" + struct.pack("<I", 10) + b"\x02\x00\x00\x00"
+    vp8x += (1279).to_bytes(3, "little") + (719).to_bytes(3, "little")
+    webp = b"RIFF" + struct.pack("<I", len(vp8x) + len(body) + 4) + b"WEBP" + vp8x + body
+    ispe = struct.pack(">I", 20) + b"ispe" + b"\x00" * 4 + struct.pack(">II", 3840, 2160)
+    avif = struct.pack(">I", 24) + b"ftypavif\x00\x00\x00\x00avifmif1" + b"meta" + ispe + body
+    return [("png", png), ("gif", gif), ("jpeg", jpeg), ("webp", webp), ("avif", avif)]
+
+
+def load_images(directory: str) -> List[Tuple[str, bytes]]:
+    """Load every file in a directory."""
+    images = []
+    for path in sorted(glob.glob(os.path.join(directory, "*"))):
+        with open(path, "rb") as image:
+            images.append((os.path.basename(path), image.read()))
+    return images
+
+
+def ranged_reader(image: bytes) -> Callable[[int, int], bytes]:
+    """Serve reads from an in-memory file as ranged GETs would."""
+    return lambda offset, length: image[offset : offset + length]
+
+
+def main() -> None:
+    """Run the image sniffing benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help="directory of image files")
+    args = parser.parse_args()
+
+    images = load_images(args.images) if args.images else synthetic_images()
+    sniffed_total = full_total = 0
+    for name, image in images:
+        start = time.perf_counter()
+        info, read = probe_image(ranged_reader(image))
+        elapsed = time.perf_counter() - start
+        sniffed_total += read
+        full_total += len(image)
+        print(f"{name:>12}: {str(info):<24} sniffed {read:>8} B of {len(image):>9} B in {elapsed * 1e6:.0f} us")
+    print(f"{'total':>12}: {sniffed_total} B instead of {full_total} B, {full_total / max(sniffed_total, 1):.0f}x less")
+
+
+if __name__ == "__main__":
+    main()
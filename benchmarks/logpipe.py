@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Measure message throughput with debug logging off and on.
+
+Usage:
+    python -m benchmarks.logpipe [--lines N] [--file RECORDING] [--sample 100]
+
+Notes:
+    Traffic is pushed through a ShangSock over a socket pair, one receive
+    sized chunk at a time, with every message parsed and every PING and
+    channel message answered through send and flush, as the bot's loop does.
+    Logs go to a rotating file as with the default logging.ini. Each mode
+    configures logging afresh:
+
+        info:   INFO to the file, written synchronously
+        debug:  DEBUG to the file, written synchronously
+        queue:  DEBUG to the file through the logpipe queue
+        sample: as queue, keeping one in --sample debug records
+
+    The queued modes also report how long the listener took to finish
+    writing after the last message was handled.
+
+"""
+
+import argparse
+import atexit
+import logging
+import logging.handlers
+import os
+import socket
+import tempfile
+import time
+from typing import List
+
+from shanghai import logpipe
+from shanghai import parser
+from shanghai.connection import ShangSock
+
+from .corpus import chunked, load_lines
+
+_MODES = ("info", "debug", "queue", "sample")
+
+
+def configure(mode: str, path: str, every: int) -> List[logging.handlers.QueueListener]:
+    """Reset logging to the given mode, logging to a file at path."""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    for name in ("shanghai.connection", "shanghai.shanghai"):
+        logging.getLogger(name).filters.clear()
+    handler = logging.handlers.RotatingFileHandler(path, "a", 10 * 1024 * 1024, 10)
+    handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO if mode == "info" else logging.DEBUG)
+    if mode == "sample":
+        logpipe.sample("shanghai.connection", every)
+        logpipe.sample("shanghai.shanghai", every)
+    if mode in ("queue", "sample"):
+        return [logpipe.start_queue(root)]
+    return []
+
+
+def run(chunks: List[bytes]) -> int:
+    """Receive, parse and answer every message, returning how many were handled."""
+    ours, theirs = socket.socketpair()
+    theirs.setblocking(False)
+    irc = ShangSock("irc.example.net", 6667, False, timeout=0)
+    irc.sock = ours
+    logger = logging.getLogger("shanghai.shanghai")
+    count = 0
+    for chunk in chunks:
+        theirs.sendall(chunk)
+        for line in irc.receive_lines():
+            message = parser.parse(line)
+            count += 1
+            # As Bot.handle logs each message
+            logger.debug("Received %s", line)
+            if message.command == "PING":
+                irc.send(f"PONG :{message.text}\r\n")
+            elif message.command == "PRIVMSG":
+                irc.send(f"PRIVMSG {message.target} :seen\r\n")
+        irc.flush()
+        try:
+            while theirs.recv(65536):
+                pass
+        except BlockingIOError:
+            pass
+    ours.close()
+    theirs.close()
+    return count
+
+
+def main() -> None:
+    """Run the logging benchmark."""
+    parser_ = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser_.add_argument("--lines", type=int, default=100_000, help="synthetic lines to generate")
+    parser_.add_argument("--file", help="recorded traffic, raw CRLF delimited lines")
+    parser_.add_argument("--chunk", type=int, default=4096, help="bytes per simulated receive")
+    parser_.add_argument("--sample", type=int, default=100, help="keep one in this many debug records")
+    parser_.add_argument("--modes", default=",".join(_MODES), help="comma separated modes to run")
+    args = parser_.parse_args()
+
+    chunks = chunked(load_lines(args.file, args.lines), args.chunk)
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in args.modes.split(","):
+            path = os.path.join(directory, f"{mode}.log")
+            listeners = configure(mode, path, args.sample)
+            start = time.perf_counter()
+            count = run(chunks)
+            elapsed = time.perf_counter() - start
+            for listener in listeners:
+                listener.stop()
+                atexit.unregister(listener.stop)
+            drained = time.perf_counter() - start - elapsed
+            size = os.path.getsize(path) / 2 ** 20
+            tail = f", {drained:.2f}s draining" if listeners else ""
+            print(f"{mode:>6}: {count / elapsed:>9,.0f} msgs/s, {elapsed:.2f}s, {size:.1f} MiB logged{tail}")
+        configure("info", os.devnull, args.sample)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Measure title parsing throughput in threads against a process pool.
+
+Usage:
+    python -m benchmarks.offload [--pages N] [--processes 1,2,4] [--threads 4]
+
+Notes:
+    Pages are parsed from a thread pool, as the bot's scrape workers do,
+    first in the threads themselves and then handed to a ParserPool of each
+    size given. Pages have their title after a large head, so parsing them
+    is CPU bound. Threads only scale past one core with the process pool.
+
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+from typing import Callable, List, Optional
+
+from shanghai.offload import ParserPool
+from shanghai.titles import TitleExtractor
+
+
+def synthetic_pages(count: int) -> List[bytes]:
+    """Build pages whose title comes after about 170KiB of inline scripts and styles."""
+    pages = []
+    for i in range(count):
+        head = "<!doctype html><html><head><meta charset='utf-8'>"
+        head += "<style>.a { color: red; }</style><script>var x = '<b>';</script><link rel='x' href='/y'>\n" * 2000
+        pages.append(f"{head}<title>Page {i}</title></head><body></body></html>".encode("utf-8"))
+    return pages
+
+
+def in_thread(page: bytes) -> Optional[str]:
+    """Parse a page in the calling thread, as fetch_title does without a pool."""
+    return TitleExtractor.from_chunks([page], max_bytes=len(page)).title()
+
+
+def run(parse: Callable[[bytes], Optional[str]], pages: List[bytes], threads: int) -> float:
+    """Parse every page from a thread pool, returning pages per second."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        titles = list(executor.map(parse, pages))
+    elapsed = time.perf_counter() - start
+    assert all(titles), "a page's title was not found"
+    return len(pages) / elapsed
+
+
+def main() -> None:
+    """Run the title parsing throughput benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=64, help="number of pages to parse")
+    parser.add_argument("--processes", default="1,2,4", help="comma separated pool sizes to try")
+    parser.add_argument("--threads", type=int, default=4, help="scrape worker threads submitting pages")
+    args = parser.parse_args()
+
+    pages = synthetic_pages(args.pages)
+    print(f"{os.cpu_count()} cores, {len(pages)} pages of {len(pages[0]) // 1024}KiB, {args.threads} threads")
+    baseline = run(in_thread, pages, args.threads)
+    print(f"{'in thread':>12}: {baseline:8.1f} pages/s")
+    for processes in (int(n) for n in args.processes.split(",")):
+        pool = ParserPool(processes=processes, timeout=60, max_bytes=len(pages[0]))
+        pool.start()
+        try:
+            rate = run(pool.title, pages, max(args.threads, processes))
+        finally:
+            pool.stop()
+        print(f"{processes:>2} processes: {rate:8.1f} pages/s, {rate / baseline:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Compare the single pass parser against the old PRIVMSG regex.
+
+Usage:
+    python -m benchmarks.parsing [--lines N] [--file RECORDING]
+
+Notes:
+    The regex only ever recognised PRIVMSG and found numerics by searching
+    the whole line, so alongside timings this reports where the two disagree.
+
+"""
+
+import argparse
+import re
+import time
+from typing import List
+
+from shanghai.buffers import decode_line
+from shanghai.parser import parse
+
+from .corpus import load_lines
+
+
+_MSPLIT = re.compile(
+    r"""
+  :
+  (?P<user>[^!]*)
+  !\S*?\s*?
+  PRIVMSG
+  \s*?
+  (?P<chan>\S*)
+  \s*?
+  :(?P<msg>[^\r\n]*)
+""",
+    re.VERBOSE | re.IGNORECASE,
+)
+
+
+def regex_pass(lines: List[str]) -> int:
+    """Classify lines the way Bot used to, returning the PRIVMSG count."""
+    privmsgs = 0
+    for line in lines:
+        if _MSPLIT.match(line):
+            privmsgs += 1
+        elif re.search(r"\b433", line):
+            pass
+    return privmsgs
+
+
+def parser_pass(lines: List[str]) -> int:
+    """Parse every line, returning the PRIVMSG count."""
+    privmsgs = 0
+    for line in lines:
+        if parse(line).command == "PRIVMSG":
+            privmsgs += 1
+    return privmsgs
+
+
+def main() -> None:
+    """Run the parsing benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=1_000_000, help="synthetic lines to generate")
+    parser.add_argument("--file", help="recorded traffic, raw CRLF delimited lines")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    lines = [decode_line(line) for line in load_lines(args.file, args.lines)]
+    for name, func in (("regex", regex_pass), ("parser", parser_pass)):
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            count = func(lines)
+            best = min(best, time.perf_counter() - start)
+        print(f"{name:>8}: {len(lines)} lines, {count} PRIVMSG, {best:.3f}s, {len(lines) / best:,.0f} lines/s")
+
+    false_433 = sum(1 for line in lines if re.search(r"\b433", line) and parse(line).command != "433")
+    tagged = sum(1 for line in lines if line.startswith("@") and not _MSPLIT.match(line))
+    print(f"regex misreads: {false_433} lines matched 433 without being one, {tagged} tagged PRIVMSG/others missed")
+
+
+if __name__ == "__main__":
+    main()
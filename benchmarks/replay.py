@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Replay recorded traffic through the bot's framing, parsing and dispatch.
+
+Usage:
+    python -m benchmarks.replay RECORDING [--speed 0] [--repeat N] [--nick NICK]
+
+Notes:
+    RECORDING is a file written by setting record_path in shanghai.ini. It
+    is read through a memory map and fed, one recorded receive at a time, to
+    a line framer and Bot.handle, so every command handler runs as it did
+    live. Nothing touches the network: lines the bot sends are counted and
+    dropped, and links are counted where they would be queued for scraping,
+    always finding room, so no worker ever fetches them.
+
+    --speed 0 replays as fast as possible, the throughput benchmark. Any
+    other speed replays with the recorded gaps between receives divided by
+    it, gaps capped at --max-gap, and reports how far replay fell behind.
+
+    --nick should match the nick the bot had when recording, so messages
+    sent to the bot itself are handled as they were.
+
+"""
+
+import argparse
+import configparser
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Dict, Optional
+
+from shanghai import recording
+from shanghai import shanghai
+from shanghai import workers
+from shanghai.buffers import LineFramer
+
+
+class DiscardingSock:
+    """Stands in for the bot's connection, counting what is sent."""
+
+    def __init__(self) -> None:
+        """Initialize with nothing sent."""
+        self.lines = 0
+        self.bytes = 0
+
+    def send(self, message: str) -> None:
+        """Count a message instead of sending it."""
+        self.lines += message.count("\r\n")
+        self.bytes += len(message)
+
+    def disconnect(self) -> None:
+        """Nothing to disconnect."""
+
+
+class CountingPool:
+    """Stands in for the scrape workers, counting the links submitted."""
+
+    def __init__(self) -> None:
+        """Initialize with nothing submitted."""
+        self.links = 0
+
+    def submit(self, channel: str, func: Any, *args: Any, **callbacks: Any) -> workers.Job:
+        """Count a link instead of queueing it, as if there were always room."""
+        self.links += 1
+        return workers.Job(func, args, channel, time.monotonic())
+
+    def cancel(self, channel: Optional[str] = None) -> None:
+        """Nothing is ever waiting to be cancelled."""
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of links submitted."""
+        return {"submitted": self.links}
+
+
+def make_bot(directory: str, nick: str) -> shanghai.Bot:
+    """Build a bot that never connects, whose sends and links are counted and dropped."""
+    config = configparser.ConfigParser()
+    config["DEFAULT"] = {
+        "owner": "",
+        "nick": nick,
+        "realname": nick,
+        "password": "",
+        "prefix": ",",
+        "server": "127.0.0.1",
+        "port": "6667",
+        "ssl": "no",
+        # Asyncio defers connecting until run_async, which is never called
+        "asyncio": "yes",
+        "flood_rate": "1000000",
+        "flood_burst": "1000000",
+        "cache_path": "",
+    }
+    paths = {name: os.path.join(directory, f"{name}.ini") for name in ("shanghai", "commands", "apis")}
+    with open(paths["shanghai"], "w") as conffile:
+        config.write(conffile)
+    for name in ("commands", "apis"):
+        with open(paths[name], "w") as conffile:
+            configparser.ConfigParser().write(conffile)
+    bot = shanghai.Bot(paths["shanghai"], paths["commands"], paths["apis"])
+    bot.irc = DiscardingSock()  # type: ignore
+    bot.pool = CountingPool()  # type: ignore
+    return bot
+
+
+def replay(bot: shanghai.Bot, path: str, speed: float, max_gap: float) -> Dict[str, float]:
+    """Feed a recording through a bot, returning counts and how far replay lagged."""
+    framer = LineFramer()
+    counts = {"receives": 0, "bytes": 0, "lines": 0, "connections": 0, "lag": 0.0}
+    previous = None
+    due = time.perf_counter()
+    for stamp, data in recording.read(path):
+        if not data:
+            framer.clear()
+            counts["connections"] += 1
+            continue
+        if speed:
+            if previous is not None:
+                due += min(max(stamp - previous, 0.0), max_gap) / speed
+            previous = stamp
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            else:
+                counts["lag"] = max(counts["lag"], -wait)
+        counts["receives"] += 1
+        counts["bytes"] += len(data)
+        for line in framer.feed(data):
+            bot.handle("".join([line, "\r\n"]))
+            counts["lines"] += 1
+    return counts
+
+
+def main() -> None:
+    """Run the replay benchmark."""
+    parser_ = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser_.add_argument("recording", help="recording written with record_path")
+    parser_.add_argument("--speed", type=float, default=0, help="multiple of recorded speed, 0 for flat out")
+    parser_.add_argument("--max-gap", type=float, default=1.0, help="longest recorded gap to wait out, in seconds")
+    parser_.add_argument("--repeat", type=int, default=1, help="times to replay the recording")
+    parser_.add_argument("--nick", default="shanghai", help="nick the bot had when recording")
+    parser_.add_argument("--log", default=os.devnull, help="file the bot logs to")
+    parser_.add_argument("--log-level", default="INFO", help="bot logging level")
+    args = parser_.parse_args()
+    logging.basicConfig(
+        filename=args.log, level=args.log_level, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        bot = make_bot(directory, args.nick)
+        sent: DiscardingSock = bot.irc  # type: ignore
+        links: CountingPool = bot.pool  # type: ignore
+        for run in range(args.repeat):
+            start = time.perf_counter()
+            counts = replay(bot, args.recording, args.speed, args.max_gap)
+            elapsed = time.perf_counter() - start
+            lag = f", at most {counts['lag'] * 1000:.1f}ms behind" if args.speed else ""
+            print(
+                f"run {run + 1}: {counts['lines']:,.0f} lines in {counts['receives']:,.0f} receives"
+                f" over {counts['connections']:.0f} connections, {elapsed:.2f}s,"
+                f" {counts['lines'] / elapsed:,.0f} msgs/s, {counts['bytes'] / elapsed / 2 ** 20:.1f} MiB/s{lag}"
+            )
+        print(f"bot sent {sent.lines:,} lines, {sent.bytes / 2 ** 20:.2f} MiB, all discarded")
+        print(f"bot submitted {links.links:,} links for scraping, none fetched")
+        bot.resources.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Compare streaming title extraction against parsing whole pages.
+
+Usage:
+    python -m benchmarks.titles [--pages DIR] [--max-bytes N]
+
+Notes:
+    DIR should hold saved pages as they were served (*.html), without one a
+    synthetic corpus of small to multi-megabyte pages is used. For each page
+    the bytes read, peak traced memory and time taken are reported.
+
+"""
+
+import argparse
+import glob
+import os
+import time
+import tracemalloc
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from bs4 import BeautifulSoup  # type: ignore
+
+from shanghai.titles import TitleExtractor
+
+
+def synthetic_pages() -> List[Tuple[str, bytes]]:
+    """Build pages with a title in the head followed by bodies of varying size."""
+    pages = []
+    for size in (10 * 1024, 200 * 1024, 2 * 1024 * 1024):
+        head = f"<!doctype html><html><head><meta charset='utf-8'>{'<script>var a=1;</script>' * 40}"
+        head += f"<title>Page of {size} bytes – ☃</title></head><body>"
+        body = "<div class='post'><p>Lorem ipsum dolor sit amet, <a href='#'>link</a></p></div>\n"
+        pages.append((f"synthetic-{size}", (head + body * (size // len(body)) + "</body></html>").encode("utf-8")))
+    return pages
+
+
+def load_pages(directory: Optional[str]) -> List[Tuple[str, bytes]]:
+    """Load saved pages from a directory, or build synthetic ones."""
+    if directory is None:
+        return synthetic_pages()
+    pages = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.html"))):
+        with open(path, "rb") as page:
+            pages.append((os.path.basename(path), page.read()))
+    return pages
+
+
+def stream(page: bytes, size: int = 8192) -> Iterator[bytes]:
+    """Yield a page in chunks as iter_content would."""
+    for i in range(0, len(page), size):
+        yield page[i : i + size]
+
+
+def full_parse(page: bytes, max_bytes: int) -> Tuple[Optional[str], int]:
+    """Read the whole body and parse it with BeautifulSoup, as fetch_title used to."""
+    body = b"".join(stream(page))
+    tag = BeautifulSoup(body.decode("utf-8", "replace"), "html.parser").title
+    return (tag.string.strip() if tag is not None and tag.string else None), len(body)
+
+
+def streaming(page: bytes, max_bytes: int) -> Tuple[Optional[str], int]:
+    """Read chunks only until the title is found."""
+    extractor = TitleExtractor.from_chunks(stream(page), max_bytes=max_bytes)
+    return extractor.title(), extractor.bytes_read
+
+
+def measure(func: Callable[[bytes, int], Tuple[Optional[str], int]], page: bytes, max_bytes: int) -> str:
+    """Run one extraction, returning a report of its cost.
+
+    Notes:
+        Timing and memory are measured on separate runs, as tracing
+        allocations slows the run down considerably.
+
+    """
+    start = time.perf_counter()
+    title, read = func(page, max_bytes)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func(page, max_bytes)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return f"read {read:>9} B, peak {peak / 1024:>9.1f} KiB, {elapsed * 1000:>8.2f} ms, title {title!r}"
+
+
+def main() -> None:
+    """Run the title extraction benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", help="directory of saved *.html pages")
+    parser.add_argument("--max-bytes", type=int, default=256 * 1024, help="streaming read limit")
+    args = parser.parse_args()
+
+    for name, page in load_pages(args.pages):
+        print(name)
+        print(f"      full: {measure(full_parse, page, args.max_bytes)}")
+        print(f"    stream: {measure(streaming, page, args.max_bytes)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,13 +10,16 @@ Notes:
 
 """
 
+import asyncio
 import configparser
 import logging
 import logging.config
 import os
 import sys
 
+from shanghai import logpipe
 import shanghai.shanghai as shanghai
+from shanghai.supervisor import Supervisor
 from shanghai.exceptions import ShanghaiError
 
 
@@ -35,6 +38,7 @@ def init_logging() -> None:
             raise ShanghaiError(error=f"Unexpected exception, contact maintainer - {inst}")
         else:
             break
+    logpipe.install("config/logging.ini")
 
 
 def logging_config_recovery(issue: KeyError) -> None:
@@ -88,6 +92,8 @@ def create_logging_config() -> None:
         This creates a logger config that results in full DEBUG logging being
         enabled to stdout. This should probably be changed eventually, but
         for now should be fine.
+        Records are written from a background thread through a queue, and
+        loggers listed under sampling keep one in every so many debug records.
 
     """
     config = configparser.ConfigParser()
@@ -120,6 +126,9 @@ def create_logging_config() -> None:
         "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
         "datefmt": "",
     }
+    # Read by logpipe rather than fileConfig, see the logpipe module
+    config["pipeline"] = {"queue": "yes"}
+    config["sampling"] = {}
     with open("config/logging.ini", "w+") as conffile:
         config.write(conffile)
 
@@ -127,7 +136,7 @@ def create_logging_config() -> None:
 def create_api_config() -> None:
     """Create an empty apis config with necessary sections and keys."""
     config = configparser.ConfigParser()
-    config["pixiv"] = {"username": "", "password": ""}
+    config["pixiv"] = {"username": "", "password": "", "refresh_token": ""}
     with open("config/apis.ini", "w+") as conffile:
         config.write(conffile)
 
@@ -138,12 +147,51 @@ def create_shanghai_config() -> None:
     config["DEFAULT"] = {
         "owner": "",
         "nick": "",
+        "alt_nicks": "",
         "realname": "",
         "password": "",
+        "caps": "message-tags,multi-prefix,server-time",
+        "register_timeout": "30",
+        "reconnect_delay": "2",
+        "max_reconnect_delay": "300",
+        "happy_eyeballs_delay": "0.25",
         "prefix": ",",
         "server": "",
         "port": "6697",
         "ssl": "yes",
+        "asyncio": "yes",
+        "flood_rate": "1.0",
+        "flood_burst": "5",
+        "scrape_workers": "4",
+        "scrape_queue": "100",
+        "scrape_per_channel": "2",
+        "scrape_deadline": "30",
+        "link_window": "60",
+        "shards": "0",
+        "restart_delay": "5",
+        "max_restart_delay": "300",
+        "health_timeout": "30",
+        "http_per_host": "4",
+        "http_hosts": "64",
+        "http_idle": "60",
+        "http_connect_timeout": "1",
+        "http_read_timeout": "1",
+        "failure_threshold": "5",
+        "failure_cooldown": "30",
+        "negative_ttl": "60",
+        "title_max_bytes": str(256 * 1024),
+        "parse_processes": "0",
+        "parse_timeout": "5",
+        "cache_path": "cache/scrape.sqlite",
+        "cache_ttl": "3600",
+        "cache_entries": "10000",
+        "cache_bytes": str(8 * 1024 * 1024),
+        "metrics_port": "0",
+        "metrics_textfile": "",
+        "metrics_interval": "15",
+        "profile_dir": "logs",
+        "record_path": "",
+        "record_max_bytes": str(1024 ** 3),
     }
     with open("config/shanghai.ini", "w+") as conffile:
         config.write(conffile)
@@ -172,7 +220,16 @@ def main() -> None:
         create_shanghai_config()
     else:
         logger.info("Necessary configuration files are present, continuing")
-        shanghai.Bot()  # Verifying bot construction / initialization
+        supervisor = Supervisor()
+        if supervisor.config.sections():
+            # Network sections are run side by side, sharing one set of scrape resources
+            supervisor.run()
+            return
+        bot = shanghai.Bot()
+        if bot.asyncio:
+            asyncio.run(bot.run_async())
+        else:
+            bot.run()
 
 
 if __name__ == "__main__":
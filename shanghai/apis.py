@@ -3,16 +3,168 @@
 
 """Contains methods that reference APIs used by bot."""
 
+from collections import OrderedDict
+from concurrent.futures import Future
 import configparser
-from functools import lru_cache
 import logging
+import threading
+import time
+from typing import Dict
 
 import pixivpy3  # type: ignore
 
+from . import metrics
+from . import sessions
 from .exceptions import APIError
 
 
-@lru_cache(maxsize=32)
+class PixivClient:
+    """Long lived, shared pixiv API session."""
+
+    def __init__(
+        self,
+        conf: configparser.SectionProxy,
+        *,
+        cache_size: int = 4096,
+        concurrency: int = 1,
+        refresh_margin: float = 300,
+    ):
+        """Initialize client, logging in happens on first use.
+
+        Args:
+            conf:           A configparser section containing user/password info
+            cache_size:     Most illustrations to keep tags for
+            concurrency:    Most API calls in flight at once
+            refresh_margin: Seconds before expiry at which the token is refreshed
+
+        """
+        self.conf = conf
+        self.cache_size = cache_size
+        self.refresh_margin = refresh_margin
+        self.api = pixivpy3.AppPixivAPI(timeout=sessions.pool().timeout)
+        self._expires = 0.0
+        self._auth_lock = threading.Lock()
+        self._calls = threading.Semaphore(concurrency)
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[int, str]" = OrderedDict()
+        self._pending: Dict[int, "Future[str]"] = {}
+
+    def authenticate(self) -> None:
+        """Log in, or refresh the access token if it is close to expiring.
+
+        Raises:
+            APIError: Authentication failed
+
+        Notes:
+            The first call logs in with the configured refresh token or
+            username and password, after that the refresh token pixiv handed
+            back is used, so the full login only ever happens once.
+
+        """
+        logger = logging.getLogger(__name__)
+        with self._auth_lock:
+            if time.monotonic() < self._expires - self.refresh_margin:
+                return
+            try:
+                if self.api.refresh_token or self.conf.get("refresh_token"):
+                    logger.info("Refreshing pixiv access token")
+                    token = self.api.auth(refresh_token=self.api.refresh_token or self.conf["refresh_token"])
+                else:
+                    logger.info("Logging in to pixiv")
+                    token = self.api.auth(username=self.conf["username"], password=self.conf["password"])
+            except pixivpy3.PixivError as inst:
+                logger.error(inst)
+                self._expires = 0.0
+                raise APIError(error=str(inst))
+            self._expires = time.monotonic() + float(token.response.get("expires_in", 3600))
+
+    def tags(self, illust_id: int) -> str:
+        """Fetch and return illustration tags from pixiv.
+
+        Args:
+            illust_id: The ID of the illustration
+
+        Returns:
+            A string containing tags for the illustration with given ID
+
+        Raises:
+            APIError: The lookup failed
+
+        Notes:
+            A lookup for an ID already being fetched waits on that fetch.
+            Different IDs are fetched by their own callers, up to concurrency
+            at once. The app API has no call taking several IDs, so holding
+            lookups back to batch them would add latency without saving a
+            single request.
+
+        """
+        with self._lock:
+            if illust_id in self._cache:
+                self._cache.move_to_end(illust_id)
+                return self._cache[illust_id]
+            future = self._pending.get(illust_id)
+            owner = future is None
+            if future is None:
+                future = self._pending[illust_id] = Future()
+        if owner:
+            # Anything raised has to reach the future, or the waiters on it hang
+            try:
+                self.authenticate()
+                future.set_result(self._fetch(illust_id))
+            except Exception as inst:
+                future.set_exception(inst if isinstance(inst, APIError) else APIError(error=str(inst)))
+            finally:
+                with self._lock:
+                    del self._pending[illust_id]
+        return future.result()
+
+    def _fetch(self, illust_id: int) -> str:
+        """Look up a single illustration and cache its tags."""
+        logger = logging.getLogger(__name__)
+        logger.info("Beginning API call to get info on ID %s", illust_id)
+        with self._calls:
+            try:
+                json_result = self.api.illust_detail(illust_id, req_auth=True)
+            except pixivpy3.PixivError as inst:
+                logger.error(inst)
+                raise APIError(error=str(inst))
+        illust = json_result.get("illust")
+        if not illust:
+            raise APIError(error=str(json_result.get("error", f"No illustration with ID {illust_id}")))
+        tags = " ".join(["[tags]", ", ".join([tag.name for tag in illust.tags])])
+        with self._lock:
+            self._cache[illust_id] = tags
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tags
+
+
+_clients: Dict[str, PixivClient] = {}
+_clients_lock = threading.Lock()
+
+
+def pixiv_client(conf: configparser.SectionProxy) -> PixivClient:
+    """Return the shared client for a pixiv account, creating it if needed.
+
+    Args:
+        conf: A configparser section containing user/password info
+
+    Returns:
+        The PixivClient for the configured account
+
+    """
+    with _clients_lock:
+        key = conf.get("username", "")
+        if key not in _clients:
+            _clients[key] = PixivClient(
+                conf,
+                cache_size=conf.getint("cache_size", fallback=4096),
+                concurrency=conf.getint("concurrency", fallback=1),
+            )
+        return _clients[key]
+
+
+@metrics.timed(metrics.STAGE_SECONDS.labels("pixiv_tags"))
 def pixiv_tags(illust_id: int, conf: configparser.SectionProxy) -> str:
     """Fetch and return illustration tags from pixiv.
 
@@ -24,15 +176,4 @@ def pixiv_tags(illust_id: int, conf: configparser.SectionProxy) -> str:
         A string containing tags for the illustration with given ID
 
     """
-    logger = logging.getLogger(__name__)
-    logger.info(f"Beginning API call to get info on ID {illust_id}")
-    api = pixivpy3.AppPixivAPI()
-    logger.debug(f'Using username: {conf["username"]}, password: {conf["password"]}')
-    api.login(conf["username"], conf["password"])
-    try:
-        json_result = api.illust_detail(illust_id, req_auth=True)
-    except pixivpy3.PixivError as inst:
-        logger.error(inst)
-        raise APIError(error=inst)
-    illust = json_result.illust
-    return " ".join(["[tags]", ", ".join([tag.name for tag in illust.tags])])
+    return pixiv_client(conf).tags(int(illust_id))
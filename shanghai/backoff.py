@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Retry delays for Shanghai.
+
+Delays grow exponentially up to a cap, and each is drawn at random from zero
+up to that bound so bots knocked off by the same netsplit don't all come back
+in the same instant.
+
+"""
+
+import random
+from typing import Callable
+
+
+class Backoff:
+    """Capped exponential backoff with full jitter."""
+
+    def __init__(self, base: float, cap: float, *, rand: Callable[[], float] = random.random):
+        """Initialize backoff, with no failed attempts yet.
+
+        Args:
+            base: Bound on the first delay in seconds, doubling with each attempt
+            cap:  Largest bound a delay is drawn under
+            rand: Source of numbers in [0, 1), for reproducible delays
+
+        """
+        self.base = base
+        self.cap = cap
+        self.attempts = 0
+        self._rand = rand
+
+    def bound(self) -> float:
+        """Return the bound the next delay will be drawn under."""
+        # Exponent capped so long outages can't overflow the float
+        return min(self.cap, self.base * 2 ** min(self.attempts, 32))
+
+    def next(self) -> float:
+        """Count a failed attempt and return seconds to wait before the next."""
+        delay = self.bound() * self._rand()
+        self.attempts += 1
+        return delay
+
+    def reset(self) -> None:
+        """Start over from the base delay after a success."""
+        self.attempts = 0
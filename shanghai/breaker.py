@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Failure tracking for hosts and links.
+
+Hosts that keep failing have their circuit opened, so requests to them fail
+straight away instead of each waiting out a timeout, and links that just
+failed are answered with the same error for a short while.
+
+"""
+
+from collections import OrderedDict
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class HostState:
+    """Failure count and circuit state of one host."""
+
+    __slots__ = ("failures", "state", "opened", "probing")
+
+    def __init__(self) -> None:
+        """Initialize as a healthy host."""
+        self.failures = 0
+        self.state = CLOSED
+        self.opened = 0.0
+        self.probing = False
+
+
+class FailureTracker:
+    """Per-host circuit breaker and per-link negative cache."""
+
+    def __init__(self, *, threshold: int = 5, cooldown: float = 30, negative_ttl: float = 60, max_entries: int = 4096):
+        """Initialize with every host healthy.
+
+        Args:
+            threshold:    Consecutive failures after which a host's circuit opens
+            cooldown:     Seconds an open circuit waits before letting a probe
+                          request through
+            negative_ttl: Seconds a failed link is answered from the negative
+                          cache
+            max_entries:  Most links kept in the negative cache
+
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, HostState] = {}
+        self._negative: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    def allow(self, host: str) -> bool:
+        """Check whether a request to a host should be made.
+
+        Args:
+            host: The hostname
+
+        Returns:
+            True for a closed circuit, and for one probe request once an open
+            circuit has cooled down, otherwise False
+
+        """
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None or state.state == CLOSED:
+                return True
+            if state.state == OPEN and time.monotonic() - state.opened >= self.cooldown:
+                state.state = HALF_OPEN
+            if state.state == HALF_OPEN and not state.probing:
+                state.probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def success(self, host: str) -> None:
+        """Record a request to a host that got an answer, closing its circuit."""
+        with self._lock:
+            state = self._hosts.pop(host, None)
+        if state is not None and state.state != CLOSED:
+            logging.getLogger(__name__).info("Circuit for %s closed", host)
+
+    def failure(self, host: str) -> None:
+        """Record a request to a host that timed out, failed to connect or got a server error."""
+        logger = logging.getLogger(__name__)
+        with self._lock:
+            state = self._hosts.setdefault(host, HostState())
+            state.failures += 1
+            state.probing = False
+            if state.state == HALF_OPEN or state.failures >= self.threshold:
+                if state.state != OPEN:
+                    logger.warning("Circuit for %s opened after %s failures", host, state.failures)
+                state.state = OPEN
+                state.opened = time.monotonic()
+
+    def release(self, host: str) -> None:
+        """Record a request to a host that failed for reasons of its own, neither closing nor opening its circuit."""
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is not None:
+                state.probing = False
+
+    def remember(self, url: str, error: str) -> None:
+        """Cache the error a link failed with.
+
+        Args:
+            url:   The normalized link
+            error: The error to answer the link with while it is cached
+
+        """
+        with self._lock:
+            self._negative[url] = (time.monotonic() + self.negative_ttl, error)
+            self._negative.move_to_end(url)
+            while len(self._negative) > self.max_entries:
+                self._negative.popitem(last=False)
+
+    def recall(self, url: str) -> Optional[str]:
+        """Return the cached error for a link that recently failed, if any."""
+        with self._lock:
+            entry = self._negative.get(url)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._negative[url]
+                return None
+            return entry[1]
+
+    def hosts(self) -> Dict[str, str]:
+        """Describe every host that has recently failed.
+
+        Returns:
+            Each host mapped to its circuit state, failure count and, for an
+            open circuit, seconds until it lets a probe through
+
+        """
+        now = time.monotonic()
+        described = {}
+        with self._lock:
+            for host, state in self._hosts.items():
+                text = f"{state.state}, {state.failures} failures"
+                if state.state == OPEN:
+                    text += f", probe in {max(self.cooldown - (now - state.opened), 0):.0f}s"
+                described[host] = text
+        return described
+
+    def stats(self) -> Dict[str, int]:
+        """Return counts of failing hosts, open circuits, rejected requests and cached failures."""
+        with self._lock:
+            return {
+                "failing": len(self._hosts),
+                "open": sum(state.state != CLOSED for state in self._hosts.values()),
+                "rejected": self.rejected,
+                "negative": len(self._negative),
+            }
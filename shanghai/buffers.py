@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Byte buffers sitting between the sockets and the IRC protocol.
+
+These hold no socket themselves, so the blocking and asyncio connections can
+share them.
+
+"""
+
+import logging
+from typing import Callable, List
+
+
+def decode_line(line: bytes) -> str:
+    """Decode a single IRC line.
+
+    Args:
+        line: The raw bytes of one message, without the CRLF
+
+    Returns:
+        The line decoded as UTF-8, or as latin-1 if it is not valid UTF-8
+
+    Notes:
+        IRC has no mandated encoding, and older clients still send latin-1,
+        which can always be decoded so no message is ever lost.
+
+    """
+    try:
+        return line.decode("utf-8")
+    except UnicodeDecodeError:
+        return line.decode("latin-1")
+
+
+class LineFramer:
+    """Incrementally split a byte stream into CRLF delimited lines."""
+
+    def __init__(self, *, max_buffer: int = 64 * 1024):
+        """Initialize an empty framer.
+
+        Args:
+            max_buffer: Most bytes to hold while waiting on a line terminator
+
+        """
+        self.max_buffer = max_buffer
+        self._buffer = bytearray()
+        self._scanned = 0
+
+    def __len__(self) -> int:
+        """Return the number of buffered bytes not yet part of a line."""
+        return len(self._buffer)
+
+    def feed(self, data: bytes) -> List[str]:
+        """Add received data and return every line it completes.
+
+        Args:
+            data: Bytes as received from the socket
+
+        Returns:
+            All complete lines, decoded and without their CRLF, in order
+
+        Notes:
+            Bytes already searched are not searched again, and the buffer is
+            only compacted once per call, so a burst of many lines in a
+            single receive costs time linear in its size. Decoding happens
+            after framing, so a multibyte character split across two receives
+            is decoded intact.
+
+        """
+        buffer = self._buffer
+        buffer += data
+        lines: List[str] = []
+        start = 0
+        # Back up one byte in case the last receive ended between CR and LF
+        end = buffer.find(b"\r\n", max(self._scanned - 1, 0))
+        while end != -1:
+            lines.append(decode_line(buffer[start:end]))
+            start = end + 2
+            end = buffer.find(b"\r\n", start)
+        if start:
+            del buffer[:start]
+        if len(buffer) > self.max_buffer:
+            logging.getLogger(__name__).warning(
+                "Discarding %s bytes received without a line break, buffer limit is %s", len(buffer), self.max_buffer
+            )
+            buffer.clear()
+        self._scanned = len(buffer)
+        return lines
+
+    def clear(self) -> None:
+        """Discard any partially received line."""
+        self._buffer.clear()
+        self._scanned = 0
+
+
+class OutBuffer:
+    """Outbound bytes waiting to be written to a socket."""
+
+    def __init__(self, *, high_water: int = 64 * 1024, low_water: int = 16 * 1024):
+        """Initialize an empty buffer.
+
+        Args:
+            high_water: Pending bytes above which writers should wait
+            low_water:  Pending bytes below which waiting writers may resume
+
+        """
+        self.high_water = high_water
+        self.low_water = low_water
+        self._data = bytearray()
+        self._offset = 0
+
+    def __len__(self) -> int:
+        """Return the number of bytes not yet written."""
+        return len(self._data) - self._offset
+
+    @property
+    def full(self) -> bool:
+        """Whether more bytes are pending than the high-water mark allows."""
+        return len(self) > self.high_water
+
+    def append(self, message: str) -> None:
+        """Encode a message and queue it behind anything already pending.
+
+        Args:
+            message: The message (including CRLF) to queue
+
+        """
+        self._data += message.encode("utf-8")
+
+    def flush(self, send: Callable[[memoryview], int]) -> int:
+        """Write as much pending data as possible with a single send call.
+
+        Args:
+            send: A socket's send method, or anything with its semantics
+
+        Returns:
+            The number of bytes written
+
+        Notes:
+            Every queued message is written by the same call, and a partial
+            write only advances the offset, so nothing is encoded twice or
+            resent. Exceptions from send propagate with the buffer untouched.
+
+        """
+        if not len(self):
+            return 0
+        with memoryview(self._data) as view, view[self._offset :] as pending:
+            sent = send(pending)
+        self._offset += sent
+        if self._offset == len(self._data):
+            self._data.clear()
+            self._offset = 0
+        elif self._offset > self.low_water:
+            del self._data[: self._offset]
+            self._offset = 0
+        return sent
+
+    def clear(self) -> None:
+        """Discard all pending data."""
+        self._data.clear()
+        self._offset = 0
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Persistent cache of link scrape results.
+
+Results are kept in a SQLite database in WAL mode, so they survive restarts
+and lookups from worker threads don't block each other behind writes.
+
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Mapping, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+
+_MAX_AGE = re.compile(r"(?:^|,)\s*(?:s-)?max-age\s*=\s*\"?(\d+)", re.IGNORECASE)
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """Reduce a URL to the form used as a cache key.
+
+    Args:
+        url: The URL as it was posted
+
+    Returns:
+        The URL with scheme and host lowercased, default port, fragment and
+        empty path removed, so trivially different links share an entry
+
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").rstrip(".")
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host if port is None or port == _DEFAULT_PORTS.get(scheme) else f"{host}:{port}"
+    if parts.username or parts.password:
+        netloc = f"{parts.netloc.rpartition('@')[0]}@{netloc}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+
+def cache_ttl(headers: Mapping[str, str], default: float) -> float:
+    """Work out how long a response may be cached for.
+
+    Args:
+        headers: Response headers
+        default: TTL to use when the response doesn't give one
+
+    Returns:
+        Seconds the result stays fresh, 0 if it must be revalidated every time
+
+    Notes:
+        max-age is only allowed to shorten the default, not extend it, as the
+        page may change in ways that matter without its headers saying so.
+
+    """
+    control = headers.get("cache-control", "")
+    if re.search(r"no-store|no-cache|private", control, re.IGNORECASE):
+        return 0
+    match = _MAX_AGE.search(control)
+    if match:
+        return min(float(match.group(1)), default)
+    return default
+
+
+class CacheEntry:
+    """A cached scrape result."""
+
+    __slots__ = ("result", "etag", "expires")
+
+    def __init__(self, result: str, etag: Optional[str], expires: float):
+        """Initialize entry.
+
+        Args:
+            result:  The scrape result
+            etag:    ETag of the response the result came from, if any
+            expires: time.time() after which the result needs revalidating
+
+        """
+        self.result = result
+        self.etag = etag
+        self.expires = expires
+
+    @property
+    def fresh(self) -> bool:
+        """Whether the result can be used without contacting the server."""
+        return time.time() < self.expires
+
+
+class ScrapeCache:
+    """SQLite backed TTL and LRU cache of scrape results."""
+
+    def __init__(self, path: str, *, ttl: float = 3600, max_entries: int = 10000, max_bytes: int = 8 * 1024 * 1024):
+        """Open or create the cache database.
+
+        Args:
+            path:        Database file, or ":memory:" for a cache that isn't kept
+            ttl:         Default seconds a result stays fresh
+            max_entries: Most results kept before the least recently used go
+            max_bytes:   Most bytes of results kept before the least recently
+                         used go
+
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS results (
+                url TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                etag TEXT,
+                expires REAL NOT NULL,
+                accessed REAL NOT NULL,
+                size INTEGER NOT NULL
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+        self._entries, self._bytes = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        logging.getLogger(__name__).info("Scrape cache opened at %s with %s entries", path, self._entries)
+
+    def lookup(self, url: str) -> Optional[CacheEntry]:
+        """Find the cached result for a normalized URL.
+
+        Args:
+            url: The normalized URL
+
+        Returns:
+            The entry, fresh or not, or None if there isn't one
+
+        Notes:
+            Only a fresh entry counts as a hit, a stale one is returned so its
+            ETag can be used to revalidate it. Once closed, nothing is found.
+
+        """
+        with self._lock:
+            if self._closed:
+                return None
+            row = self._db.execute("SELECT result, etag, expires FROM results WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            entry = CacheEntry(*row)
+            if entry.fresh:
+                self.hits += 1
+                self._db.execute("UPDATE results SET accessed = ? WHERE url = ?", (time.time(), url))
+            else:
+                self.misses += 1
+            return entry
+
+    def store(self, url: str, result: str, headers: Mapping[str, str]) -> None:
+        """Cache a result, unless its response forbids it.
+
+        Args:
+            url:     The normalized URL
+            result:  The scrape result
+            headers: Headers of the response the result came from
+
+        """
+        ttl = cache_ttl(headers, self.ttl)
+        etag = headers.get("etag")
+        if not ttl and not etag:
+            return
+        size = len(result.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            if self._closed:
+                return
+            old = self._db.execute("SELECT size FROM results WHERE url = ?", (url,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)", (url, result, etag, now + ttl, now, size)
+            )
+            if old is None:
+                self._entries += 1
+            self._bytes += size - (old[0] if old else 0)
+            self._evict()
+
+    def refresh(self, url: str, headers: Mapping[str, str]) -> None:
+        """Mark a stale entry fresh again after the server confirmed it is unchanged.
+
+        Args:
+            url:     The normalized URL
+            headers: Headers of the 304 Not Modified response
+
+        """
+        now = time.time()
+        with self._lock:
+            if self._closed:
+                return
+            self.revalidations += 1
+            self._db.execute(
+                "UPDATE results SET expires = ?, accessed = ? WHERE url = ?",
+                (now + cache_ttl(headers, self.ttl), now, url),
+            )
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until within both limits."""
+        while self._entries > self.max_entries or self._bytes > self.max_bytes:
+            row = self._db.execute("SELECT url, size FROM results ORDER BY accessed LIMIT 1").fetchone()
+            if row is None:
+                break
+            self._db.execute("DELETE FROM results WHERE url = ?", (row[0],))
+            self._entries -= 1
+            self._bytes -= row[1]
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit, miss, revalidation and eviction counts and current size."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "evictions": self.evictions,
+            "entries": self._entries,
+            "bytes": self._bytes,
+        }
+
+    def close(self) -> None:
+        """Close the database, scrapes still running after this go uncached."""
+        with self._lock:
+            self._closed = True
+            self._db.close()
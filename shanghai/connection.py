@@ -6,94 +6,229 @@
 Manages the connection to an IRC server,
 Receives and sends data
 
+Both a blocking socket wrapper (ShangSock) and an asyncio based equivalent
+(AsyncShangSock) are provided, exposing the same connect/send/receive surface.
+
 """
 
+import asyncio
+from collections import deque
+import errno
 import logging
+import os
+import select
 import socket
 import ssl
-from time import sleep
-from typing import List
+from time import monotonic, perf_counter
+from typing import Any, Deque, Dict, List, Optional
 
+from . import metrics
+from .buffers import LineFramer, OutBuffer
 from .exceptions import ShangSockError
+from .recording import Recorder
+
+
+_RECEIVE = metrics.STAGE_SECONDS.labels("receive")
+_RECEIVED_BYTES = metrics.RECEIVED_BYTES.labels()
+
+
+def open_connection(host: str, port: int, *, timeout: float, delay: float = 0.25) -> socket.socket:
+    """Connect to the first address of host to answer, racing IPv6 and IPv4.
+
+    Args:
+        host:    Hostname or address to connect to
+        port:    Port to connect to
+        timeout: Seconds to keep trying before giving up
+        delay:   Seconds to give one address before also starting the next
+
+    Returns:
+        A connected, blocking socket
+
+    Raises:
+        ShangSockError: The host didn't resolve or no address could be connected to
+
+    Notes:
+        Addresses alternate between families, starting with the resolver's
+        first choice, and a new attempt starts as soon as one fails, so a
+        broken route in either family costs at most the delay (RFC 8305).
+
+    """
+    logger = logging.getLogger(__name__)
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except OSError as inst:
+        raise ShangSockError(error=f"Could not resolve {host} - {inst}")
+    families: Dict[int, Deque[Any]] = {}
+    for info in infos:
+        families.setdefault(info[0], deque()).append(info)
+    addresses: Deque[Any] = deque()
+    while any(families.values()):
+        for family in families.values():
+            if family:
+                addresses.append(family.popleft())
+    attempts: Dict[socket.socket, Any] = {}
+    errors: List[str] = []
+    deadline = monotonic() + timeout
+    start_next = monotonic()
+    try:
+        while addresses or attempts:
+            now = monotonic()
+            if now >= deadline:
+                errors.append(f"timed out after {timeout}s")
+                break
+            if addresses and (now >= start_next or not attempts):
+                family, kind, proto, _, address = addresses.popleft()
+                sock = socket.socket(family, kind, proto)
+                sock.setblocking(False)
+                code = sock.connect_ex(address)
+                if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    errors.append(f"{address[0]}: {os.strerror(code)}")
+                    sock.close()
+                    continue
+                logger.debug("Connecting to %s", address[0])
+                attempts[sock] = address
+                start_next = now + delay
+            wake = start_next if addresses else deadline
+            _, writable, _ = select.select([], list(attempts), [], max(0.0, min(wake, deadline) - now))
+            for sock in writable:
+                address = attempts.pop(sock)
+                code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if code:
+                    errors.append(f"{address[0]}: {os.strerror(code)}")
+                    sock.close()
+                    # Don't sit out the rest of the delay on an address that has already failed
+                    start_next = now
+                    continue
+                sock.setblocking(True)
+                return sock
+    finally:
+        for sock in attempts:
+            sock.close()
+    raise ShangSockError(error=f"Could not connect to {host}:{port} - {'; '.join(errors) or 'no addresses'}")
 
 
 class ShangSock:
     """Socket object for the bot."""
 
-    def __init__(self, server: str, port: int, ssl_flag: bool, *, timeout: float = 0.5):
+    def __init__(
+        self,
+        server: str,
+        port: int,
+        ssl_flag: bool,
+        *,
+        timeout: float = 0.5,
+        connect_timeout: float = 10,
+        happy_eyeballs_delay: float = 0.25,
+        recorder: Optional[Recorder] = None,
+    ):
         """Initialize values for socket object.
 
         Args:
-            server:   The server to bind the socket to
-            port:     The port to connect to the server through
-            ssl_flag: Whether SSL should be used to wrap the socket or not
-            timeout:  The timeout for the socket
+            server:               The server to connect to
+            port:                 The port to connect to the server through
+            ssl_flag:             Whether SSL should be used to wrap the socket or not
+            timeout:              The timeout for the socket once connected
+            connect_timeout:      The timeout for connecting and the SSL handshake
+            happy_eyeballs_delay: Seconds to wait on one address before also
+                                  trying the next
+            recorder:             Records everything received, if given
+
+        Notes:
+            The SSL context outlives the sockets, and the session from the
+            last connection is offered on the next so the server can resume
+            it instead of doing a full handshake.
 
         """
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock: Optional[socket.socket] = None
         self.server = server
         self.port = port
         self.ssl = ssl_flag
         self.timeout = timeout
-        self.__receive_cache: List[str] = []
+        self.connect_timeout = connect_timeout
+        self.happy_eyeballs_delay = happy_eyeballs_delay
+        self.context = ssl.create_default_context() if ssl_flag else None
+        self.session: Optional[ssl.SSLSession] = None
+        self.recorder = recorder
+        self.framer = LineFramer()
+        self.outbuf = OutBuffer()
+        self.__pending: Deque[str] = deque()
+        # Other threads write to one end to end a wait for data early, opened with each connection
+        self._woken: Optional[socket.socket] = None
+        self._waker: Optional[socket.socket] = None
 
     def connect(self) -> None:
-        """Create socket and bind it to given server and port.
+        """Open a fresh socket to the server, wrapping it if SSL is used.
+
+        Raises:
+            ShangSockError: No address could be connected to, or the SSL
+                            handshake failed
 
         Notes:
             Only connects to the server the object was initialized with
             All IRC protocol should be handled by the caller
+            A single attempt is made, retrying is left to the caller
 
         """
         logger = logging.getLogger(__name__)
-        self.sock.settimeout(self.timeout)
-        logger.debug(f"Timeout set to {self.timeout}")
-        logger.info(f"Attempting to bind socket to {self.server}:{self.port}")
-        try:
-            self.sock.connect((self.server, self.port))
-        except socket.timeout as inst:
-            logger.warning(
-                f"Failed to bind socket to {self.server}:{self.port} before timeout", exc_info=inst,
-            )
-            self.reconnect()
-        logger.info(f"Connected to {self.server}:{self.port}")
-        if self.ssl:
-            logger.info("Creating an SSL context and wrapping the socket")
-            context = ssl.create_default_context()
+        self.close()
+        logger.info("Attempting to connect to %s:%s", self.server, self.port)
+        sock = open_connection(
+            self.server, self.port, timeout=self.connect_timeout, delay=self.happy_eyeballs_delay
+        )
+        logger.info("Connected to %s:%s over %s", self.server, self.port, sock.getpeername()[0])
+        if self.context is not None:
+            sock.settimeout(self.connect_timeout)
             try:
-                self.sock = context.wrap_socket(self.sock, server_hostname=self.server)
-            except socket.timeout as inst:
-                logger.warning("SSL handshake attempt timed out", exc_info=inst)
-                self.reconnect()
-            logger.info("SSL Socket ready for use")
+                sock = self.context.wrap_socket(sock, server_hostname=self.server, session=self.session)
+            except (OSError, ssl.SSLError) as inst:
+                sock.close()
+                # A session the server rejected shouldn't be offered again
+                self.session = None
+                raise ShangSockError(error=f"SSL handshake with {self.server} failed - {inst}")
+            reused = "resumed" if sock.session_reused else "new"  # type: ignore
+            logger.info("SSL Socket ready for use, %s session", reused)
         else:
             logger.info("Socket ready for use")
+        sock.settimeout(self.timeout)
+        logger.debug("Timeout set to %s", self.timeout)
+        self._woken, self._waker = socket.socketpair()
+        self._woken.setblocking(False)
+        self._waker.setblocking(False)
+        self.sock = sock
+        if self.recorder is not None:
+            self.recorder.mark()
 
-    def reconnect(self, delay: int = 10, increasing: bool = True) -> None:
-        """Attempt reconnection to a socket when connect times out.
+    def close(self) -> None:
+        """Close the socket without flushing, discarding anything unsent or unframed.
 
-        Args:
-            delay:      Initial delay in seconds before attempting to reconnect
-            increasing: Whether or not the function should increase the delay
-                        after every failed connection attempt
+        Notes:
+            The SSL session is kept for the next connect to resume. It is read
+            here rather than after the handshake, as TLS 1.3 servers send
+            their session tickets afterwards.
 
         """
-        logger = logging.getLogger(__name__)
-        while True:
-            sleep(delay)
-            try:
-                self.sock.connect((self.server, self.port))
-            except socket.timeout as inst:
-                logger.warning(
-                    "Failed to bind socket during reconnect attempt " f"after a delay of {delay} seconds.",
-                    exc_info=inst,
-                )
-                delay += 5 * increasing
-            else:
-                break
+        sock, self.sock = self.sock, None
+        for end in (self._woken, self._waker):
+            if end is not None:
+                end.close()
+        self._woken = self._waker = None
+        self.framer.clear()
+        self.outbuf.clear()
+        self.__pending.clear()
+        if self.recorder is not None:
+            self.recorder.flush()
+        if sock is None:
+            return
+        if isinstance(sock, ssl.SSLSocket) and sock.session is not None:
+            self.session = sock.session
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
 
     def disconnect(self) -> None:
-        """Unbind socket from server.
+        """Flush anything queued then close the socket.
 
         Notes:
             As with other methods in this class, IRC protocol should be handled
@@ -101,26 +236,91 @@ class ShangSock:
 
         """
         logging.getLogger(__name__).info("Shutting down socket")
-        self.sock.shutdown(socket.SHUT_RDWR)
-        self.sock.close()
+        deadline = monotonic() + self.timeout * 4
+        try:
+            while self.outbuf and monotonic() < deadline:
+                self.flush(self.timeout)
+        except (OSError, ShangSockError):
+            pass
+        self.close()
+
+    def wake(self) -> None:
+        """Make a receive waiting for data return, safe to call from any thread."""
+        waker = self._waker
+        if waker is None:
+            return
+        try:
+            waker.send(b"\0")
+        except OSError:
+            # Already woken with wakeups left unread, or closed with the connection meanwhile
+            pass
+
+    def _socket(self) -> socket.socket:
+        """Return the connected socket.
+
+        Raises:
+            ShangSockError: The socket isn't connected
+
+        """
+        if self.sock is None:
+            raise ShangSockError(error="Socket is not connected")
+        return self.sock
 
     def send(self, message: str) -> None:
-        """Encode string to bytes and send it to socket.
+        """Encode string to bytes and queue it for the socket.
 
         Args:
             message: The message (including CRLF) to send
 
+        Raises:
+            ShangSockError: The socket stayed unwritable with the buffer full
+
+        Notes:
+            Queued data is written by flush, which receive calls whenever the
+            socket is writable, so messages queued together share a syscall.
+            Once more than the buffer's high-water mark is queued this blocks
+            until the socket has taken enough to get back under its low-water
+            mark, pushing back on whatever is producing the output.
+
         """
-        logger = logging.getLogger(__name__)
-        total = 0
-        logger.debug("Beginning send to socket")
-        while total < len(message):
-            sent = self.sock.send(str.encode(message))
-            if not sent:
-                raise RuntimeError("Socket connection lost")
-            total += sent
-            logger.debug(f"Total sent: {total}")
-        logger.debug("Send complete")
+        self.outbuf.append(message)
+        if self.outbuf.full:
+            logging.getLogger(__name__).warning("Outbound buffer full at %s bytes, waiting on socket", len(self.outbuf))
+            deadline = monotonic() + self.timeout * 20
+            while len(self.outbuf) > self.outbuf.low_water:
+                if monotonic() > deadline:
+                    raise ShangSockError(error="Socket stopped accepting data")
+                self.flush(self.timeout)
+
+    def flush(self, timeout: float = 0) -> int:
+        """Write queued data with a single send if the socket is writable.
+
+        Args:
+            timeout: Seconds to wait for the socket to become writable
+
+        Returns:
+            The number of bytes written
+
+        Raises:
+            ShangSockError: The connection was lost
+
+        """
+        if not self.outbuf:
+            return 0
+        sock = self._socket()
+        _, writable, _ = select.select([], [sock], [], timeout)
+        if not writable:
+            return 0
+        try:
+            sent = self.outbuf.flush(sock.send)
+        except (BlockingIOError, socket.timeout, ssl.SSLWantWriteError):
+            return 0
+        except OSError as inst:
+            raise ShangSockError(error=f"Socket connection lost - {inst}")
+        if not sent:
+            raise ShangSockError(error="Socket connection lost")
+        logging.getLogger(__name__).debug("Sent %s bytes, %s still queued", sent, len(self.outbuf))
+        return sent
 
     def receive(self) -> str:
         """Receive a delimited IRC message from socket.
@@ -130,53 +330,246 @@ class ShangSock:
             or an empty string if there is nothing to receive
 
         Notes:
-            Any remaining data after forming and returning a message from
-            received data is cached to be processed next time the method is called.
+            Every complete message from a receive is framed at once, the ones
+            not returned are queued and handed out by later calls before the
+            socket is read again.
+
+        """
+        if not self.__pending:
+            self.__pending.extend(self.receive_lines())
+        return self.__pending.popleft() if self.__pending else ""
 
-            If there is a cache present, it will be checked first for a complete
-            message to be returned, in which case it will be returned without
-            receiving more data from the socket. Otherwise, the incomplete data
-            will form the beginning of the string built from received data.
+    def receive_lines(self) -> List[str]:
+        """Receive every complete IRC message available from one read.
+
+        Returns:
+            All messages (including CRLF) completed by a single receive,
+            or an empty list if there is nothing to receive
+
+        Raises:
+            ShangSockError: The server closed or lost the connection
+
+        Notes:
+            Waits up to the socket timeout for data, returning early with
+            nothing if wake is called meanwhile.
 
         """
         logger = logging.getLogger(__name__)
-        logger.debug(f"Current cache: {self.__receive_cache}")
-
-        if self.__receive_cache:
-            logger.debug("More data waiting in cache, checking it first")
-            message = "".join(self.__receive_cache).partition("\r\n")
-            if message[1]:
-                logger.debug("Complete message was remaining in cache")
-                logger.debug(f"Caching {message[2]}")
-                self.__receive_cache = [message[2]]
-                logger.debug(f"Returning {message[0]}")
-                return "".join([message[0], message[1]])
-        else:
-            logger.debug("No cached data present")
-
+        if self.__pending:
+            lines = list(self.__pending)
+            self.__pending.clear()
+            return lines
+        sock = self._socket()
+        woken = self._woken
+        # Decrypted data already buffered by SSL won't show up in select
+        if woken is not None and not (self.ssl and sock.pending()):  # type: ignore
+            readable, writable, _ = select.select([sock, woken], [sock] if self.outbuf else [], [], self.timeout)
+            if writable:
+                self.flush()
+            if woken in readable:
+                try:
+                    while woken.recv(4096):
+                        pass
+                except BlockingIOError:
+                    pass
+            if sock not in readable:
+                return []
         try:
-            logger.debug("Receiving from socket")
-            data = self.sock.recv(4096)
+            data = sock.recv(4096)
         except socket.timeout:
-            logger.debug("Socket timeout, nothing to receive")
-            return ""
+            return []
+        except OSError as inst:
+            logger.warning("Connection lost while attempting to receive data", exc_info=inst)
+            self.framer.clear()
+            raise ShangSockError(error=f"Connection lost - {inst}")
         if not data:
             logger.warning("Unexpected disconnection while attempting to receive data")
-            self.__receive_cache = []
+            self.framer.clear()
             raise ShangSockError(error="Unexpected Disconnect")
+        if self.recorder is not None:
+            self.recorder.record(data)
+        start = perf_counter()
+        lines = ["".join([line, "\r\n"]) for line in self.framer.feed(data)]
+        _RECEIVE.observe(perf_counter() - start)
+        _RECEIVED_BYTES.inc(len(data))
+        logger.debug("Received %s bytes, %s complete messages", len(data), len(lines))
+        return lines
 
-        logger.debug("Data received, merging with cache and separating by CRLF")
-        decoded = bytes.decode(data, encoding="utf-8")
-        cache = "".join(self.__receive_cache)
-        message = "".join([cache, decoded]).partition("\r\n")
-        if message[1]:  # BUG: Probably fails with IndexError exception if there is no CRLF
-            logger.debug("CRLF present, so a complete message is ready")
-            logger.debug(f"Caching {message[2]}")
-            self.__receive_cache = [message[2]]
-            logger.debug(f"Returning {message[0]}")
-            return "".join([message[0], message[1]])
-        else:
-            logger.debug("No CRLF present, so there is no complete message ready")
-            logger.debug(f"Caching {message[0]}")
-            self.__receive_cache = [message[0]]
-        return ""
+
+class ShangProtocol(asyncio.Protocol):
+    """Asyncio protocol splitting the incoming stream into IRC messages."""
+
+    def __init__(self, recorder: Optional[Recorder] = None) -> None:
+        """Initialize protocol state.
+
+        Args:
+            recorder: Records everything received, if given
+
+        """
+        self.transport: Optional[asyncio.Transport] = None
+        self.messages: "asyncio.Queue[str]" = asyncio.Queue()
+        self.closed = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self.framer = LineFramer()
+        self.recorder = recorder
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        """Store the transport once the connection is established."""
+        self.transport = transport  # type: ignore
+        if self.recorder is not None:
+            self.recorder.mark()
+        logging.getLogger(__name__).info("Asyncio transport connected")
+
+    def data_received(self, data: bytes) -> None:
+        """Frame received data and queue every complete message."""
+        if self.recorder is not None:
+            self.recorder.record(data)
+        start = perf_counter()
+        for message in self.framer.feed(data):
+            self.messages.put_nowait("".join([message, "\r\n"]))
+        _RECEIVE.observe(perf_counter() - start)
+        _RECEIVED_BYTES.inc(len(data))
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        """Flag the connection as closed and wake anything waiting on it."""
+        logging.getLogger(__name__).warning("Asyncio transport lost connection", exc_info=exc)
+        if self.recorder is not None:
+            self.recorder.flush()
+        self.closed.set()
+        self._writable.set()
+
+    def pause_writing(self) -> None:
+        """Stop writers when the transport buffer passes its high-water mark."""
+        self._writable.clear()
+
+    def resume_writing(self) -> None:
+        """Resume writers once the transport buffer has drained."""
+        self._writable.set()
+
+    async def drain(self) -> None:
+        """Wait until the transport is ready to accept more data."""
+        await self._writable.wait()
+
+
+class AsyncShangSock:
+    """Asyncio based socket object for the bot."""
+
+    def __init__(
+        self,
+        server: str,
+        port: int,
+        ssl_flag: bool,
+        *,
+        timeout: float = 10,
+        happy_eyeballs_delay: float = 0.25,
+        recorder: Optional[Recorder] = None,
+    ):
+        """Initialize values for socket object.
+
+        Args:
+            server:               The server to connect to
+            port:                 The port to connect to the server through
+            ssl_flag:             Whether SSL should be used for the connection or not
+            timeout:              The timeout for establishing the connection
+            happy_eyeballs_delay: Seconds to wait on one address before also
+                                  trying the next
+            recorder:             Records everything received, if given
+
+        Notes:
+            The SSL context is kept for every connection, though asyncio
+            offers no way to resume the previous session through it.
+
+        """
+        self.server = server
+        self.port = port
+        self.ssl = ssl_flag
+        self.timeout = timeout
+        self.happy_eyeballs_delay = happy_eyeballs_delay
+        self.context = ssl.create_default_context() if ssl_flag else None
+        self.recorder = recorder
+        self.transport: Optional[asyncio.Transport] = None
+        self.protocol: Optional[ShangProtocol] = None
+
+    async def connect(self) -> None:
+        """Open a fresh connection to the given server and port.
+
+        Raises:
+            ShangSockError: No address could be connected to before the timeout
+
+        Notes:
+            Only connects to the server the object was initialized with
+            All IRC protocol should be handled by the caller
+            A single attempt is made, retrying is left to the caller
+
+        """
+        logger = logging.getLogger(__name__)
+        loop = asyncio.get_running_loop()
+        self.disconnect()
+        logger.info("Attempting to connect to %s:%s", self.server, self.port)
+        try:
+            self.transport, self.protocol = await asyncio.wait_for(  # type: ignore
+                loop.create_connection(
+                    lambda: ShangProtocol(self.recorder),
+                    self.server,
+                    self.port,
+                    ssl=self.context,
+                    happy_eyeballs_delay=self.happy_eyeballs_delay,
+                    interleave=1,
+                ),
+                self.timeout,
+            )
+        except (asyncio.TimeoutError, OSError) as inst:
+            raise ShangSockError(error=f"Failed to connect to {self.server}:{self.port} - {inst!r}")
+        peer = self.transport.get_extra_info("peername")  # type: ignore
+        logger.info("%sConnection ready for use over %s", "SSL " if self.ssl else "", peer[0] if peer else "unknown")
+
+    def disconnect(self) -> None:
+        """Close the connection to the server."""
+        if self.transport is not None and not self.transport.is_closing():
+            logging.getLogger(__name__).info("Closing transport")
+            self.transport.close()
+
+    def send(self, message: str) -> None:
+        """Encode string to bytes and hand it to the transport.
+
+        Args:
+            message: The message (including CRLF) to send
+
+        Notes:
+            This never blocks, the transport buffers anything the socket
+            can't take right away. Await drain to respect flow control.
+
+        """
+        if self.transport is None or self.transport.is_closing():
+            raise ShangSockError(error="Send attempted on a closed transport")
+        self.transport.write(str.encode(message))
+
+    async def drain(self) -> None:
+        """Wait until the transport buffer is below its high-water mark."""
+        if self.protocol is not None:
+            await self.protocol.drain()
+
+    async def receive(self) -> str:
+        """Receive a delimited IRC message from the connection.
+
+        Returns:
+            A *single* message from the connection as a string
+
+        Raises:
+            ShangSockError: The connection was lost and no messages remain
+
+        """
+        if self.protocol is None:
+            raise ShangSockError(error="Receive attempted before connecting")
+        if not self.protocol.messages.empty():
+            return self.protocol.messages.get_nowait()
+        get = asyncio.ensure_future(self.protocol.messages.get())
+        closed = asyncio.ensure_future(self.protocol.closed.wait())
+        done, _ = await asyncio.wait((get, closed), return_when=asyncio.FIRST_COMPLETED)
+        if get in done:
+            closed.cancel()
+            return get.result()
+        get.cancel()
+        logging.getLogger(__name__).warning("Unexpected disconnection while attempting to receive data")
+        raise ShangSockError(error="Unexpected Disconnect")
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Incremental decompression of response bodies with a size cap.
+
+Pages are requested compressed and decompressed as they stream in, never
+producing more than a set number of bytes, so a small compressed body that
+expands enormously can't exhaust memory.
+
+"""
+
+from typing import Any, Iterator, List
+import zlib
+
+import requests
+
+from .exceptions import RequestError
+
+try:
+    import brotli  # type: ignore
+
+    # Only bindings that can limit their output are safe against brotli bombs
+    brotli.Decompressor().process(b"", output_buffer_limit=1)
+except (ImportError, TypeError):
+    brotli = None
+
+
+ACCEPT_ENCODING = "gzip, deflate, br" if brotli is not None else "gzip, deflate"
+"""Accept-Encoding header value offering every encoding that can be decoded."""
+
+
+class StreamDecoder:
+    """Decodes one Content-Encoding chunk by chunk, up to a limit."""
+
+    def __init__(self, encoding: str, *, max_bytes: int):
+        """Initialize decoder.
+
+        Args:
+            encoding:  The Content-Encoding header, empty for none
+            max_bytes: Most decompressed bytes to produce
+
+        Raises:
+            RequestError: The encoding isn't supported
+
+        """
+        self.max_bytes = max_bytes
+        self.produced = 0
+        names = (part.strip().lower() for part in encoding.split(","))
+        encodings = [name for name in names if name not in ("", "identity")]
+        if len(encodings) > 1:
+            raise RequestError(error=f"Layered content encodings {encoding} are not supported")
+        self.encoding = encodings[0] if encodings else ""
+        self._decoder: Any = None
+        if self.encoding in ("gzip", "x-gzip"):
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == "deflate":
+            self._decoder = zlib.decompressobj()
+        elif self.encoding == "br" and brotli is not None:
+            self._decoder = brotli.Decompressor()
+        elif self.encoding:
+            raise RequestError(error=f"Unsupported content encoding {encoding}")
+        self._first = True
+
+    @property
+    def done(self) -> bool:
+        """Whether the limit has been reached."""
+        return self.produced >= self.max_bytes
+
+    def decode(self, chunk: bytes) -> bytes:
+        """Decompress the next chunk of the body.
+
+        Args:
+            chunk: The next bytes as received
+
+        Returns:
+            The decompressed bytes, cut short once the limit is reached
+
+        Raises:
+            RequestError: The body is not validly encoded
+
+        """
+        remaining = self.max_bytes - self.produced
+        if remaining <= 0:
+            return b""
+        try:
+            if self._decoder is None:
+                data = chunk[:remaining]
+            elif self.encoding == "br":
+                # Output stops growing near the limit, anything held back is never needed
+                data = self._decoder.process(chunk, output_buffer_limit=remaining)[:remaining]
+            else:
+                data = self._inflate(chunk, remaining)
+        except (zlib.error, getattr(brotli, "error", zlib.error)) as inst:
+            raise RequestError(error=f"Invalid {self.encoding} body: {inst}")
+        self.produced += len(data)
+        return data
+
+    def _inflate(self, chunk: bytes, remaining: int) -> bytes:
+        """Decompress a zlib, gzip or raw deflate chunk, producing at most remaining bytes."""
+        if self._first and self.encoding == "deflate" and chunk:
+            # Some servers send raw deflate without the zlib header the spec calls for
+            self._first = False
+            if len(chunk) < 2 or chunk[0] & 0x0F != 8 or (chunk[0] << 8 | chunk[1]) % 31:
+                self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+        parts: List[bytes] = []
+        data = chunk
+        while remaining > 0:
+            part = self._decoder.decompress(data, remaining)
+            parts.append(part)
+            remaining -= len(part)
+            data = self._decoder.unconsumed_tail
+            if not data:
+                break
+        return b"".join(parts)
+
+
+def iter_decoded(response: requests.Response, *, max_bytes: int, chunk_size: int = 8192) -> Iterator[bytes]:
+    """Yield the decompressed body of a streamed response.
+
+    Args:
+        response:   A response opened with stream=True
+        max_bytes:  Most decompressed bytes to yield
+        chunk_size: Bytes read from the connection at a time
+
+    Returns:
+        An iterator over decompressed chunks, stopping at max_bytes
+
+    Raises:
+        RequestError: The body's encoding is unsupported or invalid
+
+    """
+    decoder = StreamDecoder(response.headers.get("content-encoding", ""), max_bytes=max_bytes)
+    for chunk in response.raw.stream(chunk_size, decode_content=False):
+        data = decoder.decode(chunk)
+        if data:
+            yield data
+        if decoder.done:
+            return
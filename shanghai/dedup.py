@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Deduplication of repeated link scrapes.
+
+A link pasted into several channels at once is only fetched once, and a link
+the bot has just answered in a channel isn't answered there again straight
+away.
+
+"""
+
+from collections import OrderedDict
+from concurrent.futures import Future
+import threading
+import time
+from typing import Any, Callable, Dict, Tuple
+
+
+class SingleFlight:
+    """Shares one call between concurrent callers asking for the same key."""
+
+    def __init__(self) -> None:
+        """Initialize with nothing in flight."""
+        self._lock = threading.Lock()
+        self._flights: Dict[str, "Future[Any]"] = {}
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key: str, func: Callable[..., Any], *args: Any) -> Any:
+        """Call func, or wait on the call already running for key.
+
+        Args:
+            key:   What the call is for, such as a normalized URL
+            func:  Function to call if no call for key is in flight
+            *args: Positional arguments for func
+
+        Returns:
+            The result of the one call made for key
+
+        Raises:
+            Whatever the shared call raised, in every caller
+
+        """
+        with self._lock:
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = self._flights[key] = Future()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+        try:
+            future.set_result(func(*args))
+        except Exception as inst:
+            future.set_exception(inst)
+        finally:
+            with self._lock:
+                del self._flights[key]
+        return future.result()
+
+    def stats(self) -> Dict[str, int]:
+        """Return calls made, callers that shared another's call, and calls in flight."""
+        with self._lock:
+            return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._flights)}
+
+
+class RecentLinks:
+    """Remembers which links were recently answered in each channel."""
+
+    def __init__(self, *, window: float = 60, max_entries: int = 4096):
+        """Initialize with nothing remembered.
+
+        Args:
+            window:      Seconds a link stays suppressed in a channel
+            max_entries: Most channel and link pairs remembered, the oldest go
+                         first beyond this
+
+        """
+        self.window = window
+        self.max_entries = max_entries
+        self.suppressed = 0
+        self._seen: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+
+    def check(self, channel: str, key: str) -> bool:
+        """Note a link posted in a channel.
+
+        Args:
+            channel: Channel the link was posted in
+            key:     The normalized link
+
+        Returns:
+            True if the link should be answered, False if it was answered in
+            the channel within the window
+
+        Notes:
+            A suppressed repeat doesn't extend the window, so a link pasted
+            continuously is still answered once per window.
+
+        """
+        now = time.monotonic()
+        while self._seen:
+            oldest, expires = next(iter(self._seen.items()))
+            if expires > now and len(self._seen) < self.max_entries:
+                break
+            del self._seen[oldest]
+        if (channel, key) in self._seen:
+            self.suppressed += 1
+            return False
+        self._seen[(channel, key)] = now + self.window
+        return True
+
+    def discard(self, channel: str, key: str) -> None:
+        """Forget a link noted in a channel, as when it couldn't be answered."""
+        self._seen.pop((channel, key), None)
+
+    def forget(self, channel: str) -> None:
+        """Drop everything remembered for a channel."""
+        for pair in [pair for pair in self._seen if pair[0] == channel]:
+            del self._seen[pair]
@@ -85,6 +85,21 @@ class RequestError(LinkScanError):
         self.error = error
 
 
+class CircuitOpenError(RequestError):
+    """Raise for a request refused because its host keeps failing."""
+
+    def __init__(self, *, link: Optional[str] = None, host: str):
+        """Initialize CircuitOpenError class.
+
+        Args:
+            link: page the request was for
+            host: host whose circuit is open
+
+        """
+        super(CircuitOpenError, self).__init__(link=link, error=f"{host} is failing, not retrying yet")
+        self.host = host
+
+
 class APIError(LinkScanError):
     """Raise for exception with an API."""
 
@@ -111,3 +126,19 @@ class ShangSockError(ShanghaiError):
         """
         super(ShangSockError, self).__init__(error=f"ShangSockError - {error}")
         self.error = error
+
+
+class ParseError(ShanghaiError):
+    """Raise for a message that cannot be parsed."""
+
+    def __init__(self, *, line: str, error: str):
+        """Initialize ParseError class.
+
+        Args:
+            line:  the message that could not be parsed
+            error: reason parsing failed
+
+        """
+        super(ParseError, self).__init__(error=f"ParseError - {error}: {line!r}")
+        self.line = line
+        self.error = error
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Registry of site specific link handlers.
+
+Handlers are found by the linked hostname through an index of reversed domain
+labels, so the lookup costs the same however many handlers are registered.
+
+"""
+
+from abc import ABC, abstractmethod
+import configparser
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+
+class Handler(ABC):
+    """Base class for site specific link handling.
+
+    Attributes:
+        name:       Short name used in logs
+        domains:    Domains handled, each also covering its subdomains
+        needs_body: Whether handle wants the streamed GET response for the
+                    link, handlers that answer from an API set this False
+                    and the generic GET is skipped
+
+    """
+
+    name = "handler"
+    domains: Tuple[str, ...] = ()
+    needs_body = True
+
+    @abstractmethod
+    def handle(
+        self, link: str, response: Optional[requests.Response], apis: configparser.ConfigParser
+    ) -> Optional[str]:
+        """Describe a link.
+
+        Args:
+            link:     The link to be described
+            response: The streamed GET response if needs_body is set, else None
+            apis:     A configparser object containing API auth info
+
+        Returns:
+            The text to reply with, or None to fall back to generic handling,
+            a handler given a response must not have read from it if so
+
+        Raises:
+            RequestError: A request the handler made failed, raised rather than
+                          described in the return value so it isn't cached
+
+        """
+
+
+def _labels(domain: str) -> Tuple[str, ...]:
+    """Split a domain into its labels, top level first."""
+    return tuple(reversed(domain.lower().rstrip(".").split(".")))
+
+
+class HandlerRegistry:
+    """Maps hostnames to the handler of their most specific registered domain."""
+
+    def __init__(self, handlers: Iterable[Handler] = ()):
+        """Initialize registry.
+
+        Args:
+            handlers: Handlers to register straight away
+
+        """
+        self._index: Dict[Tuple[str, ...], Handler] = {}
+        for handler in handlers:
+            self.register(handler)
+
+    def register(self, handler: Handler) -> Handler:
+        """Add a handler for each of its domains, replacing any already there.
+
+        Args:
+            handler: The handler to add
+
+        Returns:
+            The handler, so this can be applied to an instance as it is created
+
+        """
+        for domain in handler.domains:
+            self._index[_labels(domain)] = handler
+        return handler
+
+    def find(self, link: str) -> Optional[Handler]:
+        """Find the handler for a link.
+
+        Args:
+            link: The link to be scanned
+
+        Returns:
+            The handler registered for the longest suffix of the link's
+            hostname, or None if there isn't one
+
+        """
+        labels = _labels(urlsplit(link).hostname or "")
+        for end in range(len(labels), 0, -1):
+            handler = self._index.get(labels[:end])
+            if handler is not None:
+                return handler
+        return None
+
+    def __len__(self) -> int:
+        """Return the number of domains registered."""
+        return len(self._index)
+
+
+registry = HandlerRegistry()
+"""The registry scrape dispatches links through."""
+
+
+def register(handler: Handler) -> Handler:
+    """Add a handler to the shared registry, see HandlerRegistry.register."""
+    return registry.register(handler)
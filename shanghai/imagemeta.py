@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Image dimension and format sniffing from file headers.
+
+Reads only the first few KB of an image, so the dimensions of a linked image
+can be reported without downloading or decoding it.
+
+"""
+
+import struct
+from typing import Callable, Optional, Tuple
+
+
+HEAD_BYTES = 16 * 1024
+"""Bytes read from the start of an image on the first request."""
+
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class ImageInfo:
+    """Format, dimensions and animation of an image."""
+
+    __slots__ = ("format", "width", "height", "frames", "animated")
+
+    def __init__(self, fmt: str, width: int, height: int, *, frames: Optional[int] = None, animated: bool = False):
+        """Initialize image info.
+
+        Args:
+            fmt:      Image format, such as PNG
+            width:    Width in pixels
+            height:   Height in pixels
+            frames:   Number of frames, if the header gives it
+            animated: Whether the image is animated
+
+        """
+        self.format = fmt
+        self.width = width
+        self.height = height
+        self.frames = frames
+        self.animated = animated or (frames is not None and frames > 1)
+
+    def __str__(self) -> str:
+        """Return the info as shown in link replies, such as 640x480 12 frames."""
+        text = f"{self.width}x{self.height}"
+        if self.frames is not None and self.frames > 1:
+            return f"{text} {self.frames} frames"
+        return f"{text} animated" if self.animated else text
+
+
+def _png(data: bytes) -> Optional[ImageInfo]:
+    """Read the IHDR chunk, and the APNG acTL chunk if it precedes the image data."""
+    if len(data) < 24 or data[12:16] != b"IHDR":
+        return None
+    width, height = struct.unpack(">II", data[16:24])
+    frames = None
+    pos = 8
+    while pos + 8 <= len(data):
+        length, kind = struct.unpack(">I4s", data[pos : pos + 8])
+        if kind == b"acTL" and pos + 12 <= len(data):
+            frames = struct.unpack(">I", data[pos + 8 : pos + 12])[0]
+            break
+        if kind == b"IDAT":
+            break
+        pos += length + 12
+    return ImageInfo("PNG", width, height, frames=frames)
+
+
+def _gif(data: bytes) -> Optional[ImageInfo]:
+    """Read the logical screen size, and look for the looping extension."""
+    if len(data) < 10:
+        return None
+    width, height = struct.unpack("<HH", data[6:10])
+    return ImageInfo("GIF", width, height, animated=b"NETSCAPE2.0" in data)
+
+
+def _webp(data: bytes) -> Optional[ImageInfo]:
+    """Read the size from the first VP8, VP8L or VP8X chunk."""
+    kind = data[12:16]
+    if kind == b"VP8 " and len(data) >= 30:
+        width, height = struct.unpack("<HH", data[26:30])
+        return ImageInfo("WebP", width & 0x3FFF, height & 0x3FFF)
+    if kind == b"VP8L" and len(data) >= 25:
+        bits = int.from_bytes(data[21:25], "little")
+        return ImageInfo("WebP", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+    if kind == b"VP8X" and len(data) >= 30:
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        animated = bool(data[20] & 0x02)
+        return ImageInfo("WebP", width, height, animated=animated)
+    return None
+
+
+def _avif(data: bytes) -> Optional[ImageInfo]:
+    """Read the largest image spatial extents (ispe) property in the header."""
+    best: Optional[Tuple[int, int]] = None
+    pos = data.find(b"ispe")
+    while pos != -1 and pos + 16 <= len(data):
+        width, height = struct.unpack(">II", data[pos + 8 : pos + 16])
+        if best is None or width * height > best[0] * best[1]:
+            best = (width, height)
+        pos = data.find(b"ispe", pos + 4)
+    if best is None:
+        return None
+    return ImageInfo("AVIF", best[0], best[1], animated=b"avis" in data[8:32])
+
+
+def _jpeg(read: Callable[[int, int], bytes], data: bytes) -> Tuple[Optional[ImageInfo], int]:
+    """Walk JPEG segments to the start of frame, fetching past large segments.
+
+    Args:
+        read: Returns length bytes from offset in the file
+        data: The first bytes of the file
+
+    Returns:
+        The info, or None if no start of frame was found, and the bytes read
+        beyond the first block
+
+    Notes:
+        EXIF and ICC segments can run to tens of KB before the frame header,
+        rather than reading through them their lengths are used to jump over.
+
+    """
+    base = 0
+    extra = 0
+    pos = 2
+    for _ in range(16):
+        while pos + 9 <= base + len(data):
+            local = pos - base
+            if data[local] != 0xFF:
+                return None, extra
+            marker = data[local + 1]
+            if marker == 0xFF:
+                pos += 1
+                continue
+            if marker in _JPEG_SOF:
+                height, width = struct.unpack(">HH", data[local + 5 : local + 9])
+                return ImageInfo("JPEG", width, height), extra
+            if marker == 0xD8 or 0xD0 <= marker <= 0xD7:
+                pos += 2
+                continue
+            pos += 2 + struct.unpack(">H", data[local + 2 : local + 4])[0]
+        data = read(pos, 4096)
+        if not data:
+            break
+        base = pos
+        extra += len(data)
+    return None, extra
+
+
+def probe_image(read: Callable[[int, int], bytes], *, head_bytes: int = HEAD_BYTES) -> Tuple[Optional[ImageInfo], int]:
+    """Identify an image and its dimensions from its headers.
+
+    Args:
+        read:       Returns length bytes from offset in the file, fewer at the
+                    end of the file
+        head_bytes: Bytes to read from the start of the file
+
+    Returns:
+        The info, or None if the format isn't recognised or the header is
+        incomplete, and the total bytes read
+
+    """
+    data = read(0, head_bytes)
+    info: Optional[ImageInfo] = None
+    extra = 0
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        info = _png(data)
+    elif data[:6] in (b"GIF87a", b"GIF89a"):
+        info = _gif(data)
+    elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        info = _webp(data)
+    elif data[4:8] == b"ftyp" and (b"avif" in data[8:32] or b"avis" in data[8:32]):
+        info = _avif(data)
+    elif data[:2] == b"\xff\xd8":
+        info, extra = _jpeg(read, data)
+    return info, len(data) + extra
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Logging pipeline for Shanghai.
+
+The handlers loaded from logging.ini can be moved behind a queue, so logging
+a record costs the bot's thread a put rather than a write to disk, and the
+writes happen on a background thread. Chatty loggers can also be sampled,
+keeping only one in every so many of their debug records.
+
+Both are set up from two extra sections of logging.ini, which fileConfig
+itself ignores::
+
+    [pipeline]
+    queue = yes
+
+    [sampling]
+    shanghai.connection = 100
+
+"""
+
+import atexit
+import configparser
+import logging
+import logging.handlers
+import queue
+from typing import Any, List
+
+
+class SampleFilter(logging.Filter):
+    """Passes one in every so many records at or below a level."""
+
+    def __init__(self, every: int, *, level: int = logging.DEBUG):
+        """Initialize filter.
+
+        Args:
+            every: Keep one record out of this many, the first being kept
+            level: Records above this level always pass
+
+        Notes:
+            The counters are not locked, under contention from several threads
+            the sampling is approximate rather than exact.
+
+        """
+        super(SampleFilter, self).__init__()
+        self.every = max(1, every)
+        self.level = level
+        self.seen = 0
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Return whether the record should be logged."""
+        if record.levelno > self.level:
+            return True
+        self.seen += 1
+        if (self.seen - 1) % self.every:
+            self.dropped += 1
+            return False
+        return True
+
+
+class _LocalQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler for a listener in the same process."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Merge the arguments into the message, leaving the rest to the listener.
+
+        Notes:
+            The stock handler formats and copies every record so it can be
+            pickled, which costs more than the write it saves. Here only the
+            arguments are resolved, so later changes to them can't alter the
+            message, while exc_info and formatting stay with the listener.
+
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def sample(name: str, every: int, *, level: int = logging.DEBUG) -> SampleFilter:
+    """Sample the records logged directly to a logger.
+
+    Args:
+        name:  The logger, such as shanghai.connection, or root
+        every: Keep one record out of this many
+        level: Records above this level are never dropped
+
+    Returns:
+        The filter added to the logger
+
+    Notes:
+        Logger filters only see records logged to that logger, not those
+        propagating up from its children, so each chatty module is named.
+
+    """
+    sampler = SampleFilter(every, level=level)
+    logging.getLogger(None if name == "root" else name).addFilter(sampler)
+    return sampler
+
+
+def start_queue(logger: logging.Logger) -> logging.handlers.QueueListener:
+    """Move a logger's handlers behind a queue served by a background thread.
+
+    Args:
+        logger: The logger, normally the root logger
+
+    Returns:
+        The running listener, which is stopped, flushing the queue, at exit
+
+    Notes:
+        Each handler keeps its own level. Records only reach the queue once
+        they have passed the logger's level and filters.
+
+    """
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    handlers = list(logger.handlers)
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(_LocalQueueHandler(records))  # type: ignore
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)  # type: ignore
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+class _Dispatcher(logging.Handler):
+    """Passes records forwarded from another process to this process's handlers."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """Hand the record to the handlers its logger would have used here.
+
+        Notes:
+            Levels and filters were already applied in the process that
+            logged it, so they aren't applied again, sampling would otherwise
+            drop records twice.
+
+        """
+        logging.getLogger(None if record.name == "root" else record.name).callHandlers(record)
+
+
+def forward(records: Any) -> None:
+    """Send this process's log records to another process instead of writing them.
+
+    Args:
+        records: A multiprocessing queue served by serve in the other process
+
+    Notes:
+        Run in worker processes after fileConfig, so loggers keep the levels
+        and filters the config gives them while only one process writes to,
+        and rotates, the log files.
+
+    """
+    loggers = [logging.getLogger()]
+    loggers.extend(found for found in logging.Logger.manager.loggerDict.values() if isinstance(found, logging.Logger))
+    for found in loggers:
+        handlers = [handler for handler in found.handlers if not isinstance(handler, logging.NullHandler)]
+        for handler in handlers:
+            found.removeHandler(handler)
+            handler.close()
+        # Records from other loggers propagate to the root's handler, so they're only sent once
+        if handlers and (found is loggers[0] or not found.propagate):
+            found.addHandler(logging.handlers.QueueHandler(records))
+
+
+def serve(records: Any) -> logging.handlers.QueueListener:
+    """Write records sent by forward from other processes through this process's handlers.
+
+    Args:
+        records: The multiprocessing queue the other processes forward to
+
+    Returns:
+        The running listener, stop it once the other processes are done
+
+    """
+    listener = logging.handlers.QueueListener(records, _Dispatcher())
+    listener.start()
+    return listener
+
+
+def install(path: str = "config/logging.ini") -> List[logging.handlers.QueueListener]:
+    """Apply the pipeline and sampling sections of a logging config.
+
+    Args:
+        path: The logging config, already loaded with fileConfig
+
+    Returns:
+        The queue listeners started, one per logger with handlers that write
+        somewhere, none if the queue is turned off
+
+    Raises:
+        ValueError: A sampling rate is not a whole number
+
+    """
+    logger = logging.getLogger(__name__)
+    config = configparser.ConfigParser(default_section="__defaults__")
+    # Logger names are case sensitive
+    config.optionxform = str  # type: ignore
+    config.read(path)
+    if config.has_section("sampling"):
+        for name, every in config["sampling"].items():
+            sample(name, int(every))
+            logger.info("Sampling one in %s debug records from %s", every, name)
+    if not config.getboolean("pipeline", "queue", fallback=False):
+        return []
+    loggers = [logging.getLogger()]
+    loggers.extend(found for found in logging.Logger.manager.loggerDict.values() if isinstance(found, logging.Logger))
+    # Libraries attach a NullHandler to stay quiet, there is nothing to move off the thread
+    listeners = [
+        start_queue(found)
+        for found in loggers
+        if any(not isinstance(handler, logging.NullHandler) for handler in found.handlers)
+    ]
+    logger.info("Logging through a queue for %s loggers", len(listeners))
+    return listeners
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Counters and latency histograms for Shanghai.
+
+Each stage of handling messages and links records how long it took in a
+histogram with fixed buckets, and counters track how much passed through.
+Everything is kept in process and rendered in the Prometheus text format on
+request, either from a local HTTP endpoint or a file rewritten periodically
+for a node exporter's textfile collector.
+
+Recording is a lock and a few additions, well under a microsecond, cheap
+enough for every message. Per message paths call perf_counter and observe
+directly, as the Timer context manager costs a few times more.
+
+"""
+
+from bisect import bisect_left
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar, Union
+
+
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+"""Default histogram bucket bounds in seconds, from sub-millisecond parsing to slow scrapes."""
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+
+class CounterValue:
+    """A single counter, for one set of label values."""
+
+    def __init__(self) -> None:
+        """Initialize at zero."""
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        """Add to the counter."""
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name: str, labels: str) -> List[str]:
+        """Return the exposition lines for this counter."""
+        return [f"{name}{{{labels}}} {self.value:g}" if labels else f"{name} {self.value:g}"]
+
+
+class HistogramValue:
+    """A single histogram, for one set of label values."""
+
+    def __init__(self, bounds: Sequence[float]):
+        """Initialize empty.
+
+        Args:
+            bounds: Sorted upper bounds of the buckets, +Inf is implied
+
+        """
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """Record a value, normally a duration in seconds."""
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> "Timer":
+        """Return a context manager observing how long its block takes."""
+        return Timer(self)
+
+    def samples(self, name: str, labels: str) -> List[str]:
+        """Return the exposition lines for this histogram, with cumulative buckets."""
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        prefix = f"{labels}," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, hits in zip(self.bounds + (float("inf"),), counts):
+            cumulative += hits
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {total:.6f}")
+        lines.append(f"{name}_count{suffix} {count}")
+        return lines
+
+
+class Timer:
+    """Context manager observing the duration of its block in a histogram."""
+
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: HistogramValue):
+        """Initialize timer, timing starts on entering the block."""
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self) -> "Timer":
+        """Start timing."""
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        """Observe the time taken, whether or not the block raised."""
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Metric:
+    """A named metric and its values, one for each set of label values."""
+
+    def __init__(self, kind: str, name: str, description: str, labels: Sequence[str], bounds: Sequence[float]):
+        """Initialize metric, use counter or histogram rather than this directly.
+
+        Args:
+            kind:        counter or histogram
+            name:        Metric name, such as shanghai_messages_total
+            description: Help text
+            labels:      Label names, values are given in the same order
+            bounds:      Bucket bounds, for histograms
+
+        """
+        self.kind = kind
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self.bounds = tuple(bounds)
+        self._values: Dict[Tuple[str, ...], Union[CounterValue, HistogramValue]] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str) -> Any:
+        """Return the value for a set of label values, created on first use.
+
+        Args:
+            *values: One value for each label name
+
+        Returns:
+            A CounterValue or HistogramValue, which callers on hot paths
+            should look up once and keep
+
+        Raises:
+            ValueError: The wrong number of label values was given
+
+        """
+        if len(values) != len(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {values}")
+        value = self._values.get(values)
+        if value is None:
+            with self._lock:
+                value = self._values.get(values)
+                if value is None:
+                    value = CounterValue() if self.kind == "counter" else HistogramValue(self.bounds)
+                    self._values[values] = value
+        return value
+
+    def render(self) -> List[str]:
+        """Return the exposition lines for every set of label values."""
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            labels = ",".join(
+                f'{name}="{_escape(label)}"' for name, label in zip(self.label_names, label_values)
+            )
+            lines.extend(value.samples(self.name, labels))
+        return lines
+
+
+_metrics: List[Metric] = []
+
+
+def counter(name: str, description: str, labels: Sequence[str] = ()) -> Metric:
+    """Create and register a counter.
+
+    Args:
+        name:        Metric name, ending in _total
+        description: Help text
+        labels:      Label names
+
+    Returns:
+        The metric, see Metric.labels
+
+    """
+    metric = Metric("counter", name, description, labels, ())
+    _metrics.append(metric)
+    return metric
+
+
+def histogram(name: str, description: str, labels: Sequence[str] = (), bounds: Sequence[float] = BUCKETS) -> Metric:
+    """Create and register a histogram.
+
+    Args:
+        name:        Metric name, ending in the unit such as _seconds
+        description: Help text
+        labels:      Label names
+        bounds:      Sorted bucket upper bounds
+
+    Returns:
+        The metric, see Metric.labels
+
+    """
+    metric = Metric("histogram", name, description, labels, sorted(bounds))
+    _metrics.append(metric)
+    return metric
+
+
+def timed(value: HistogramValue) -> Callable[[_F], _F]:
+    """Decorate a function to observe how long each call takes.
+
+    Args:
+        value: The histogram value to observe into
+
+    """
+
+    def decorator(func: _F) -> _F:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with Timer(value):
+                return func(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+def render() -> str:
+    """Return every registered metric in the Prometheus text format."""
+    lines = []
+    for metric in list(_metrics):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    """Escape a label value for the text format."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+STAGE_SECONDS = histogram(
+    "shanghai_stage_seconds", "Time spent in each stage of handling messages and links", ("stage",)
+)
+MESSAGES = counter("shanghai_messages_total", "IRC messages received", ("network",))
+RECEIVED_BYTES = counter("shanghai_received_bytes_total", "Bytes received from IRC servers")
+LINKS = counter("shanghai_links_total", "Links seen in messages, by what was done with them", ("result",))
+REPLIES = counter("shanghai_link_replies_total", "Finished link scrapes, by whether they were sent", ("result",))
+LINK_REPLY_SECONDS = histogram(
+    "shanghai_link_reply_seconds", "Time from a link being seen until its reply is queued to send"
+).labels()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serves the metrics page."""
+
+    def do_GET(self) -> None:
+        """Answer a scrape of /metrics."""
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        """Log requests at debug rather than to stderr."""
+        logging.getLogger(__name__).debug(format, *args)
+
+
+class Exporter:
+    """Publishes the metrics over local HTTP, to a textfile, or both."""
+
+    def __init__(self, *, port: int = 0, host: str = "127.0.0.1", textfile: str = "", interval: float = 15):
+        """Initialize exporter, call start to begin publishing.
+
+        Args:
+            port:     Port to serve /metrics on, 0 for no HTTP endpoint
+            host:     Address to bind, local only by default
+            textfile: File to rewrite with the metrics, empty for none
+            interval: Seconds between rewrites of the textfile
+
+        """
+        self.port = port
+        self.host = host
+        self.textfile = textfile
+        self.interval = interval
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        """Start serving and writing in background threads.
+
+        Notes:
+            A port that can't be bound, as when already in use, is logged and
+            skipped rather than raised, the textfile is still written.
+
+        """
+        logger = logging.getLogger(__name__)
+        self._stopping.clear()
+        if self.port:
+            try:
+                self._server = ThreadingHTTPServer((self.host, self.port), _Handler)
+            except OSError as inst:
+                logger.error("Could not serve metrics on %s:%s, not serving them", self.host, self.port, exc_info=inst)
+            else:
+                self._server.daemon_threads = True
+                self._spawn(self._server.serve_forever)
+                logger.info("Serving metrics on http://%s:%s/metrics", self.host, self._server.server_address[1])
+        if self.textfile:
+            self._spawn(self._write_loop)
+            logger.info("Writing metrics to %s every %ss", self.textfile, self.interval)
+
+    def stop(self) -> None:
+        """Stop serving, writing the textfile one last time."""
+        self._stopping.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def write(self) -> None:
+        """Rewrite the textfile, replacing it atomically so readers never see half of it."""
+        directory = os.path.dirname(self.textfile)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        partial = f"{self.textfile}.{os.getpid()}.tmp"
+        with open(partial, "w", encoding="utf-8") as out:
+            out.write(render())
+        os.replace(partial, self.textfile)
+
+    def _spawn(self, target: Callable[[], None]) -> None:
+        """Run target in a daemon thread."""
+        thread = threading.Thread(target=target, name="shanghai-metrics", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _write_loop(self) -> None:
+        """Rewrite the textfile every interval until stopped."""
+        while True:
+            try:
+                self.write()
+            except OSError as inst:
+                logging.getLogger(__name__).warning("Could not write metrics to %s", self.textfile, exc_info=inst)
+            if self._stopping.wait(self.interval):
+                break
+        try:
+            self.write()
+        except OSError:
+            pass
+
+
+_exporter: Optional[Exporter] = None
+
+
+def configure(*, port: int = 0, textfile: str = "", interval: float = 15) -> Optional[Exporter]:
+    """Start the shared exporter, or none if there is nowhere to publish to.
+
+    Args:
+        port:     Port to serve /metrics on at 127.0.0.1, 0 for none
+        textfile: File to rewrite with the metrics, empty for none
+        interval: Seconds between rewrites of the textfile
+
+    Returns:
+        The started exporter, or None if disabled
+
+    Notes:
+        Metrics are recorded whether or not they are published.
+
+    """
+    global _exporter
+    if _exporter is not None:
+        _exporter.stop()
+        _exporter = None
+    if port or textfile:
+        _exporter = Exporter(port=port, textfile=textfile, interval=interval)
+        _exporter.start()
+    return _exporter
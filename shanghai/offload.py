@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Optional process pool for page title parsing.
+
+Title parsing is pure Python and holds the GIL, so when many links arrive at
+once it can starve the socket loop. With a pool configured, page bytes are
+parsed in separate processes instead, spreading the work across cores.
+
+"""
+
+import logging
+import multiprocessing
+import multiprocessing.pool
+import threading
+from typing import Dict, Optional
+
+from .exceptions import TitleError
+from .titles import TitleExtractor
+
+
+def _extract(data: bytes, declared: Optional[str], max_bytes: int) -> Optional[str]:
+    """Find the title of a page, run in a pool process."""
+    extractor = TitleExtractor(declared=declared, max_bytes=max_bytes)
+    extractor.feed(data)
+    return extractor.title()
+
+
+def _warm(_: int) -> None:
+    """Do nothing, used to have every pool process started and importing before it is needed."""
+
+
+class ParserPool:
+    """Pool of processes parsing page titles, with per-job timeouts and size limits."""
+
+    def __init__(self, *, processes: int = 2, timeout: float = 5, max_bytes: int = 256 * 1024):
+        """Initialize pool, call start to launch its processes.
+
+        Args:
+            processes: Number of parsing processes
+            timeout:   Seconds a single page may take to parse
+            max_bytes: Most bytes of a page sent to be parsed
+
+        """
+        self.processes = processes
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.parsed = 0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+        self._pool: Optional[multiprocessing.pool.Pool] = None
+        self._stopped = False
+
+    def start(self) -> None:
+        """Launch the processes and wait until each has started.
+
+        Notes:
+            forkserver is used where available, so the processes don't inherit
+            the bot's sockets and threads.
+
+        """
+        with self._lock:
+            self._stopped = False
+        self._launch()
+
+    def _launch(self) -> None:
+        """Launch the processes, unless the pool was stopped meanwhile."""
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        pool = context.Pool(self.processes)
+        pool.map(_warm, range(self.processes), chunksize=1)
+        with self._lock:
+            stopped = self._stopped
+            if not stopped:
+                self._pool = pool
+        if stopped:
+            pool.terminate()
+            return
+        logging.getLogger(__name__).info("Started %s title parsing processes", self.processes)
+
+    def stop(self) -> None:
+        """Stop the processes, abandoning any parses in progress."""
+        with self._lock:
+            self._stopped = True
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.terminate()
+
+    def title(self, data: bytes, declared: Optional[str] = None) -> Optional[str]:
+        """Parse the title out of the start of a page.
+
+        Args:
+            data:     The first bytes of the page, beyond max_bytes are ignored
+            declared: Charset from the Content-Type header, if it had one
+
+        Returns:
+            The title, or None if the page has none
+
+        Raises:
+            TitleError: The pool isn't running or the parse took too long
+
+        Notes:
+            A parse that times out may be stuck, so the processes are replaced,
+            failing any other parses running at the time.
+
+        """
+        with self._lock:
+            pool = self._pool
+        if pool is None:
+            raise TitleError(error="Title parsing pool is not running")
+        job = pool.apply_async(_extract, (data[: self.max_bytes], declared, self.max_bytes))
+        try:
+            title = job.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            logging.getLogger(__name__).warning("Title parse timed out after %ss, restarting pool", self.timeout)
+            with self._lock:
+                self.timeouts += 1
+            self._restart(pool)
+            raise TitleError(error=f"Parsing took over {self.timeout}s")
+        with self._lock:
+            self.parsed += 1
+        return title
+
+    def stats(self) -> Dict[str, int]:
+        """Return the process count and the number of pages parsed and timed out."""
+        with self._lock:
+            return {"processes": self.processes, "parsed": self.parsed, "timeouts": self.timeouts}
+
+    def _restart(self, pool: multiprocessing.pool.Pool) -> None:
+        """Replace the processes, unless another thread already has or the pool was stopped."""
+        with self._lock:
+            if self._stopped or self._pool is not pool:
+                return
+            self._pool = None
+        pool.terminate()
+        self._launch()
+
+
+_pool: Optional[ParserPool] = None
+
+
+def configure(*, processes: int, timeout: float = 5, max_bytes: int = 256 * 1024) -> Optional[ParserPool]:
+    """Start a shared parsing pool, or parse in the calling thread if processes is 0.
+
+    Args:
+        processes: Number of parsing processes, 0 to disable the pool
+        timeout:   Seconds a single page may take to parse
+        max_bytes: Most bytes of a page sent to be parsed
+
+    Returns:
+        The started pool, or None if disabled
+
+    """
+    global _pool
+    if _pool is not None:
+        _pool.stop()
+        _pool = None
+    if processes > 0:
+        _pool = ParserPool(processes=processes, timeout=timeout, max_bytes=max_bytes)
+        _pool.start()
+    return _pool
+
+
+def pool() -> Optional[ParserPool]:
+    """Return the shared parsing pool, or None if titles are parsed in the calling thread."""
+    return _pool
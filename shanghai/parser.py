@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""IRC message parsing for Shanghai.
+
+Parses lines per RFC 1459 / RFC 2812 with IRCv3 message tags, in a single
+left to right pass using str.find rather than a regular expression.
+
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from .exceptions import ParseError
+
+
+_TAG_ESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+
+class Message:
+    """A single parsed IRC message."""
+
+    __slots__ = ("tags", "nick", "user", "host", "command", "params")
+
+    def __init__(
+        self,
+        command: str,
+        params: List[str],
+        *,
+        tags: Optional[Dict[str, str]] = None,
+        nick: Optional[str] = None,
+        user: Optional[str] = None,
+        host: Optional[str] = None,
+    ):
+        """Initialize message.
+
+        Args:
+            command: Uppercased command, or three digit numeric reply
+            params:  Parameters, including the trailing parameter if present
+            tags:    IRCv3 message tags, unescaped
+            nick:    Nick (or server name) from the message prefix
+            user:    User from the message prefix
+            host:    Host from the message prefix
+
+        """
+        self.tags = tags if tags is not None else {}
+        self.nick = nick
+        self.user = user
+        self.host = host
+        self.command = command
+        self.params = params
+
+    def __repr__(self) -> str:
+        """Return a readable representation for logging."""
+        return f"Message(command={self.command!r}, params={self.params!r}, nick={self.nick!r}, tags={self.tags!r})"
+
+    @property
+    def target(self) -> Optional[str]:
+        """First parameter, the target of a PRIVMSG, NOTICE and most numerics."""
+        return self.params[0] if self.params else None
+
+    @property
+    def text(self) -> str:
+        """Last parameter, the text of a PRIVMSG or NOTICE."""
+        return self.params[-1] if self.params else ""
+
+    @property
+    def ctcp(self) -> Optional[Tuple[str, str]]:
+        """CTCP command and arguments if the text is a CTCP request, else None."""
+        text = self.text
+        if len(text) < 2 or text[0] != "\x01":
+            return None
+        command, _, args = text.strip("\x01").partition(" ")
+        return command.upper(), args
+
+
+def _unescape(value: str) -> str:
+    """Unescape an IRCv3 tag value."""
+    if "\\" not in value:
+        return value
+    out = []
+    chars = iter(value)
+    for char in chars:
+        if char == "\\":
+            escaped = next(chars, "")
+            char = _TAG_ESCAPES.get(escaped, escaped)
+        out.append(char)
+    return "".join(out)
+
+
+def _parse_tags(raw: str) -> Dict[str, str]:
+    """Parse the tags section of a message, without its leading @."""
+    tags = {}
+    for tag in raw.split(";"):
+        key, _, value = tag.partition("=")
+        if key:
+            tags[key] = _unescape(value)
+    return tags
+
+
+def parse(line: str) -> Message:
+    """Parse a single IRC line.
+
+    Args:
+        line: The line, with or without its CRLF
+
+    Returns:
+        The parsed Message
+
+    Raises:
+        ParseError: The line has no command
+
+    Notes:
+        The trailing parameter is located with one find, which leaves only the
+        short middle section to be split, so message text is never scanned
+        more than once however long it is.
+
+    """
+    rest = line.rstrip("\r\n")
+    tags = None
+    nick = user = host = None
+
+    if rest[:1] == "@":
+        raw, _, rest = rest.partition(" ")
+        tags = _parse_tags(raw[1:])
+        rest = rest.lstrip(" ")
+
+    if rest[:1] == ":":
+        source, _, rest = rest.partition(" ")
+        nick, _, host = source[1:].partition("@")
+        nick, _, user = nick.partition("!")
+        user = user or None
+        host = host or None
+        rest = rest.lstrip(" ")
+
+    trailing = rest.find(" :")
+    if trailing != -1:
+        params = rest[:trailing].split()
+        params.append(rest[trailing + 2 :])
+    else:
+        params = rest.split()
+    if not params or params[0][0] == ":":
+        raise ParseError(line=line, error="Message has no command")
+    command = params.pop(0).upper()
+
+    return Message(command, params, tags=tags, nick=nick, user=user, host=host)
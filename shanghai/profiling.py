@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""On demand profiling of the running bot.
+
+A run profiles the live process for a set time, then writes its results and
+a snapshot of the largest allocations made meanwhile to the log directory,
+so a slowdown can be looked into without restarting and losing whatever
+caused it. Only one run can be active in a process at a time.
+
+Two kinds of run are offered:
+    cprofile: Deterministic profile of the bot's own thread, exact call counts
+              but slowing that thread down while it runs
+    sample:   Samples the stack of every thread at an interval, cheap enough
+              to leave on for minutes, and written as folded stacks that
+              flame graph tools read directly
+
+"""
+
+from collections import Counter
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+
+KINDS = ("cprofile", "sample")
+"""Kinds of profiling run."""
+
+MAX_SECONDS = 3600
+"""Longest a run may be asked to last."""
+
+
+class StackSampler:
+    """Counts the stacks every thread is in, sampled from a background thread."""
+
+    def __init__(self, interval: float = 0.005):
+        """Initialize sampler, call start to begin sampling.
+
+        Args:
+            interval: Seconds between samples
+
+        """
+        self.interval = interval
+        self.stacks: "Counter[str]" = Counter()
+        self.samples = 0
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start sampling."""
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._sample, name="shanghai-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling and wait for the sampling thread to finish."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _sample(self) -> None:
+        """Record the stack of every other thread until stopped."""
+        own = threading.get_ident()
+        while not self._stopping.wait(self.interval):
+            names: Dict[int, str] = {thread.ident: thread.name for thread in threading.enumerate() if thread.ident}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                calls: List[str] = []
+                current = frame
+                while current is not None:
+                    code = current.f_code
+                    calls.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    current = current.f_back
+                calls.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(calls))] += 1
+            self.samples += 1
+
+    def write(self, path: str) -> None:
+        """Write the stacks in folded format, one stack and its count per line."""
+        with open(path, "w", encoding="utf-8") as out:
+            for stack, count in self.stacks.most_common():
+                out.write(f"{stack} {count}\n")
+
+    def summary(self, limit: int = 40) -> str:
+        """Return the functions most often on top of a stack, with their share of samples."""
+        tops: "Counter[str]" = Counter()
+        for stack, count in self.stacks.items():
+            tops[stack.rsplit(";", 1)[-1]] += count
+        total = sum(tops.values()) or 1
+        lines = [f"{self.samples} samples every {self.interval * 1000:g}ms across all threads", ""]
+        lines.extend(f"{count * 100 / total:6.2f}% {count:8} {frame}" for frame, count in tops.most_common(limit))
+        return "\n".join(lines) + "\n"
+
+
+class ProfileRun:
+    """One profiling run and the allocation tracing alongside it."""
+
+    def __init__(self, kind: str, seconds: float, *, directory: str = "logs", label: str = ""):
+        """Initialize run, call start to begin profiling.
+
+        Args:
+            kind:      cprofile or sample
+            seconds:   How long the run should last
+            directory: Where results are written
+            label:     Added to file names, such as the network
+
+        Raises:
+            ValueError: The kind is unknown or seconds out of range
+
+        """
+        if kind not in KINDS:
+            raise ValueError(f"Unknown profiler {kind}, expected one of {', '.join(KINDS)}")
+        if not 0 < seconds <= MAX_SECONDS:
+            raise ValueError(f"Profiling time must be between 0 and {MAX_SECONDS} seconds")
+        self.kind = kind
+        self.seconds = seconds
+        self.directory = directory
+        self.label = label
+        self.started = 0.0
+        self._profile: Optional[cProfile.Profile] = None
+        self._sampler: Optional[StackSampler] = None
+        self._tracing = False
+
+    @property
+    def expired(self) -> bool:
+        """Whether the run has lasted as long as it was asked to."""
+        return time.monotonic() - self.started >= self.seconds
+
+    def start(self) -> None:
+        """Begin profiling and tracing allocations.
+
+        Notes:
+            A cprofile run only sees the thread that starts it, which must be
+            the one that stops it.
+
+        """
+        self.started = time.monotonic()
+        # Leave tracing alone if it was already on, such as from PYTHONTRACEMALLOC
+        self._tracing = not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start()
+        if self.kind == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = StackSampler()
+            self._sampler.start()
+        logging.getLogger(__name__).info("Started %s profiling for %ss", self.kind, self.seconds)
+
+    def stop(self) -> List[str]:
+        """End profiling and write the results.
+
+        Returns:
+            Paths of the files written
+
+        """
+        if self._profile is not None:
+            self._profile.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+        snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        if self._tracing:
+            tracemalloc.stop()
+        os.makedirs(self.directory, exist_ok=True)
+        stem = os.path.join(
+            self.directory,
+            "-".join(part for part in ("profile", self.label, time.strftime("%Y%m%d-%H%M%S"), self.kind) if part),
+        )
+        paths = []
+        if self._profile is not None:
+            self._profile.dump_stats(f"{stem}.pstats")
+            summary = io.StringIO()
+            pstats.Stats(self._profile, stream=summary).sort_stats("cumulative").print_stats(40)
+            with open(f"{stem}.txt", "w", encoding="utf-8") as out:
+                out.write(summary.getvalue())
+            paths.extend([f"{stem}.pstats", f"{stem}.txt"])
+        if self._sampler is not None:
+            self._sampler.write(f"{stem}.folded")
+            with open(f"{stem}.txt", "w", encoding="utf-8") as out:
+                out.write(self._sampler.summary())
+            paths.extend([f"{stem}.folded", f"{stem}.txt"])
+        if snapshot is not None:
+            with open(f"{stem}-alloc.txt", "w", encoding="utf-8") as out:
+                out.write(_allocations(snapshot))
+            paths.append(f"{stem}-alloc.txt")
+        logging.getLogger(__name__).info("Finished %s profiling, wrote %s", self.kind, ", ".join(paths))
+        return paths
+
+
+def _allocations(snapshot: tracemalloc.Snapshot, limit: int = 25) -> str:
+    """Return the lines that allocated the most memory still held when the snapshot was taken."""
+    # Leave out the sampler's own stacks and tracemalloc's bookkeeping
+    ignored = (__file__, tracemalloc.__file__, "<frozen importlib._bootstrap>")
+    stats = snapshot.filter_traces([tracemalloc.Filter(False, pattern) for pattern in ignored]).statistics("lineno")
+    total = sum(stat.size for stat in stats)
+    lines = [f"{total / 1024:.1f} KiB allocated during the run and still held, top {limit} lines", ""]
+    for stat in stats[:limit]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size / 1024:10.1f} KiB {stat.count:8} blocks  {frame.filename}:{frame.lineno}")
+    return "\n".join(lines) + "\n"
+
+
+_current: Optional[ProfileRun] = None
+_current_lock = threading.Lock()
+
+
+def start(kind: str, seconds: float, *, directory: str = "logs", label: str = "") -> ProfileRun:
+    """Start a run, unless one is already active in this process.
+
+    Args:
+        kind:      cprofile or sample
+        seconds:   How long the run should last
+        directory: Where results are written
+        label:     Added to file names, such as the network
+
+    Returns:
+        The started run, to be passed to finish once it has expired
+
+    Raises:
+        ValueError: The kind or time is invalid
+        RuntimeError: Another run is active
+
+    """
+    global _current
+    run = ProfileRun(kind, seconds, directory=directory, label=label)
+    with _current_lock:
+        if _current is not None:
+            raise RuntimeError(f"A {_current.kind} run is already active")
+        run.start()
+        _current = run
+        return run
+
+
+def finish(run: ProfileRun) -> List[str]:
+    """Stop a run and write its results.
+
+    Args:
+        run: The run from start
+
+    Returns:
+        Paths of the files written, empty if the run had already finished
+
+    """
+    global _current
+    with _current_lock:
+        if _current is not run:
+            return []
+        _current = None
+    return run.stop()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Recording of raw IRC traffic, for replaying it later.
+
+A recording is an 8 byte magic header followed by one record per receive:
+the wall clock time as a little endian double, the length as an unsigned
+32 bit int, then the bytes exactly as they came off the socket, split
+wherever the receive split them. A record of length zero marks a new
+connection, so a replay knows to drop any partial line left from the last.
+
+Recording is opt-in and costs one buffered write per receive. Recordings
+are appended to, and stop growing once they reach their size limit.
+
+"""
+
+import logging
+import mmap
+import os
+import struct
+import time
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+
+MAGIC = b"SHGREC01"
+"""Header every recording starts with."""
+
+_RECORD = struct.Struct("<dI")
+
+
+class Recorder:
+    """Appends received data to a recording."""
+
+    def __init__(self, path: str, *, max_bytes: int = 1024 ** 3, buffer_size: int = 64 * 1024):
+        """Initialize recorder, opening the recording for appending.
+
+        Args:
+            path:        Recording to create or append to
+            max_bytes:   Size past which nothing more is recorded, 0 for no limit
+            buffer_size: Bytes buffered before writing to the file
+
+        Raises:
+            ValueError: The file exists and isn't a recording
+
+        """
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, "rb") as existing:
+                if existing.read(len(MAGIC)) != MAGIC:
+                    raise ValueError(f"{path} is not a traffic recording")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._file: Optional[BinaryIO] = open(path, "ab", buffering=buffer_size)  # type: ignore
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self.size = self._file.tell()
+        logging.getLogger(__name__).info("Recording received traffic to %s", path)
+
+    def record(self, data: bytes) -> None:
+        """Append one receive's worth of data."""
+        if self._file is None:
+            return
+        self.size += _RECORD.size + len(data)
+        if self.max_bytes and self.size > self.max_bytes:
+            logging.getLogger(__name__).warning("Recording %s reached %s bytes, stopping", self.path, self.max_bytes)
+            self.close()
+            return
+        self._file.write(_RECORD.pack(time.time(), len(data)))
+        self._file.write(data)
+
+    def mark(self) -> None:
+        """Record the start of a new connection."""
+        self.record(b"")
+
+    def flush(self) -> None:
+        """Write anything buffered out to the file."""
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        """Flush and close the recording, later data is ignored."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read(path: str) -> Iterator[Tuple[float, bytes]]:
+    """Read a recording through a memory map.
+
+    Args:
+        path: The recording
+
+    Yields:
+        The time and data of each record, empty data marking a new connection
+
+    Raises:
+        ValueError: The file isn't a recording
+
+    Notes:
+        A record cut short, as by the bot dying mid write, ends the recording.
+
+    """
+    with open(path, "rb") as recording:
+        if os.fstat(recording.fileno()).st_size < len(MAGIC):
+            raise ValueError(f"{path} is not a traffic recording")
+        with mmap.mmap(recording.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            if view[: len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a traffic recording")
+            size = len(view)
+            offset = len(MAGIC)
+            while offset + _RECORD.size <= size:
+                stamp, length = _RECORD.unpack_from(view, offset)
+                offset += _RECORD.size
+                if offset + length > size:
+                    break
+                yield stamp, view[offset : offset + length]
+                offset += length
+            if offset != size:
+                logging.getLogger(__name__).warning("%s ends with a partial record, ignoring it", path)
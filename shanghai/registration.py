@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Connection registration for Shanghai.
+
+Registration is a state machine fed the server's replies, doing no IO itself,
+so the socket and asyncio transports share it. Everything needed to register
+is sent in one write up front rather than waiting on each reply in turn.
+
+"""
+
+import logging
+from typing import Dict, Iterable, List, Optional, Set
+
+from .parser import Message
+
+
+NICK_ERRORS = {"431", "432", "433", "436", "437"}
+"""Numerics refusing a nick: none given, erroneous, in use, collision, unavailable."""
+
+
+class Registration:
+    """Tracks the handshake from connecting until the server's welcome."""
+
+    def __init__(
+        self,
+        nick: str,
+        realname: str,
+        *,
+        password: str = "",
+        alt_nicks: Iterable[str] = (),
+        caps: Iterable[str] = (),
+    ):
+        """Initialize registration.
+
+        Args:
+            nick:      Preferred nick
+            realname:  Real name sent with USER
+            password:  Server password, if one is needed
+            alt_nicks: Nicks to try in order if the preferred one is refused
+            caps:      IRCv3 capabilities to request if the server offers them
+
+        """
+        self.nick = nick
+        self.realname = realname
+        self.password = password
+        self.wanted = set(caps)
+        self.offered: Dict[str, str] = {}
+        self.enabled: Set[str] = set()
+        self.done = False
+        self._alternates = [alt for alt in alt_nicks if alt and alt != nick]
+        self._negotiating = False
+
+    def start(self) -> List[str]:
+        """Return the lines that begin registration, to be sent in one write.
+
+        Notes:
+            CAP LS holds registration open until CAP END, servers without
+            capability negotiation ignore it or reply 421 and carry on.
+
+        """
+        lines = ["CAP LS 302\r\n"] if self.wanted else []
+        self._negotiating = bool(self.wanted)
+        if self.password:
+            lines.append(f"PASS {self.password}\r\n")
+        lines.append(f"NICK {self.nick}\r\n")
+        lines.append(f"USER {self.nick} 0 * :{self.realname}\r\n")
+        return lines
+
+    def feed(self, message: Message) -> List[str]:
+        """Advance registration with a message from the server.
+
+        Args:
+            message: The parsed message
+
+        Returns:
+            Lines to send in reply, if any
+
+        """
+        logger = logging.getLogger(__name__)
+        command = message.command
+        if command == "PING":
+            return [f"PONG :{message.text}\r\n"]
+        if command == "CAP" and len(message.params) >= 3:
+            return self._cap(message.params[1].upper(), message.params[2:])
+        if command == "421" and len(message.params) > 1 and message.params[1].upper() == "CAP":
+            self._negotiating = False
+            return []
+        if command in NICK_ERRORS and not self.done:
+            refused = self.nick
+            self.nick = self._next_nick()
+            logger.warning("Nick %s refused with %s, trying %s", refused, command, self.nick)
+            return [f"NICK {self.nick}\r\n"]
+        if command == "001":
+            # The welcome is addressed to the nick the server actually gave us
+            self.nick = message.target or self.nick
+            self.done = True
+            logger.info("Registered as %s with capabilities %s", self.nick, sorted(self.enabled) or "none")
+        return []
+
+    def _cap(self, subcommand: str, args: List[str]) -> List[str]:
+        """Handle a CAP reply, returning the next negotiation step."""
+        if subcommand == "LS":
+            more = len(args) > 1 and args[0] == "*"
+            for cap in args[-1].split():
+                name, _, value = cap.partition("=")
+                self.offered[name] = value
+            if more or not self._negotiating:
+                return []
+            wanted = sorted(self.wanted & set(self.offered))
+            if wanted:
+                return [f"CAP REQ :{' '.join(wanted)}\r\n"]
+        elif subcommand == "ACK":
+            self.enabled.update(cap.lstrip("-=~") for cap in args[-1].split() if not cap.startswith("-"))
+        elif subcommand != "NAK":
+            return []
+        if not self._negotiating:
+            return []
+        self._negotiating = False
+        return ["CAP END\r\n"]
+
+    def _next_nick(self) -> str:
+        """Pick the next nick to try, adding underscores once the alternates run out."""
+        if self._alternates:
+            return self._alternates.pop(0)
+        return f"{self.nick}_"
+
+
+def split_list(value: Optional[str]) -> List[str]:
+    """Split a comma separated config value, such as alt_nicks or caps."""
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Output scheduling for Shanghai.
+
+Everything the bot writes to the server passes through here, so it can be
+paced to stay under the server's flood limits, split to fit the 512 byte line
+limit, and ordered so that more useful output is not stuck behind link info.
+
+"""
+
+from collections import deque, OrderedDict
+import time
+from typing import Deque, List, Optional, Tuple
+
+
+SYSTEM = 0
+"""Priority for protocol traffic such as PONG, JOIN and PART."""
+
+COMMAND = 1
+"""Priority for replies to commands."""
+
+LINK = 2
+"""Priority for link information."""
+
+LINE_LIMIT = 512
+"""Maximum bytes in an IRC line, including CRLF and the prefix the server adds."""
+
+
+def prefix_overhead(nick: str, user: str = "", host: str = "") -> int:
+    """Estimate the bytes a server adds when relaying one of our messages.
+
+    Args:
+        nick: The bot's nick
+        user: The bot's username as seen by the server, if known
+        host: The bot's host as seen by the server, if known
+
+    Returns:
+        Length of ":nick!user@host " in bytes
+
+    Notes:
+        When the user or host are not known yet, the largest values servers
+        commonly allow (10 and 63 bytes) are assumed, so lines never overflow.
+
+    """
+    user_len = len(user.encode("utf-8")) if user else 10
+    host_len = len(host.encode("utf-8")) if host else 63
+    return len(nick.encode("utf-8")) + user_len + host_len + 4
+
+
+def pack_lines(command: str, target: str, text: str, overhead: int) -> List[str]:
+    """Build complete protocol lines for text, splitting it to fit the limit.
+
+    Args:
+        command:  The command, such as PRIVMSG or NOTICE
+        target:   Channel or nick the text is sent to
+        text:     Text to send, may contain newlines
+        overhead: Bytes the server adds to each line, see prefix_overhead
+
+    Returns:
+        Lines including CRLF, each at most LINE_LIMIT bytes once relayed
+
+    Notes:
+        Splits are made on a space where one falls in the second half of the
+        line, otherwise as late as possible, but never inside a UTF-8 sequence.
+
+    """
+    head = f"{command} {target} :"
+    budget = LINE_LIMIT - overhead - len(head.encode("utf-8")) - 2
+    lines = []
+    # str.splitlines would also split on IRC's italic and other control codes
+    for part in text.replace("\r", "").split("\n"):
+        data = part.encode("utf-8")
+        while data:
+            if len(data) <= budget:
+                cut = len(data)
+            else:
+                cut = budget
+                while cut and data[cut] & 0xC0 == 0x80:
+                    cut -= 1
+                space = data.rfind(b" ", budget // 2, cut + 1)
+                if space > 0:
+                    cut = space
+            chunk, data = data[:cut], data[cut:].lstrip(b" ")
+            if chunk:
+                lines.append("".join([head, chunk.decode("utf-8"), "\r\n"]))
+    return lines
+
+
+class TokenBucket:
+    """Token bucket rate limiter."""
+
+    def __init__(self, rate: float, burst: int):
+        """Initialize a full bucket.
+
+        Args:
+            rate:  Tokens added per second
+            burst: Most tokens the bucket holds
+
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        """Add the tokens earned since the last refill."""
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def take(self, now: float) -> bool:
+        """Take a token if one is available.
+
+        Args:
+            now: Current time.monotonic()
+
+        Returns:
+            Whether a token was taken
+
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def delay(self, now: float) -> float:
+        """Return the seconds until a token will be available."""
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class OutputScheduler:
+    """Rate limited, prioritised, round robin queue of outbound lines."""
+
+    def __init__(self, *, rate: float = 1.0, burst: int = 5, overhead: int = 0):
+        """Initialize an empty scheduler.
+
+        Args:
+            rate:     Lines per second the server allows once the burst is spent
+            burst:    Lines the server allows in a burst
+            overhead: Bytes the server adds to each relayed line
+
+        """
+        self.bucket = TokenBucket(rate, burst)
+        self.overhead = overhead
+        self._queues: Tuple["OrderedDict[str, Deque[str]]", ...] = (OrderedDict(), OrderedDict(), OrderedDict())
+
+    def __len__(self) -> int:
+        """Return the number of lines waiting."""
+        return sum(len(lines) for queue in self._queues for lines in queue.values())
+
+    def push(self, line: str, *, target: str = "", priority: int = SYSTEM) -> None:
+        """Queue a complete protocol line.
+
+        Args:
+            line:     The line, including CRLF
+            target:   Channel or nick the line is for, lines for the same
+                      target are sent in order, other targets take turns
+            priority: SYSTEM, COMMAND or LINK, lower values are sent first
+
+        """
+        queue = self._queues[priority]
+        if target not in queue:
+            queue[target] = deque()
+        queue[target].append(line)
+
+    def message(self, text: str, target: str, *, priority: int = COMMAND, command: str = "PRIVMSG") -> None:
+        """Pack text into lines for a target and queue them.
+
+        Args:
+            text:     Text to send, may contain newlines
+            target:   Channel or nick to send to
+            priority: SYSTEM, COMMAND or LINK, lower values are sent first
+            command:  PRIVMSG or NOTICE
+
+        """
+        for line in pack_lines(command, target, text, self.overhead):
+            self.push(line, target=target, priority=priority)
+
+    def pop(self, now: Optional[float] = None) -> Optional[str]:
+        """Take the next line to send, if the rate limit allows one.
+
+        Args:
+            now: Current time.monotonic(), looked up if not given
+
+        Returns:
+            The next line, or None if nothing is waiting or no token is left
+
+        Notes:
+            The highest priority with anything waiting is served first. Within
+            it the target at the front gives up one line and moves to the back,
+            so a channel flooded with links can't hold up the others.
+
+        """
+        for queue in self._queues:
+            if queue:
+                break
+        else:
+            return None
+        if not self.bucket.take(time.monotonic() if now is None else now):
+            return None
+        target, lines = next(iter(queue.items()))
+        line = lines.popleft()
+        if lines:
+            queue.move_to_end(target)
+        else:
+            del queue[target]
+        return line
+
+    def delay(self, now: Optional[float] = None) -> Optional[float]:
+        """Return seconds until the next line may be sent, None if none wait."""
+        if not any(self._queues):
+            return None
+        return self.bucket.delay(time.monotonic() if now is None else now)
+
+    def drop(self, target: str) -> None:
+        """Discard everything waiting for a target, such as a parted channel."""
+        for queue in self._queues:
+            queue.pop(target, None)
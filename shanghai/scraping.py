@@ -5,27 +5,46 @@
 
 import configparser
 import logging
+import mimetypes
 import re
-from typing import List
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
 
-from bs4 import BeautifulSoup  # type: ignore
 import requests
 import requests.exceptions
 
+from . import handlers
+from . import metrics
+from . import offload
+from . import sessions
 from .apis import pixiv_tags
-from .exceptions import TitleError, RequestError, APIError
+from .cache import normalize_url, ScrapeCache
+from .decompress import ACCEPT_ENCODING, iter_decoded
+from .exceptions import TitleError, RequestError, APIError, CircuitOpenError
+from .imagemeta import ImageInfo, probe_image
+from .titles import TitleExtractor
 
 
-_PIXIV = re.compile(r"pixiv.*illust_id(\d+)")
+_PIXIV_ID = re.compile(r"(?:illust_id=|/artworks/)(\d+)")
 
+_CONTENT_RANGE = re.compile(r"bytes\s+(?:\d+-\d+|\*)/(\d+)", re.IGNORECASE)
 
-def scrape(link: str, apis: configparser.ConfigParser) -> str:
+_PAGE_TYPES = {"text/html", "application/xhtml+xml"}
+
+_HEAD_END = re.compile(rb"</title|</head|<body", re.IGNORECASE)
+
+_STAGES = metrics.STAGE_SECONDS
+
+
+@metrics.timed(_STAGES.labels("scrape"))
+def scrape(link: str, apis: configparser.ConfigParser, cache: Optional[ScrapeCache] = None) -> str:
     """Check a link and return pertinent info.
 
     Args:
-        link: The link to be scanned
-        apis: A configparser object linked to a file containing all required
-              information for API usage. The file is mostly auth info.
+        link:  The link to be scanned
+        apis:  A configparser object linked to a file containing all required
+               information for API usage. The file is mostly auth info.
+        cache: Cache to answer from and store results in, if any
 
     Returns:
         A string with info relating to the link for the bot to use
@@ -43,79 +62,261 @@ def scrape(link: str, apis: configparser.ConfigParser) -> str:
     """
     logger = logging.getLogger(__name__)
     message: List[str] = []
-    logger.info(f"Beginning handling for {link}")
+    logger.info("Beginning handling for %s", link)
+    key = normalize_url(link)
+    entry = cache.lookup(key) if cache is not None else None
+    if entry is not None and entry.fresh:
+        logger.info("Answering %s from cache", link)
+        return entry.result
+    failures = sessions.pool().failures
+    failed = failures.recall(key)
+    if failed is not None:
+        logger.info("%s failed recently, answering with the same error", link)
+        return failed
+    handler = handlers.registry.find(link)
+    if handler is not None and not handler.needs_body:
+        logger.info("Handing %s to the %s handler", link, handler.name)
+        try:
+            ret = handler.handle(link, None, apis)
+        except RequestError as inst:
+            logger.error("There was an error making the request", exc_info=inst)
+            if not isinstance(inst, CircuitOpenError):
+                failures.remember(key, str(inst))
+            return str(inst)
+        if ret is not None:
+            if cache is not None:
+                cache.store(key, ret, {})
+            return ret
+        handler = None
+    headers = {"If-None-Match": entry.etag} if entry is not None and entry.etag else None
     try:
-        response = get_response(link)
+        response = open_response(link, headers=headers)
     except RequestError as inst:
         logger.error("There was an error making the request", exc_info=inst)
         message.append(str(inst))
-    else:
-        logger.info(f"Request successful for {link}")
-        message = []
-        if response.headers["content-type"] == "text/html":
-            try:
-                message.append(fetch_title(response))
-            except TitleError:
-                message.append("No title found for the linked page")
-            try:
-                message.append(pixiv_tags(_PIXIV.search(link).group(1), apis["pixiv"]))
-            except APIError:
-                message.append("Failed to fetch illustration tags")
-            except AttributeError:
-                pass
-        else:
-            message.append(fetch_info(response))
         ret = "\n".join(message)
+        if not isinstance(inst, CircuitOpenError):
+            # The breaker already answers for the host until it recovers
+            failures.remember(key, ret)
+    else:
+        # Closing returns the connection to the pool, or drops it if the body wasn't read
+        with response:
+            logger.info("Request successful for %s", link)
+            if entry is not None and cache is not None and response.status_code == 304:
+                logger.info("Cached result for %s is still valid", link)
+                cache.refresh(key, response.headers)
+                return entry.result
+            ret = handler.handle(link, response, apis) if handler is not None else None
+            if ret is None:
+                ret = describe(response)
+            if cache is not None:
+                cache.store(key, ret, response.headers)
     return ret
 
 
-def get_response(link: str) -> requests.Response:
+def describe(response: requests.Response) -> str:
+    """Describe a link generically, by page title or by content type and size.
+
+    Args:
+        response: The response from open_response
+
+    Returns:
+        A string with info relating to the link for the bot to use
+
+    """
+    if media_type(response) in _PAGE_TYPES:
+        try:
+            return fetch_title(response)
+        except TitleError:
+            return "No title found for the linked page"
+    return fetch_info(response)
+
+
+@metrics.timed(_STAGES.labels("get_response"))
+def get_response(link: str, headers: Optional[Dict[str, str]] = None) -> requests.Response:
     """Manage the HTTP GET request for a link.
 
     Args:
-        link: The URL for the request
+        link:    The URL for the request
+        headers: Extra request headers, such as for revalidating a cached result
 
     Returns:
         The requests Response object
 
     """
     logger = logging.getLogger(__name__)
-    logger.info(f"Sending GET request to {link}")
+    logger.info("Sending GET request to %s", link)
     try:
-        response = requests.get(link, timeout=1, stream=True, headers={"Accept-Encoding": "deflate"})
+        response = sessions.pool().get(
+            link, stream=True, headers={"Accept-Encoding": ACCEPT_ENCODING, **(headers or {})}
+        )
     except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as inst:
         raise RequestError(link=link, error=str(inst))
     else:
-        logger.info(f"Request completed, checking status")
+        logger.info("Request completed, checking status")
         try:
             response.raise_for_status()
         except requests.exceptions.HTTPError as inst:
+            # The body is never read, so release the connection or the pool runs dry
+            response.close()
             raise RequestError(link=link, error=str(inst))
-    logger.info(f"No errors in request, returning")
+    logger.info("No errors in request, returning")
     return response
 
 
+def open_response(link: str, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+    """Get a response for a link, only opening a body stream for pages.
+
+    Args:
+        link:    The URL for the request
+        headers: Extra request headers, such as for revalidating a cached result
+
+    Returns:
+        A streamed GET response for pages, otherwise a probe response
+
+    Notes:
+        Links whose extension names a non-page type (video, archive, image,
+        ...) are probed first. Should the server report a page after all, a
+        GET follows. Anything else is assumed to be a page and fetched directly,
+        saving a round trip on the common case.
+
+    """
+    guessed, _ = mimetypes.guess_type(urlsplit(link).path)
+    if guessed is None or guessed in _PAGE_TYPES:
+        return get_response(link, headers=headers)
+    response = probe(link, headers=headers)
+    if response.status_code != 304 and media_type(response) in _PAGE_TYPES:
+        response.close()
+        return get_response(link, headers=headers)
+    return response
+
+
+def probe(link: str, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+    """Find a link's type and size without downloading it.
+
+    Args:
+        link:    The URL for the request
+        headers: Extra request headers
+
+    Returns:
+        The HEAD response, or if HEAD is refused or unhelpful, the response to
+        a GET for just the first byte
+
+    """
+    logger = logging.getLogger(__name__)
+    logger.info("Sending HEAD request to %s", link)
+    try:
+        response = sessions.pool().head(link, allow_redirects=True, headers=headers)
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as inst:
+        raise RequestError(link=link, error=str(inst))
+    if response.ok and "content-type" in response.headers:
+        return response
+    logger.info("HEAD gave %s for %s, falling back to a ranged GET", response.status_code, link)
+    response.close()
+    return get_response(link, headers={**(headers or {}), "Range": "bytes=0-0"})
+
+
+def parse_media_type(value: str) -> Tuple[str, Dict[str, str]]:
+    """Split a Content-Type header into its media type and parameters.
+
+    Args:
+        value: The header value, such as 'text/html; charset="utf-8"'
+
+    Returns:
+        The lowercased media type and a dictionary of its parameters
+
+    """
+    mtype, *params = value.split(";")
+    parsed = {}
+    for param in params:
+        key, _, val = param.partition("=")
+        if key.strip():
+            parsed[key.strip().lower()] = val.strip().strip('"')
+    return mtype.strip().lower(), parsed
+
+
+def media_type(response: requests.Response) -> str:
+    """Return the lowercased media type of a response, without parameters."""
+    return parse_media_type(response.headers.get("content-type", ""))[0]
+
+
+def content_size(response: requests.Response) -> Optional[int]:
+    """Return the full size of the linked content, if the server gave it.
+
+    Args:
+        response: A GET, ranged GET or HEAD response
+
+    Returns:
+        The total from Content-Range for a partial response, otherwise
+        Content-Length, or None if neither is present
+
+    """
+    if response.status_code == 206:
+        match = _CONTENT_RANGE.match(response.headers.get("content-range", ""))
+        return int(match.group(1)) if match else None
+    try:
+        return int(response.headers["content-length"])
+    except (KeyError, ValueError):
+        return None
+
+
+@metrics.timed(_STAGES.labels("fetch_title"))
 def fetch_title(response: requests.Response) -> str:
     """Get the title from HTML page source.
 
     Args:
-        response: The Response object that includes the HTML source
+        response: The streamed Response object for the HTML page
 
     Returns:
         A string containing the page title
 
+    Raises:
+        TitleError: No title was found, or the body couldn't be decompressed
+
+    Notes:
+        The body is decompressed and read in chunks only until the title has
+        been seen, up to the limit set with titles.configure. With a parsing
+        pool configured, the head of the page is read here and parsed in a
+        pool process.
+
     """
     logger = logging.getLogger(__name__)
-    logger.info(f"Attempting to find page title for {response.url}")
+    logger.info("Attempting to find page title for %s", response.url)
+    declared = response.encoding if "charset" in response.headers.get("content-type", "").lower() else None
+    parsers = offload.pool()
     try:
-        title: str = BeautifulSoup(response.text, "html.parser").title.string.strip().replace("\n", "")
-    except AttributeError:
-        logger.info(f"No page title present for {response.url}")
+        if parsers is not None:
+            head = _read_head(response, parsers.max_bytes)
+            title = parsers.title(head, declared)
+            read = len(head)
+        else:
+            extractor = TitleExtractor(declared=declared)
+            for chunk in iter_decoded(response, max_bytes=extractor.max_bytes):
+                if extractor.feed(chunk):
+                    break
+            title = extractor.title()
+            read = extractor.bytes_read
+    except RequestError as inst:
+        logger.info("Could not read the body of %s: %s", response.url, inst.error)
+        raise TitleError(link=response.url, error=inst.error)
+    if not title:
+        logger.info("No page title present for %s", response.url)
         raise TitleError(link=response.url, error="No title present")
-    logger.info(f"Page title found for {response.url}: {title}")
+    logger.info("Page title found for %s after %s bytes: %s", response.url, read, title)
     return " ".join(["[title]", title])
 
 
+def _read_head(response: requests.Response, max_bytes: int) -> bytes:
+    """Read and decompress a page until the end of its title or head, or max_bytes."""
+    data = bytearray()
+    for chunk in iter_decoded(response, max_bytes=max_bytes):
+        data += chunk
+        # Look back a little in case the tag straddles two chunks
+        if len(data) >= max_bytes or _HEAD_END.search(data, max(len(data) - len(chunk) - 8, 0)):
+            break
+    return bytes(data[:max_bytes])
+
+
 def fetch_info(response: requests.Response) -> str:
     """Get the size and type of the linked content.
 
@@ -127,17 +328,72 @@ def fetch_info(response: requests.Response) -> str:
 
     """
     logger = logging.getLogger(__name__)
-    logger.info(f"Beginning to fetch info about {response.url}")
-    message = [f'[{response.headers["content-type"]}]']
-    try:
-        logger.info("Getting size and converting it to something readable")
-        message.append(size_convert(int(response.headers["content-length"])))
-    except KeyError:
+    logger.info("Beginning to fetch info about %s", response.url)
+    message = [f'[{media_type(response) or "unknown type"}]']
+    if media_type(response).startswith("image/"):
+        info = fetch_image_info(response)
+        if info is not None:
+            message.append(str(info))
+    size = content_size(response)
+    if size is None:
         logger.info("No content length header, size unknown")
         message.append("?B")
+    else:
+        logger.info("Getting size and converting it to something readable")
+        message.append(size_convert(size))
     return " ".join(message)
 
 
+def fetch_image_info(response: requests.Response) -> Optional[ImageInfo]:
+    """Get the format and dimensions of a linked image from its headers.
+
+    Args:
+        response: A GET, ranged GET or HEAD response for the image
+
+    Returns:
+        The image info, or None if it couldn't be determined
+
+    Notes:
+        A streamed full GET is read from directly, otherwise ranged GETs
+        fetch just the parts of the file the header parser asks for.
+
+    """
+    logger = logging.getLogger(__name__)
+    stream = response if response.request.method == "GET" and response.status_code == 200 else None
+
+    def read(offset: int, length: int) -> bytes:
+        """Return length bytes of the image from offset."""
+        if offset == 0 and stream is not None:
+            return _read_body(stream, length)
+        byte_range = f"bytes={offset}-{offset + length - 1}"
+        try:
+            part = sessions.pool().get(response.url, stream=True, headers={"Range": byte_range})
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, CircuitOpenError) as inst:
+            logger.info("Ranged read of %s failed", response.url, exc_info=inst)
+            return b""
+        with part:
+            if part.status_code == 206:
+                return _read_body(part, length)
+            if part.status_code == 200 and offset + length <= 64 * 1024:
+                # Range ignored, the start of the full body will still do
+                return _read_body(part, offset + length)[offset:]
+        return b""
+
+    info, read_bytes = probe_image(read)
+    logger.info("Read %s bytes of %s for image info: %s", read_bytes, response.url, info)
+    return info
+
+
+def _read_body(response: requests.Response, length: int) -> bytes:
+    """Read up to length bytes from the start of a streamed response body."""
+    data = bytearray()
+    for chunk in response.iter_content(chunk_size=min(length, 16 * 1024)):
+        data += chunk
+        if len(data) >= length:
+            break
+    return bytes(data[:length])
+
+
 def size_convert(size: float = 0) -> str:
     """Convert a size in bytes to human readable format.
 
@@ -160,3 +416,80 @@ def size_convert(size: float = 0) -> str:
         return str(round(size, 2)) + size_name[i]
     except IndexError:
         return str(round(size, 2)) + " x " + "1024^{i} bytes"
+
+
+class PixivHandler(handlers.Handler):
+    """Answers pixiv illustration links with their tags from the API."""
+
+    name = "pixiv"
+    domains = ("pixiv.net",)
+    needs_body = False
+
+    def handle(
+        self, link: str, response: Optional[requests.Response], apis: configparser.ConfigParser
+    ) -> Optional[str]:
+        """Look up the tags of the linked illustration, see Handler.handle."""
+        match = _PIXIV_ID.search(link)
+        if match is None:
+            return None
+        try:
+            return pixiv_tags(int(match.group(1)), apis["pixiv"])
+        except APIError as inst:
+            # Raised rather than returned, so the failure isn't cached as the link's description
+            raise RequestError(link=link, error="Failed to fetch illustration tags") from inst
+
+
+class ImageHostHandler(handlers.Handler):
+    """Probes links on image hosts as images, whatever their extension."""
+
+    name = "image host"
+    domains = ("i.imgur.com", "i.redd.it", "pbs.twimg.com", "media.discordapp.net", "cdn.discordapp.com")
+    needs_body = False
+
+    def handle(
+        self, link: str, response: Optional[requests.Response], apis: configparser.ConfigParser
+    ) -> Optional[str]:
+        """Describe the linked image without downloading it, see Handler.handle."""
+        with probe(link) as probed:
+            if media_type(probed) in _PAGE_TYPES:
+                return None
+            return fetch_info(probed)
+
+
+class OEmbedHandler(handlers.Handler):
+    """Answers video links with the title and author from the site's oEmbed endpoint."""
+
+    name = "oembed"
+    domains = ("youtube.com", "youtu.be", "vimeo.com")
+    needs_body = False
+
+    endpoints = {
+        "youtube.com": "https://www.youtube.com/oembed",
+        "youtu.be": "https://www.youtube.com/oembed",
+        "vimeo.com": "https://vimeo.com/api/oembed.json",
+    }
+
+    def handle(
+        self, link: str, response: Optional[requests.Response], apis: configparser.ConfigParser
+    ) -> Optional[str]:
+        """Fetch the oEmbed title for a video, see Handler.handle."""
+        host = (urlsplit(link).hostname or "").lower()
+        endpoint = next((url for domain, url in self.endpoints.items() if host.endswith(domain)), None)
+        if endpoint is None:
+            return None
+        try:
+            with sessions.pool().get(endpoint, params={"url": link, "format": "json"}) as reply:
+                if not reply.ok:
+                    return None
+                data = reply.json()
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, ValueError) as inst:
+            raise RequestError(link=link, error=str(inst))
+        if not data.get("title"):
+            return None
+        text = f"[title] {data['title']}"
+        return f"{text} [by] {data['author_name']}" if data.get("author_name") else text
+
+
+handlers.register(PixivHandler())
+handlers.register(ImageHostHandler())
+handlers.register(OEmbedHandler())
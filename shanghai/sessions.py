@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Shared HTTP connection pooling for Shanghai.
+
+Every outgoing HTTP request is made through one pool, so repeat requests to a
+host reuse a kept-alive connection instead of paying for DNS, TCP and TLS
+setup again.
+
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .breaker import FailureTracker
+from .exceptions import CircuitOpenError
+
+
+class HTTPPool:
+    """requests Session with bounded, expiring keep-alive connection pools."""
+
+    def __init__(
+        self,
+        *,
+        per_host: int = 4,
+        max_hosts: int = 64,
+        idle_timeout: float = 60,
+        connect_timeout: float = 1,
+        read_timeout: float = 1,
+        failure_threshold: int = 5,
+        failure_cooldown: float = 30,
+        negative_ttl: float = 60,
+    ):
+        """Initialize pool.
+
+        Args:
+            per_host:          Most connections to a single host, requests
+                               beyond this wait for one to be released
+            max_hosts:         Most hosts to keep connections open to
+            idle_timeout:      Seconds after which a host's unused connections
+                               close
+            connect_timeout:   Seconds allowed to establish a connection
+            read_timeout:      Seconds allowed between bytes of a response
+            failure_threshold: Consecutive failures after which requests to a
+                               host are refused
+            failure_cooldown:  Seconds before a refused host is tried again
+            negative_ttl:      Seconds a failed link is remembered
+
+        """
+        self.idle_timeout = idle_timeout
+        self.timeout = (connect_timeout, read_timeout)
+        self.adapter = HTTPAdapter(pool_connections=max_hosts, pool_maxsize=per_host, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        self._lock = threading.Lock()
+        self._last_used: Dict[Tuple[str, str, Optional[int]], float] = {}
+        self._closed_connections = 0
+        self._closed_requests = 0
+        self.failures = FailureTracker(
+            threshold=failure_threshold, cooldown=failure_cooldown, negative_ttl=negative_ttl
+        )
+
+    def request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        """Make a request through the pool.
+
+        Args:
+            method:   HTTP method
+            url:      The URL for the request
+            **kwargs: Passed on to requests, timeout defaults to the pool's
+
+        Returns:
+            The requests Response object
+
+        Raises:
+            CircuitOpenError: The host has failed too often to be tried yet
+
+        Notes:
+            Timeouts, connection errors and server errors count as failures of
+            the host, any other response as a success. Other errors, such as an
+            invalid URL or too many redirects, count as neither.
+
+        """
+        self.expire()
+        parts = requests.utils.urlparse(url)
+        host = parts.hostname or ""
+        if not self.failures.allow(host):
+            raise CircuitOpenError(link=url, host=host)
+        with self._lock:
+            self._last_used[(parts.scheme, host, parts.port)] = time.monotonic()
+        kwargs.setdefault("timeout", self.timeout)
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except (requests.Timeout, requests.ConnectionError):
+            self.failures.failure(host)
+            raise
+        except Exception:
+            self.failures.release(host)
+            raise
+        if response.status_code >= 500:
+            self.failures.failure(host)
+        else:
+            self.failures.success(host)
+        return response
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        """Make a GET request through the pool, see request."""
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url: str, **kwargs: Any) -> requests.Response:
+        """Make a HEAD request through the pool, see request."""
+        return self.request("HEAD", url, **kwargs)
+
+    def expire(self) -> None:
+        """Close connections to hosts that haven't been used recently."""
+        now = time.monotonic()
+        with self._lock:
+            idle = {key for key, used in self._last_used.items() if now - used > self.idle_timeout}
+            if not idle:
+                return
+            for key in idle:
+                del self._last_used[key]
+            pools = self.adapter.poolmanager.pools
+            for pool_key in list(pools.keys()):
+                scheme, host = pool_key.key_scheme, pool_key.key_host
+                port = pool_key.key_port
+                if any(key[0] == scheme and key[1] == host and key[2] in (None, port) for key in idle):
+                    pool = pools.get(pool_key)
+                    if pool is not None:
+                        self._closed_connections += pool.num_connections
+                        self._closed_requests += pool.num_requests
+                    del pools[pool_key]
+        logging.getLogger(__name__).debug("Closed idle connections to %s hosts", len(idle))
+
+    def stats(self) -> Dict[str, float]:
+        """Return request and connection counts and the connection reuse rate.
+
+        Notes:
+            The hit rate is the fraction of requests that went out on an
+            existing connection rather than opening a new one.
+
+        """
+        with self._lock:
+            pools = [self.adapter.poolmanager.pools.get(key) for key in list(self.adapter.poolmanager.pools.keys())]
+            connections = self._closed_connections + sum(pool.num_connections for pool in pools if pool)
+            requests_made = self._closed_requests + sum(pool.num_requests for pool in pools if pool)
+        return {
+            "hosts": len(pools),
+            "requests": requests_made,
+            "connections": connections,
+            "hit_rate": round(1 - connections / requests_made, 4) if requests_made else 0.0,
+        }
+
+    def close(self) -> None:
+        """Close every pooled connection."""
+        self.session.close()
+
+
+_pool: Optional[HTTPPool] = None
+_pool_lock = threading.Lock()
+
+
+def configure(**kwargs: Any) -> HTTPPool:
+    """Replace the shared pool with one built from the given settings.
+
+    Args:
+        **kwargs: Passed on to HTTPPool
+
+    Returns:
+        The new shared pool
+
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = HTTPPool(**kwargs)
+        return _pool
+
+
+def pool() -> HTTPPool:
+    """Return the shared pool, creating one with default settings if needed."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = HTTPPool()
+        return _pool
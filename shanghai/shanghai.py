@@ -8,51 +8,146 @@ scan incoming links to post information on the content to the channel.
 
 TODO:
     Actually write the code
-    Move Exceptions to own file
-    Better parser?
 
 """
 
+import asyncio
 import configparser
+import functools
+import inspect
 import logging
+import os
+import queue
 import re
+import time
+from typing import Any, Callable, Dict, Optional, Set, Tuple
 
 # import fuckit
 
+from . import backoff
+from . import cache
 from . import connection
+from . import dedup
 from . import exceptions
+from . import metrics
+from . import offload
+from . import parser
+from . import profiling
+from . import recording
+from . import registration
+from . import scheduler
 from . import scraping
+from . import sessions
+from . import titles
+from . import workers
 
 
-_MSPLIT = re.compile(
-    r"""
-  :
-  (?P<user>[^!]*)
-  !\S*?\s*?
-  PRIVMSG
-  \s*?
-  (?P<chan>\S*)
-  \s*?
-  :(?P<msg>[^\r\n]*)
-""",
-    re.VERBOSE | re.IGNORECASE,
-)
-
 _LINKS = re.compile(r"\bhttps?://[^. ]+\.[^. \t\n\r\f\v][^ \n\r]+")
 
+_PARSE = metrics.STAGE_SECONDS.labels("parse")
+_LINK_RESULTS = {result: metrics.LINKS.labels(result) for result in ("scraped", "repeated", "dropped")}
+_REPLY_RESULTS = {result: metrics.REPLIES.labels(result) for result in ("sent", "stale")}
+
+
+class Resources:
+    """Scrape machinery shared by every network a process connects to."""
+
+    def __init__(self, conf: configparser.SectionProxy):
+        """Create the HTTP pool, caches, parsing pool and scrape workers.
+
+        Args:
+            conf: Config section holding their settings, normally DEFAULT
+
+        Notes:
+            The HTTP pool, title limit and parsing pool are module level, so
+            only one Resources should exist per process.
+
+        """
+        self.http = sessions.configure(
+            per_host=conf.getint("http_per_host", fallback=4),
+            max_hosts=conf.getint("http_hosts", fallback=64),
+            idle_timeout=conf.getfloat("http_idle", fallback=60),
+            connect_timeout=conf.getfloat("http_connect_timeout", fallback=1),
+            read_timeout=conf.getfloat("http_read_timeout", fallback=1),
+            failure_threshold=conf.getint("failure_threshold", fallback=5),
+            failure_cooldown=conf.getfloat("failure_cooldown", fallback=30),
+            negative_ttl=conf.getfloat("negative_ttl", fallback=60),
+        )
+        titles.configure(max_bytes=conf.getint("title_max_bytes", fallback=256 * 1024))
+        self.parsers = offload.configure(
+            processes=conf.getint("parse_processes", fallback=0),
+            timeout=conf.getfloat("parse_timeout", fallback=5),
+            max_bytes=conf.getint("title_max_bytes", fallback=256 * 1024),
+        )
+        self.cache: Optional[cache.ScrapeCache] = None
+        if conf.get("cache_path", "cache/scrape.sqlite"):
+            self.cache = cache.ScrapeCache(
+                conf.get("cache_path", "cache/scrape.sqlite"),
+                ttl=conf.getfloat("cache_ttl", fallback=3600),
+                max_entries=conf.getint("cache_entries", fallback=10000),
+                max_bytes=conf.getint("cache_bytes", fallback=8 * 1024 * 1024),
+            )
+        # Each bot passes its own result callback with every job
+        self.pool = workers.WorkerPool(
+            None,
+            workers=conf.getint("scrape_workers", fallback=4),
+            max_queue=conf.getint("scrape_queue", fallback=100),
+            per_channel=conf.getint("scrape_per_channel", fallback=2),
+            deadline=conf.getfloat("scrape_deadline", fallback=30.0),
+        )
+        self.flights = dedup.SingleFlight()
+        self._stopped = False
+        self.metrics = metrics.configure(
+            port=conf.getint("metrics_port", fallback=0),
+            textfile=conf.get("metrics_textfile", ""),
+            interval=conf.getfloat("metrics_interval", fallback=15),
+        )
+
+    def start(self) -> None:
+        """Start the scrape workers."""
+        self.pool.start()
+
+    def stop(self) -> None:
+        """Stop the scrape workers, parsing processes and metrics exporter, and close the cache.
+
+        Notes:
+            Only the first call does anything, stopped resources can't be
+            started again.
+
+        """
+        if self._stopped:
+            return
+        self._stopped = True
+        self.pool.stop()
+        if self.parsers is not None:
+            self.parsers.stop()
+        if self.metrics is not None:
+            self.metrics.stop()
+        if self.cache is not None:
+            self.cache.close()
+
 
 class Bot:
     """Main class to handle bot functionality."""
 
     def __init__(
-        self, config: str = "config/shanghai.ini", chancoms: str = "config/commands.ini", apis: str = "config/apis.ini",
+        self,
+        config: str = "config/shanghai.ini",
+        chancoms: str = "config/commands.ini",
+        apis: str = "config/apis.ini",
+        *,
+        network: str = configparser.DEFAULTSECT,
+        resources: Optional["Resources"] = None,
     ):
         """Initialize bot.
 
         Args:
-            config:   Bot specific config file path
-            chancoms: Channel commands config file path
-            apis:     API config file path
+            config:    Bot specific config file path
+            chancoms:  Channel commands config file path
+            apis:      API config file path
+            network:   Config section of the network to connect to
+            resources: Scrape machinery shared with other networks, the bot
+                       creates its own if not given and runs asyncio if given
 
         """
         logger = logging.getLogger(__name__)
@@ -76,76 +171,578 @@ class Bot:
         # This is almost certainly going to get changed eventually, as it feels sloppy
         self.chanfile = chancoms
 
-        self.syscoms = {"quit": self.quit, "join": self.join}
+        self.syscoms = {
+            "quit": self.quit,
+            "join": self.join,
+            "part": self.part,
+            "stats": self.stats,
+            "hosts": self.hosts,
+            "profile": self.profile,
+        }
+        self.handlers: Dict[str, Callable[[parser.Message], None]] = {
+            "JOIN": self.on_join,
+            "KICK": self.on_kick,
+            "NICK": self.on_nick,
+            "PART": self.on_part,
+            "PING": self.on_ping,
+            "PRIVMSG": self.on_privmsg,
+        }
         self.match = None
         self.message = None
 
-        default = self.config["DEFAULT"]
-        self.irc = connection.ShangSock(default["server"], default.getint("port"), default.getboolean("ssl"))
-        self.connect()
+        default = self.config[network]
+        self.network = network
+        self.supervised = resources is not None
+        self.stopped = False
+        # Channels are scoped by network in the shared worker pool
+        self._scope = "" if network == configparser.DEFAULTSECT else f"{network}/"
+        self.asyncio = self.supervised or default.getboolean("asyncio", fallback=False)
+        self.nick = default["nick"]
+        self.caps: Set[str] = set()
+        # Channels the server says the bot is in, rejoined after reconnecting
+        self.channels: Set[str] = set()
+        self.backoff = backoff.Backoff(
+            default.getfloat("reconnect_delay", fallback=2), default.getfloat("max_reconnect_delay", fallback=300)
+        )
+        self.reconnects = 0
+        self.last_recovery: Optional[float] = None
+        self.scheduler = scheduler.OutputScheduler(
+            rate=default.getfloat("flood_rate", fallback=1.0),
+            burst=default.getint("flood_burst", fallback=5),
+            overhead=scheduler.prefix_overhead(default["nick"]),
+        )
+        self.resources = resources if resources is not None else Resources(default)
+        self.http = self.resources.http
+        self.parsers = self.resources.parsers
+        self.cache = self.resources.cache
+        self.pool = self.resources.pool
+        self.flights = self.resources.flights
+        self.recent = dedup.RecentLinks(window=default.getfloat("link_window", fallback=60))
+        self._messages = metrics.MESSAGES.labels(network)
+        self._profiling: Optional[profiling.ProfileRun] = None
+        self._results: "queue.Queue[Tuple[Callable[..., None], tuple]]" = queue.Queue()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        eyeballs = default.getfloat("happy_eyeballs_delay", fallback=0.25)
+        recorder = self._recorder()
+        if self.asyncio:
+            # Connection is deferred until run_async is awaited inside an event loop
+            self.irc = connection.AsyncShangSock(
+                default["server"],
+                default.getint("port"),
+                default.getboolean("ssl"),
+                happy_eyeballs_delay=eyeballs,
+                recorder=recorder,
+            )
+        else:
+            self.irc = connection.ShangSock(
+                default["server"],
+                default.getint("port"),
+                default.getboolean("ssl"),
+                happy_eyeballs_delay=eyeballs,
+                recorder=recorder,
+            )
+            self.connect()
+
+    def _recorder(self) -> Optional[recording.Recorder]:
+        """Open the recording of received traffic set by record_path, if any.
 
-    def connect(self) -> None:
-        """Connect to and send necessary information to IRC server per protocol.
+        Notes:
+            Networks under a supervisor each record to their own file, named
+            by adding the network to record_path.
+
+        """
+        default = self.config[self.network]
+        path = default.get("record_path", "")
+        if not path:
+            return None
+        if self._scope:
+            stem, ext = os.path.splitext(path)
+            path = f"{stem}-{self.network}{ext}"
+        return recording.Recorder(path, max_bytes=default.getint("record_max_bytes", fallback=1024 ** 3))
+
+    def _registration(self) -> registration.Registration:
+        """Build the registration state machine from the network's config."""
+        default = self.config[self.network]
+        return registration.Registration(
+            default["nick"],
+            default["realname"],
+            password=default["password"],
+            alt_nicks=registration.split_list(default.get("alt_nicks")),
+            caps=registration.split_list(default.get("caps", "message-tags,multi-prefix,server-time")),
+        )
+
+    def _registered(self, reg: registration.Registration) -> None:
+        """Adopt the nick and capabilities registration ended with."""
+        self.nick = reg.nick
+        self.caps = reg.enabled
+        self.scheduler.overhead = scheduler.prefix_overhead(self.nick)
+
+    def connect(self) -> int:
+        """Connect to and register with the IRC server, retrying until it works.
+
+        Returns:
+            The number of attempts it took
 
         Notes:
-            The response checking in here is kinda hacky with regexes right now
-            It'll be changed when I've got a proper scanner/parser for IRC ABNF
-            implemented and working
+            Failed attempts are retried after a capped, jittered exponential
+            backoff, see the backoff module.
 
-        Todo:
-            Implement parsing grammar with Lark or PLY, stop using regex for this
+        """
+        logger = logging.getLogger(__name__)
+        while True:
+            try:
+                self._register()
+            except exceptions.ShangSockError as inst:
+                delay = self.backoff.next()
+                logger.warning(
+                    "Connection attempt %s failed, retrying in %.1fs - %s", self.backoff.attempts, delay, inst
+                )
+                time.sleep(delay)
+            else:
+                attempts = self.backoff.attempts + 1
+                self.backoff.reset()
+                return attempts
+
+    def _register(self) -> None:
+        """Make one attempt to connect to and register with the IRC server.
+
+        Raises:
+            ShangSockError: The connection failed, or the server didn't welcome
+                            the bot within register_timeout
 
         """
         logger = logging.getLogger(__name__)
-        default = self.config["DEFAULT"]
+        timeout = self.config[self.network].getfloat("register_timeout", fallback=30)
 
         self.irc.connect()
         logger.info("Socket bound to server, beginning connection protocol")
+        reg = self._registration()
+        self.irc.send("".join(reg.start()))
+        deadline = time.monotonic() + timeout
+        while not reg.done:
+            if time.monotonic() > deadline:
+                raise exceptions.ShangSockError(error=f"No welcome from server after {timeout}s")
+            response = self.irc.receive()
+            if not response:
+                continue
+            logger.debug("Received %s", response)
+            try:
+                message = parser.parse(response)
+            except exceptions.ParseError as inst:
+                logger.warning(inst)
+                continue
+            replies = reg.feed(message)
+            if replies:
+                self.irc.send("".join(replies))
+        self._registered(reg)
+        logger.info("Server authentication completed")
 
-        if default["password"]:
-            logger.debug(f'Sending password, password is {default["password"]}')
-            self.irc.send(f'PASS {default["password"]}\r\n')
-        else:
-            logger.debug("No connection password is set, not using")
+    async def connect_async(self) -> int:
+        """Connect to and register with the IRC server without blocking the loop.
 
-        validnick = False
-        logger.debug(f'Entering nick validation loop, attempting {default["nick"]}')
-        while not validnick:
-            logger.debug(f'Setting nick to {default["nick"]}')
-            self.irc.send(f'NICK {default["nick"]}\r\n')
-            response = self.irc.receive()
-            if response:
-                if re.search(r"\b433", response):
-                    logger.warning(f'Nick in use: {default["nick"]}')
-                    default["nick"] = input("Input a new bot nick: ")
-                    logger.info(f'New nick input: {default["nick"]}')
-                else:
-                    logger.debug(f"Unexpected message {response}, but continuing")
-                    validnick = True
+        Returns:
+            The number of attempts it took
+
+        """
+        logger = logging.getLogger(__name__)
+        while True:
+            try:
+                await self._register_async()
+            except exceptions.ShangSockError as inst:
+                delay = self.backoff.next()
+                logger.warning(
+                    "Connection attempt %s failed, retrying in %.1fs - %s", self.backoff.attempts, delay, inst
+                )
+                await asyncio.sleep(delay)
             else:
-                validnick = True
-                logger.info(f'Server accepted nick: {default["nick"]}')
+                attempts = self.backoff.attempts + 1
+                self.backoff.reset()
+                return attempts
 
-        logger.debug(f'Setting user information, realname {default["realname"]}')
-        self.irc.send(f'USER {default["nick"]} 0 * :{default["realname"]}\r\n')
+    async def _register_async(self) -> None:
+        """Make one attempt to connect to and register with the IRC server.
 
-        success = False
-        while not success:
-            logger.debug(f"Waiting for server to verify auth success...")
-            response = self.irc.receive()
-            logger.debug(f"Received {response}")
-            if response:
-                if re.search(r"\b001", response):
-                    logger.debug(f"Server sent welcome reply, connection complete")
-                    success = True
-                elif re.search(r"\b422", response):
-                    logger.debug("Server sent NOMOTD, but havent received welcome")
-                elif re.search(r"\b376", response):
-                    logger.debug("Server sent ENDOFMOTD, but havent received welcome")
-                else:
-                    logger.debug("Server sent an unexpected message")
+        Raises:
+            ShangSockError: The connection failed, or the server didn't welcome
+                            the bot within register_timeout
+
+        """
+        logger = logging.getLogger(__name__)
+        timeout = self.config[self.network].getfloat("register_timeout", fallback=30)
+
+        await self.irc.connect()
+        logger.info("Transport connected to server, beginning connection protocol")
+        reg = self._registration()
+        self.irc.send("".join(reg.start()))
+
+        async def handshake() -> None:
+            while not reg.done:
+                response = await self.irc.receive()
+                logger.debug("Received %s", response)
+                try:
+                    message = parser.parse(response)
+                except exceptions.ParseError as inst:
+                    logger.warning(inst)
+                    continue
+                replies = reg.feed(message)
+                if replies:
+                    self.irc.send("".join(replies))
+
+        try:
+            await asyncio.wait_for(handshake(), timeout)
+        except asyncio.TimeoutError:
+            raise exceptions.ShangSockError(error=f"No welcome from server after {timeout}s")
+        self._registered(reg)
         logger.info("Server authentication completed")
 
+    def _recovered(self, lost: float, attempts: int) -> None:
+        """Record how long reconnecting took and rejoin the tracked channels.
+
+        Args:
+            lost:     time.monotonic() when the connection was found lost
+            attempts: Connection attempts it took to get back
+
+        Notes:
+            The joins are queued as protocol traffic, so the scheduler paces
+            them under the flood limit along with everything else.
+
+        """
+        self.reconnects += 1
+        self.last_recovery = time.monotonic() - lost
+        logging.getLogger(__name__).warning(
+            "Recovered in %.2fs after %s attempts, rejoining %s channels",
+            self.last_recovery,
+            attempts,
+            len(self.channels),
+        )
+        for channel in sorted(self.channels):
+            self._write(f"JOIN {channel}\r\n", target=channel)
+
+    def run(self) -> None:
+        """Receive and handle messages from the server until the bot quits.
+
+        Notes:
+            A lost connection is reconnected, blocking until it is back.
+
+        """
+        logger = logging.getLogger(__name__)
+        self.resources.start()
+        try:
+            while True:
+                try:
+                    for message in self.irc.receive_lines():
+                        self._handle_safely(message)
+                    while not self._results.empty():
+                        func, args = self._results.get_nowait()
+                        func(*args)
+                    if self._profiling is not None and self._profiling.expired:
+                        self._profiled(self._profiling)
+                    self._pump()
+                    self.irc.flush()
+                except exceptions.ShangSockError as inst:
+                    if self.stopped:
+                        return
+                    logger.warning("Lost connection to server, reconnecting - %s", inst)
+                    lost = time.monotonic()
+                    self._recovered(lost, self.connect())
+        finally:
+            self.irc.close()
+            self._closed()
+
+    async def run_async(self) -> None:
+        """Connect, then read, dispatch and write as concurrent tasks.
+
+        Notes:
+            Reading never waits on a reply being scraped or written, so a slow
+            link lookup only delays its own reply
+            A lost connection is reconnected, output queued meanwhile is sent
+            once it is back
+
+        """
+        logger = logging.getLogger(__name__)
+        try:
+            await self.connect_async()
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            if not self.supervised:
+                self.resources.start()
+            while True:
+                try:
+                    await self._session()
+                    return
+                except exceptions.ShangSockError as inst:
+                    if self.stopped:
+                        return
+                    logger.warning("Lost connection to server, reconnecting - %s", inst)
+                lost = time.monotonic()
+                self._recovered(lost, await self.connect_async())
+        finally:
+            self.irc.disconnect()
+            self._closed()
+
+    def _closed(self) -> None:
+        """Release what the bot holds once it stops running.
+
+        Notes:
+            The shared resources are left to the supervisor, if there is one.
+
+        """
+        if self.irc.recorder is not None:
+            self.irc.recorder.close()
+        if not self.supervised:
+            self.resources.stop()
+
+    async def _session(self) -> None:
+        """Run the reader, dispatcher and writer until one of them stops.
+
+        Raises:
+            ShangSockError: The connection was lost
+
+        """
+        inbound: "asyncio.Queue[str]" = asyncio.Queue()
+        tasks = [
+            asyncio.ensure_future(self._reader(inbound)),
+            asyncio.ensure_future(self._dispatcher(inbound)),
+            asyncio.ensure_future(self._writer()),
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            logging.getLogger(__name__).info("Stopping bot tasks")
+            for task in tasks:
+                task.cancel()
+
+    async def _reader(self, inbound: "asyncio.Queue[str]") -> None:
+        """Move messages from the connection onto the inbound queue."""
+        while True:
+            try:
+                line = await self.irc.receive()
+            except exceptions.ShangSockError:
+                if self.stopped:
+                    return
+                raise
+            await inbound.put(line)
+
+    async def _dispatcher(self, inbound: "asyncio.Queue[str]") -> None:
+        """Handle messages from the inbound queue as they arrive."""
+        while True:
+            self._handle_safely(await inbound.get())
+
+    def _handle_safely(self, response: str) -> None:
+        """Handle a message, logging rather than raising anything unexpected so one message can't stop the bot."""
+        try:
+            self.handle(response)
+        except exceptions.ShangSockError:
+            raise
+        except Exception:
+            logging.getLogger(__name__).exception("Failed to handle %r", response)
+
+    async def _writer(self) -> None:
+        """Write lines as the scheduler releases them, coalescing each batch."""
+        assert self._wakeup is not None
+        while True:
+            self._wakeup.clear()
+            lines = []
+            line = self.scheduler.pop()
+            while line is not None:
+                lines.append(line)
+                line = self.scheduler.pop()
+            if lines:
+                self.irc.send("".join(lines))
+                await self.irc.drain()
+            delay = self.scheduler.delay()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _scanned(self, job: workers.Job, result: Any) -> None:
+        """Hand a finished scrape from a worker thread back to the bot's thread."""
+        self._hand_back(self._reply, job, result)
+
+    def _unscanned(self, channel: str, key: str, job: workers.Job) -> None:
+        """Let a link be answered again once its scrape failed or went stale, from any thread."""
+        self._hand_back(self.recent.discard, channel, key)
+
+    def _hand_back(self, func: Callable[..., None], *args: Any) -> None:
+        """Call func with args on the bot's thread, from a worker thread."""
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(func, *args)
+            except RuntimeError:
+                # The loop closed with the bot, nobody is left to reply to
+                logging.getLogger(__name__).debug("Dropping %s, the bot has stopped", func.__name__)
+        else:
+            self._results.put((func, args))
+            if not self.asyncio:
+                # Don't leave the reply waiting out the receive timeout
+                self.irc.wake()
+
+    def _reply(self, job: workers.Job, result: Any) -> None:
+        """Send a finished scrape to its channel unless it has gone stale."""
+        if job.stale:
+            _REPLY_RESULTS["stale"].inc()
+            if job.on_failure is not None:
+                job.on_failure(job)
+            return
+        _REPLY_RESULTS["sent"].inc()
+        metrics.LINK_REPLY_SECONDS.observe(time.monotonic() - job.submitted)
+        self.send(result, job.channel[len(self._scope) :], priority=scheduler.LINK)
+
+    def handle(self, response: str) -> None:
+        """Act on a single message received from the server.
+
+        Args:
+            response: The raw message, including CRLF
+
+        """
+        logger = logging.getLogger(__name__)
+        logger.debug("Received %s", response)
+        self._messages.inc()
+        start = time.perf_counter()
+        try:
+            message = parser.parse(response)
+        except exceptions.ParseError as inst:
+            logger.warning(inst)
+            return
+        _PARSE.observe(time.perf_counter() - start)
+        handler = self.handlers.get(message.command)
+        if handler is not None:
+            handler(message)
+
+    def on_ping(self, message: parser.Message) -> None:
+        """Answer a server PING to keep the connection alive."""
+        self._write(f"PONG :{message.text}\r\n")
+
+    def on_join(self, message: parser.Message) -> None:
+        """Track joined channels and learn the bot's own prefix from the server echoing its JOIN."""
+        if message.nick != self.nick:
+            return
+        if message.target:
+            self.channels.add(message.target)
+        if message.user and message.host:
+            self.scheduler.overhead = scheduler.prefix_overhead(message.nick, message.user, message.host)
+
+    def on_part(self, message: parser.Message) -> None:
+        """Stop tracking a channel once the server confirms the bot left it."""
+        if message.nick == self.nick and message.target:
+            self.channels.discard(message.target)
+
+    def on_kick(self, message: parser.Message) -> None:
+        """Stop tracking a channel the bot was kicked from, so it isn't rejoined."""
+        if len(message.params) > 1 and message.params[1] == self.nick:
+            self.channels.discard(message.params[0])
+
+    def on_nick(self, message: parser.Message) -> None:
+        """Follow the server changing the bot's nick."""
+        if message.nick == self.nick and message.text:
+            self.nick = message.text
+            self.scheduler.overhead = scheduler.prefix_overhead(self.nick)
+
+    def on_privmsg(self, message: parser.Message) -> None:
+        """Run commands and scan links sent to a channel or the bot."""
+        logger = logging.getLogger(__name__)
+        if message.nick is None or message.ctcp is not None:
+            return
+        channel = message.target
+        if channel == self.nick:
+            channel = message.nick
+        text = message.text
+        prefix = self.config[self.network]["prefix"]
+        if prefix and text.startswith(prefix):
+            try:
+                self.command(message.nick, text[len(prefix) :])
+            except exceptions.ClearanceError as inst:
+                logger.warning(inst)
+            return
+        links: Dict[str, str] = {}
+        for link in _LINKS.findall(text):
+            links.setdefault(cache.normalize_url(link), link)
+        for key, link in links.items():
+            if not self.recent.check(channel, key):
+                logger.info("Already answered %s in %s, skipping", link, channel)
+                _LINK_RESULTS["repeated"].inc()
+                continue
+            job = self.pool.submit(
+                self._scope + channel,
+                self.flights.do,
+                key,
+                scraping.scrape,
+                link,
+                self.apiconf,
+                self.cache,
+                on_result=self._scanned,
+                on_failure=functools.partial(self._unscanned, channel, key),
+            )
+            if job is None:
+                self.recent.discard(channel, key)
+                _LINK_RESULTS["dropped"].inc()
+            else:
+                _LINK_RESULTS["scraped"].inc()
+
+    def command(self, user: str, command: str) -> None:
+        """Run a system command on behalf of a user.
+
+        Args:
+            user:    Nick of the user issuing the command
+            command: The command name followed by any arguments
+
+        Raises:
+            ClearanceError: The user is not the configured owner
+
+        Notes:
+            A command given the wrong arguments is answered with its usage.
+
+        """
+        if not command.split():
+            return
+        name, *args = command.split()
+        if name not in self.syscoms:
+            return
+        owner = self.config[self.network]["owner"]
+        if user != owner:
+            raise exceptions.ClearanceError(user=user, func=name)
+        func = self.syscoms[name]
+        try:
+            inspect.signature(func).bind(*args)
+        except TypeError:
+            params = " ".join(
+                f"[{param.name}]" if param.default is not param.empty else f"<{param.name}>"
+                for param in inspect.signature(func).parameters.values()
+            )
+            self.send(f"[{name}] Usage: {self.config[self.network]['prefix']}{name} {params}".rstrip(), owner)
+            return
+        try:
+            func(*args)
+        except (TypeError, ValueError) as inst:
+            logging.getLogger(__name__).warning("Command %s failed - %s", name, inst)
+            self.send(f"[{name}] {inst}", owner)
+
+    def _write(self, message: str, *, target: str = "", priority: int = scheduler.SYSTEM) -> None:
+        """Queue a raw message with the output scheduler.
+
+        Args:
+            message:  The message, including CRLF
+            target:   Channel or nick the message concerns, if any
+            priority: Scheduler priority, protocol traffic by default
+
+        """
+        self.scheduler.push(message, target=target, priority=priority)
+        self._pump()
+
+    def _pump(self) -> None:
+        """Pass any lines the scheduler will release on towards the socket."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+            return
+        line = self.scheduler.pop()
+        while line is not None:
+            self.irc.send(line)
+            line = self.scheduler.pop()
+
     def join(self, channel: str) -> None:
         """Join channel.
 
@@ -157,8 +754,8 @@ class Bot:
 
         """
         logger = logging.getLogger(__name__)
-        logger.info(f"Joining channel {channel}")
-        self.irc.send(f"JOIN {channel}\r\n")
+        logger.info("Joining channel %s", channel)
+        self._write(f"JOIN {channel}\r\n")
 
     def part(self, channel: str) -> None:
         """Leave channel.
@@ -171,14 +768,19 @@ class Bot:
 
         """
         logger = logging.getLogger(__name__)
-        logger.info(f"Leaving channel {channel}")
-        self.irc.send(f"PART {channel}\r\n")
+        logger.info("Leaving channel %s", channel)
+        self.pool.cancel(self._scope + channel)
+        self.scheduler.drop(channel)
+        self.recent.forget(channel)
+        self._write(f"PART {channel}\r\n")
 
     def quit(self) -> None:
         """Quit server and stop bot.
 
         Notes:
-            This does not automatically leave any currently joined channels
+            This does not automatically leave any currently joined channels.
+            Under a supervisor only this network's connection ends, leaving the
+            shared resources and other networks running.
 
         Todo:
             Specification includes quit message
@@ -186,19 +788,104 @@ class Bot:
         """
         logger = logging.getLogger(__name__)
         logger.info("Quitting server")
+        self.stopped = True
         self.irc.send("QUIT\r\n")
         self.irc.disconnect()
+        if self.supervised:
+            return
         logger.info("Halting execution")
         exit()
 
-    def send(self, message: str, channel: str) -> None:
+    def stats(self) -> None:
+        """Message the owner the worker pool, link, connection, cache, HTTP pool, failure and parsing counters."""
+        sections = {
+            "workers": self.pool.stats(),
+            "http": self.http.stats(),
+            "failures": self.http.failures.stats(),
+            "links": {**self.flights.stats(), "suppressed": self.recent.suppressed},
+            "connection": {
+                "channels": len(self.channels),
+                "reconnects": self.reconnects,
+                "last_recovery": "none" if self.last_recovery is None else f"{self.last_recovery:.2f}s",
+            },
+        }
+        if self.cache is not None:
+            sections["cache"] = self.cache.stats()
+        if self.parsers is not None:
+            sections["parsing"] = self.parsers.stats()
+        for name, stats in sections.items():
+            counters = ", ".join(f"{key}: {value}" for key, value in stats.items())
+            self.send(f"[{name}] {counters}", self.config[self.network]["owner"])
+
+    def hosts(self, host: Optional[str] = None) -> None:
+        """Message the owner the circuit state of failing hosts.
+
+        Args:
+            host: Only report this host, every failing host if not given
+
+        """
+        owner = self.config[self.network]["owner"]
+        states = self.http.failures.hosts()
+        if host is not None:
+            states = {host: states.get(host, "closed, no recent failures")}
+        if not states:
+            self.send("[hosts] No failing hosts", owner)
+        for name, state in states.items():
+            self.send(f"[hosts] {name}: {state}", owner)
+
+    def profile(self, kind: str = "sample", seconds: str = "30") -> None:
+        """Profile the running bot for a while, or end the current run early.
+
+        Args:
+            kind:    cprofile, sample, or stop to end the current run
+            seconds: How long to profile for
+
+        Notes:
+            Results and the top allocations made meanwhile are written to
+            profile_dir, and the owner is messaged the file names once done.
+            See the profiling module for the kinds of run.
+
+        """
+        owner = self.config[self.network]["owner"]
+        if kind == "stop":
+            if self._profiling is None:
+                self.send("[profile] Nothing to stop", owner)
+            else:
+                self._profiled(self._profiling)
+            return
+        try:
+            run = profiling.start(
+                kind,
+                float(seconds),
+                directory=self.config[self.network].get("profile_dir", "logs"),
+                label=self._scope.rstrip("/"),
+            )
+        except (ValueError, RuntimeError) as inst:
+            self.send(f"[profile] {inst}", owner)
+            return
+        self._profiling = run
+        if self._loop is not None:
+            self._loop.call_later(run.seconds, self._profiled, run)
+        self.send(f"[profile] Started {kind} profiling for {run.seconds:g}s", owner)
+
+    def _profiled(self, run: profiling.ProfileRun) -> None:
+        """Finish a profiling run, unless it was already stopped, and tell the owner where its results are."""
+        if self._profiling is not run:
+            return
+        self._profiling = None
+        paths = profiling.finish(run)
+        self.send(f"[profile] Wrote {', '.join(paths)}", self.config[self.network]["owner"])
+
+    def send(self, message: str, channel: str, *, priority: int = scheduler.COMMAND) -> None:
         """Send message to channel.
 
         Args:
-            message: Message to be sent
-            channel: Channel to send message to
+            message:  Message to be sent, split over several lines if needed
+            channel:  Channel to send message to
+            priority: Scheduler priority, see the scheduler module
 
         """
         logger = logging.getLogger(__name__)
-        logger.debug(f"Sending {message} to {channel}")
-        self.irc.send(f"PRIVMSG {channel} :{message}\r\n")
+        logger.debug("Sending %s to %s", message, channel)
+        self.scheduler.message(message, channel, priority=priority)
+        self._pump()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Runs the bot on several networks from one config.
+
+Every section of the main config is a network, inheriting anything it doesn't
+set from DEFAULT. The networks either all run in one process, sharing the
+HTTP pool, scrape cache and workers, or are split across worker processes
+that are restarted if they die or stop responding.
+
+"""
+
+import asyncio
+import configparser
+import logging
+import logging.config
+import multiprocessing
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from . import logpipe
+from .shanghai import Bot, Resources
+
+
+class Supervisor:
+    """Keeps a Bot connected for each configured network."""
+
+    def __init__(
+        self,
+        config: str = "config/shanghai.ini",
+        chancoms: str = "config/commands.ini",
+        apis: str = "config/apis.ini",
+        *,
+        networks: Optional[List[str]] = None,
+        shard: Optional[int] = None,
+    ):
+        """Initialize supervisor.
+
+        Args:
+            config:   Bot specific config file path
+            chancoms: Channel commands config file path
+            apis:     API config file path
+            networks: Sections to run, every section if not given, or DEFAULT
+                      alone if there are none
+            shard:    Number of the worker process this runs in, if any, which
+                      moves its metrics to their own port and textfile
+
+        """
+        self.paths = (config, chancoms, apis)
+        self.config = configparser.ConfigParser()
+        with open(config) as conffile:
+            self.config.read_file(conffile)
+        self.networks = networks or self.config.sections() or [configparser.DEFAULTSECT]
+        default = self.config[configparser.DEFAULTSECT]
+        self.shards = default.getint("shards", fallback=0)
+        self.restart_delay = default.getfloat("restart_delay", fallback=5)
+        self.max_restart_delay = default.getfloat("max_restart_delay", fallback=300)
+        self.health_timeout = default.getfloat("health_timeout", fallback=30)
+        self.bots: Dict[str, Bot] = {}
+        if shard is not None:
+            _separate_metrics(default, shard)
+
+    def run(self) -> None:
+        """Run every network, across worker processes if shards is above 1."""
+        if self.shards > 1 and len(self.networks) > 1:
+            self.run_sharded(self.shards)
+        else:
+            asyncio.run(self.run_async())
+
+    async def run_async(self, heartbeat: Any = None) -> None:
+        """Run every network in this process until all of them have quit.
+
+        Args:
+            heartbeat: Shared value to store time.time() in every second, so a
+                       parent process can tell the event loop is still running
+
+        """
+        logger = logging.getLogger(__name__)
+        resources = Resources(self.config[configparser.DEFAULTSECT])
+        resources.start()
+        beat = asyncio.ensure_future(self._beat(heartbeat)) if heartbeat is not None else None
+        logger.info("Supervising networks %s", ", ".join(self.networks))
+        try:
+            await asyncio.gather(*(self._keep(network, resources) for network in self.networks))
+        finally:
+            if beat is not None:
+                beat.cancel()
+            resources.stop()
+
+    async def _keep(self, network: str, resources: Resources) -> None:
+        """Run a network's bot, restarting it with growing delays until it quits."""
+        logger = logging.getLogger(__name__)
+        delay = self.restart_delay
+        while True:
+            started = time.monotonic()
+            try:
+                bot = Bot(*self.paths, network=network, resources=resources)
+                self.bots[network] = bot
+                await bot.run_async()
+            except Exception as inst:
+                logger.error("Bot for %s stopped", network, exc_info=inst)
+            else:
+                if bot.stopped:
+                    logger.info("Bot for %s quit", network)
+                    del self.bots[network]
+                    return
+            if time.monotonic() - started > self.max_restart_delay:
+                # It ran long enough that this is a fresh failure, not a crash loop
+                delay = self.restart_delay
+            logger.warning("Restarting bot for %s in %.0fs", network, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_restart_delay)
+
+    @staticmethod
+    async def _beat(heartbeat: Any) -> None:
+        """Store the time in heartbeat every second."""
+        while True:
+            heartbeat.value = time.time()
+            await asyncio.sleep(1)
+
+    def run_sharded(self, shards: int) -> None:
+        """Split the networks across worker processes and keep them running.
+
+        Args:
+            shards: Number of worker processes
+
+        Notes:
+            A worker that exits with an error, or whose heartbeat stops for
+            health_timeout seconds, is killed and started again after a delay
+            that doubles while it keeps failing. One that exits cleanly, every
+            network in it having quit, is left stopped.
+            Workers send their log records to this process, which alone
+            writes the log files.
+            Each worker publishes its own metrics, the Nth (from 0) serving
+            them on metrics_port + N and writing metrics_textfile with -N added
+            to its name.
+
+        """
+        context = multiprocessing.get_context("spawn")
+        groups = [self.networks[i::shards] for i in range(shards) if self.networks[i::shards]]
+        shard_list = [_Shard(index, group, self.restart_delay) for index, group in enumerate(groups)]
+        records = context.Queue()
+        listener = logpipe.serve(records)
+        try:
+            self._watch(context, shard_list, records)
+        finally:
+            listener.stop()
+
+    def _watch(self, context: Any, shard_list: List["_Shard"], records: Any) -> None:
+        """Start the shards, then restart any that die or hang until all have finished."""
+        logger = logging.getLogger(__name__)
+        for shard in shard_list:
+            shard.start(context, self.paths, records)
+        while shard_list:
+            time.sleep(1)
+            now = time.time()
+            for shard in list(shard_list):
+                if shard.process is None:
+                    if now >= shard.restart_at:
+                        shard.start(context, self.paths, records)
+                    continue
+                if shard.process.is_alive() and now - shard.heartbeat.value <= self.health_timeout:
+                    continue
+                if shard.process.is_alive():
+                    logger.error("Shard %s stopped responding, killing it", shard.name)
+                    shard.process.kill()
+                shard.process.join()
+                if shard.process.exitcode == 0:
+                    logger.info("Shard %s finished", shard.name)
+                    shard_list.remove(shard)
+                    continue
+                if now - shard.started > self.max_restart_delay:
+                    shard.delay = self.restart_delay
+                logger.warning(
+                    "Shard %s exited with %s, restarting in %.0fs", shard.name, shard.process.exitcode, shard.delay
+                )
+                shard.process = None
+                shard.restart_at = now + shard.delay
+                shard.delay = min(shard.delay * 2, self.max_restart_delay)
+
+
+class _Shard:
+    """A worker process running some of the networks."""
+
+    def __init__(self, index: int, networks: List[str], delay: float):
+        """Initialize shard, not yet started."""
+        self.index = index
+        self.networks = networks
+        self.name = ",".join(networks)
+        self.delay = delay
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.heartbeat: Any = None
+        self.started = 0.0
+        self.restart_at = 0.0
+
+    def start(self, context: Any, paths: tuple, records: Any) -> None:
+        """Launch the worker process, logging through the records queue."""
+        self.started = time.time()
+        # Give a fresh process until the timeout to start beating
+        self.heartbeat = context.Value("d", self.started, lock=False)
+        self.process = context.Process(
+            target=_run_shard,
+            args=(paths, self.networks, self.index, self.heartbeat, records),
+            name=f"shanghai-{self.name}",
+        )
+        self.process.start()
+        logging.getLogger(__name__).info("Started shard %s as process %s", self.name, self.process.pid)
+
+
+def _separate_metrics(conf: configparser.SectionProxy, shard: int) -> None:
+    """Point a worker process's metrics at a port and textfile of its own."""
+    port = conf.getint("metrics_port", fallback=0)
+    if port:
+        conf["metrics_port"] = str(port + shard)
+    textfile = conf.get("metrics_textfile", "")
+    if textfile:
+        stem, ext = os.path.splitext(textfile)
+        conf["metrics_textfile"] = f"{stem}-{shard}{ext}"
+
+
+def _run_shard(paths: tuple, networks: List[str], shard: int, heartbeat: Any, records: Any) -> None:
+    """Run some networks in a worker process, forwarding its logging to the parent."""
+    logging_config = os.path.join(os.path.dirname(paths[0]), "logging.ini")
+    if os.path.isfile(logging_config):
+        logging.config.fileConfig(logging_config, disable_existing_loggers=False)
+        logpipe.forward(records)
+        logpipe.install(logging_config)
+    asyncio.run(Supervisor(*paths, networks=networks, shard=shard).run_async(heartbeat))
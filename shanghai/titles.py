@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Streaming page title extraction.
+
+Reads only as much of a page as it takes to find its title, instead of
+downloading the whole body and building a full document tree.
+
+"""
+
+import codecs
+from html.parser import HTMLParser
+import re
+from typing import Iterable, List, Optional, Tuple
+
+from bs4 import BeautifulSoup  # type: ignore
+
+
+_META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?([\w.:-]+)""", re.IGNORECASE)
+
+_OG_TITLES = ("og:title", "twitter:title")
+
+_max_bytes = 256 * 1024
+
+
+def configure(*, max_bytes: int) -> None:
+    """Set how much of a page is read looking for its title.
+
+    Args:
+        max_bytes: Most body bytes to read from a single page
+
+    """
+    global _max_bytes
+    _max_bytes = max_bytes
+
+
+def sniff_encoding(head: bytes, declared: Optional[str]) -> str:
+    """Pick the encoding to decode a page with.
+
+    Args:
+        head:     The first bytes of the page
+        declared: Charset from the Content-Type header, if it had one
+
+    Returns:
+        The declared charset, else a <meta> charset, else UTF-8
+
+    """
+    for candidate in (declared, *(m.decode("ascii") for m in _META_CHARSET.findall(head[:4096])[:1])):
+        if candidate:
+            try:
+                return codecs.lookup(candidate).name
+            except LookupError:
+                pass
+    return "utf-8"
+
+
+class _TitleParser(HTMLParser):
+    """Collects the <title> text and OpenGraph title of a page."""
+
+    def __init__(self) -> None:
+        """Initialize parser state."""
+        super().__init__(convert_charrefs=True)
+        self.title: List[str] = []
+        self.og_title: Optional[str] = None
+        self.in_title = False
+        self.done = False
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        """Note the start of the title, OpenGraph titles and the end of the head."""
+        if tag == "title" and not self.done:
+            self.in_title = True
+        elif tag == "meta" and self.og_title is None:
+            values = dict(attrs)
+            if (values.get("property") or values.get("name") or "").lower() in _OG_TITLES and values.get("content"):
+                self.og_title = values["content"]
+        elif tag == "body":
+            # Anything titled <title> past this point belongs to an svg or similar
+            self.done = True
+
+    def handle_endtag(self, tag: str) -> None:
+        """Finish once the title or the head closes."""
+        if tag == "title" and self.in_title:
+            self.in_title = False
+            self.done = True
+        elif tag == "head":
+            self.done = True
+
+    def handle_data(self, data: str) -> None:
+        """Collect text inside the title."""
+        if self.in_title:
+            self.title.append(data)
+
+
+class TitleExtractor:
+    """Incrementally find a page's title from chunks of its body."""
+
+    def __init__(self, *, declared: Optional[str] = None, max_bytes: Optional[int] = None):
+        """Initialize extractor.
+
+        Args:
+            declared:  Charset from the Content-Type header, if it had one
+            max_bytes: Most bytes to read, the configured limit if not given
+
+        """
+        self.declared = declared
+        self.max_bytes = _max_bytes if max_bytes is None else max_bytes
+        self.bytes_read = 0
+        self._parser = _TitleParser()
+        self._decoder: Optional[codecs.IncrementalDecoder] = None
+        self._head = bytearray()
+
+    @property
+    def done(self) -> bool:
+        """Whether no more input is needed, either a title was found or the limit reached."""
+        return self._parser.done or self.bytes_read >= self.max_bytes
+
+    def feed(self, chunk: bytes) -> bool:
+        """Parse the next chunk of the body.
+
+        Args:
+            chunk: The next bytes of the body
+
+        Returns:
+            Whether no more input is needed
+
+        """
+        chunk = chunk[: self.max_bytes - self.bytes_read]
+        self.bytes_read += len(chunk)
+        self._head += chunk
+        if self._decoder is not None:
+            self._parser.feed(self._decoder.decode(chunk))
+        elif len(self._head) >= 1024 or self.done:
+            # Only decode once there is enough of the page to find a <meta> charset
+            self._start()
+        return self.done
+
+    def _start(self) -> None:
+        """Pick the encoding and parse everything held back so far."""
+        self._decoder = codecs.getincrementaldecoder(sniff_encoding(bytes(self._head), self.declared))("replace")
+        self._parser.feed(self._decoder.decode(bytes(self._head)))
+
+    def title(self) -> Optional[str]:
+        """Return the title found, falling back to a full parse if needed.
+
+        Returns:
+            The <title> text, else the OpenGraph title, else whatever title
+            BeautifulSoup finds in the bytes read, else None
+
+        """
+        if self._decoder is None:
+            self._start()
+        if not self._parser.done:
+            assert self._decoder is not None
+            self._parser.feed(self._decoder.decode(b"", final=True))
+            self._parser.close()
+        text = " ".join("".join(self._parser.title).split())
+        if text:
+            return text
+        if self._parser.og_title:
+            return " ".join(self._parser.og_title.split())
+        tag = BeautifulSoup(bytes(self._head), "html.parser").title
+        if tag is not None and tag.string:
+            return " ".join(tag.string.split()) or None
+        return None
+
+    @classmethod
+    def from_chunks(
+        cls, chunks: Iterable[bytes], *, declared: Optional[str] = None, max_bytes: Optional[int] = None
+    ) -> "TitleExtractor":
+        """Feed chunks to a new extractor until it has what it needs.
+
+        Args:
+            chunks:    The body, in chunks
+            declared:  Charset from the Content-Type header, if it had one
+            max_bytes: Most bytes to read, the configured limit if not given
+
+        Returns:
+            The extractor, ready for title to be called
+
+        """
+        extractor = cls(declared=declared, max_bytes=max_bytes)
+        for chunk in chunks:
+            if extractor.feed(chunk):
+                break
+        return extractor
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Worker pool running link scrapes away from the IRC read loop."""
+
+from collections import defaultdict, deque
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+
+class Job:
+    """A unit of work submitted to a WorkerPool."""
+
+    __slots__ = ("func", "args", "channel", "seq", "on_result", "on_failure", "submitted", "deadline", "cancelled")
+
+    def __init__(
+        self,
+        func: Callable[..., Any],
+        args: tuple,
+        channel: str,
+        deadline: float,
+        seq: int = 0,
+        on_result: Optional[Callable[["Job", Any], None]] = None,
+        on_failure: Optional[Callable[["Job"], None]] = None,
+    ):
+        """Initialize job.
+
+        Args:
+            func:      Function to call
+            args:      Positional arguments for func
+            channel:   Channel the result will be sent to
+            deadline:  time.monotonic() after which the result is stale
+            seq:       Position of the job among its channel's submissions
+            on_result:  Called with the job and its result instead of the pool's
+                        on_result, if given
+            on_failure: Called with the job if it fails, goes stale or is
+                        cancelled, so nothing is delivered for it
+
+        """
+        self.func = func
+        self.args = args
+        self.channel = channel
+        self.seq = seq
+        self.on_result = on_result
+        self.on_failure = on_failure
+        self.submitted = time.monotonic()
+        self.deadline = deadline
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        """Stop the job from running, or its result from being delivered."""
+        self.cancelled = True
+
+    @property
+    def stale(self) -> bool:
+        """Whether the job was cancelled or has passed its deadline."""
+        return self.cancelled or time.monotonic() > self.deadline
+
+
+class WorkerPool:
+    """Bounded pool of threads with per-channel concurrency limits."""
+
+    def __init__(
+        self,
+        on_result: Optional[Callable[[Job, Any], None]],
+        *,
+        workers: int = 4,
+        max_queue: int = 100,
+        per_channel: int = 2,
+        deadline: float = 30.0,
+    ):
+        """Initialize pool, call start to launch its threads.
+
+        Args:
+            on_result:   Called from a worker thread with each finished job and
+                         its result, must be thread safe and not block. A
+                         channel's results are passed on in submission order.
+                         None if every job brings its own
+            workers:     Number of worker threads
+            max_queue:   Most jobs waiting to run before submissions are refused
+            per_channel: Most jobs from one channel running at once
+            deadline:    Seconds after submission a result is still wanted
+
+        """
+        self.on_result = on_result
+        self.workers = workers
+        self.max_queue = max_queue
+        self.per_channel = per_channel
+        self.deadline = deadline
+
+        self._queue: "queue.Queue[Optional[Job]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._running: Dict[str, int] = defaultdict(int)
+        self._waiting: Dict[str, Deque[Job]] = defaultdict(deque)
+        self._submitted: Dict[str, int] = defaultdict(int)
+        self._delivered: Dict[str, int] = defaultdict(int)
+        self._finished: Dict[str, Dict[int, Tuple[Job, Any, bool]]] = defaultdict(dict)
+        self._delivery = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._active = 0
+        self._busy = 0.0
+        self._started = 0.0
+        self.completed = 0
+        self.dropped = 0
+        self.expired = 0
+
+    def start(self) -> None:
+        """Launch the worker threads."""
+        self._started = time.monotonic()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"shanghai-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        """Cancel everything waiting and stop the workers once they are idle."""
+        self.cancel()
+        for _ in self._threads:
+            self._queue.put(None)
+        self._threads = []
+
+    def depth(self) -> int:
+        """Return the number of jobs waiting to run."""
+        with self._lock:
+            return self._queue.qsize() + sum(len(jobs) for jobs in self._waiting.values())
+
+    def submit(
+        self,
+        channel: str,
+        func: Callable[..., Any],
+        *args: Any,
+        on_result: Optional[Callable[[Job, Any], None]] = None,
+        on_failure: Optional[Callable[[Job], None]] = None,
+    ) -> Optional[Job]:
+        """Queue a call to func for a channel.
+
+        Args:
+            channel:   Channel the result is for
+            func:      Function to call on a worker thread
+            *args:     Positional arguments for func
+            on_result:  Called with the job and its result in place of the
+                        pool's on_result, so pools can be shared
+            on_failure: Called from a worker thread with the job if no result
+                        is delivered for it, must be thread safe and not block
+
+        Returns:
+            The queued Job, or None if the pool is at capacity
+
+        """
+        if self.depth() >= self.max_queue:
+            logging.getLogger(__name__).warning("Worker queue full, dropping job for %s", channel)
+            self.dropped += 1
+            return None
+        with self._lock:
+            deadline = time.monotonic() + self.deadline
+            job = Job(func, args, channel, deadline, self._submitted[channel], on_result, on_failure)
+            self._submitted[channel] += 1
+            if self._running[channel] < self.per_channel:
+                self._running[channel] += 1
+                self._queue.put(job)
+            else:
+                self._waiting[channel].append(job)
+        return job
+
+    def cancel(self, channel: Optional[str] = None) -> None:
+        """Cancel waiting jobs, for one channel or all of them.
+
+        Args:
+            channel: The channel to cancel jobs for, or None for every channel
+
+        Notes:
+            Jobs already running finish, but their results are discarded.
+
+        """
+        with self._lock:
+            channels = list(self._waiting) if channel is None else [channel]
+            cancelled = []
+            for name in channels:
+                for job in self._waiting.pop(name, ()):
+                    job.cancel()
+                    cancelled.append(job)
+        # Jobs that never run still have to be accounted for, or later results wait on them
+        for job in cancelled:
+            self._finish(job, None, False)
+        with self._queue.mutex:
+            for job in self._queue.queue:
+                if job is not None and (channel is None or job.channel == channel):
+                    job.cancel()
+
+    def stats(self) -> Dict[str, float]:
+        """Return counters for sizing the pool.
+
+        Returns:
+            Queue depth, active and total workers, utilization as the fraction
+            of worker time spent busy since start, and job outcome counts
+
+        """
+        elapsed = max(time.monotonic() - self._started, 1e-9) * max(self.workers, 1)
+        return {
+            "queued": self.depth(),
+            "active": self._active,
+            "workers": self.workers,
+            "utilization": round(self._busy / elapsed, 4),
+            "completed": self.completed,
+            "dropped": self.dropped,
+            "expired": self.expired,
+        }
+
+    def _work(self) -> None:
+        """Run jobs from the queue until told to stop."""
+        logger = logging.getLogger(__name__)
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            result = None
+            ok = False
+            try:
+                if job.stale:
+                    with self._lock:
+                        self.expired += 1
+                    continue
+                with self._lock:
+                    self._active += 1
+                start = time.monotonic()
+                try:
+                    result = job.func(*job.args)
+                except Exception as inst:
+                    logger.error("Job for %s failed", job.channel, exc_info=inst)
+                    continue
+                finally:
+                    with self._lock:
+                        self._active -= 1
+                        self._busy += time.monotonic() - start
+                ok = True
+            finally:
+                self._release(job.channel)
+                self._finish(job, result, ok)
+
+    def _finish(self, job: Job, result: Any, ok: bool) -> None:
+        """Record a job as done, passing on every result now due in its channel.
+
+        Args:
+            job:    The finished job
+            result: What it returned
+            ok:     Whether it ran and returned a result
+
+        Notes:
+            A result that finishes ahead of earlier jobs in its channel is
+            held until they are done, and whether it went stale is judged
+            when it is passed on.
+
+        """
+        with self._delivery:
+            with self._lock:
+                finished = self._finished[job.channel]
+                finished[job.seq] = (job, result, ok)
+                due = []
+                while self._delivered[job.channel] in finished:
+                    due.append(finished.pop(self._delivered[job.channel]))
+                    self._delivered[job.channel] += 1
+                if not finished and self._delivered[job.channel] == self._submitted[job.channel]:
+                    del self._finished[job.channel], self._delivered[job.channel], self._submitted[job.channel]
+                for done, _, ran in due:
+                    if not ran:
+                        continue
+                    if done.stale:
+                        self.expired += 1
+                    else:
+                        self.completed += 1
+            for done, value, ran in due:
+                if ran and not done.stale:
+                    deliver = done.on_result or self.on_result
+                    if deliver is not None:
+                        deliver(done, value)
+                elif done.on_failure is not None:
+                    done.on_failure(done)
+
+    def _release(self, channel: str) -> None:
+        """Free a channel's slot, handing it to its next waiting job."""
+        with self._lock:
+            waiting = self._waiting.get(channel)
+            if waiting:
+                self._queue.put(waiting.popleft())
+                if not waiting:
+                    del self._waiting[channel]
+            else:
+                self._running[channel] -= 1
+                if not self._running[channel]:
+                    del self._running[channel]